@@ -1,27 +1,44 @@
-from analysis.corrections.tau import TauCorrector
-from analysis.corrections.btag import BTagCorrector
-from analysis.corrections.muon import MuonCorrector
-from analysis.corrections.top_pt import add_top_pt_weight
-from analysis.corrections.lhepdf import add_lhepdf_weight
-from analysis.corrections.pileup import add_pileup_weight
-from analysis.corrections.jec import apply_jet_corrections
-from analysis.corrections.isr_weight import add_isr_weight
-from analysis.corrections.jerc import apply_jerc_corrections
-from analysis.corrections.electron import ElectronCorrector
-from analysis.corrections.pujetid import add_pujetid_weight
-from analysis.corrections.lhescale import add_scalevar_weight
-from analysis.corrections.met import apply_met_phi_corrections
-from analysis.corrections.top_boost import add_top_boost_weight
-from analysis.corrections.muon_highpt import MuonHighPtCorrector
-from analysis.corrections.l1prefiring import add_l1prefiring_weight
-from analysis.corrections.partonshower import add_partonshower_weight
-from analysis.corrections.electron_ss import apply_electron_ss_corrections
-from analysis.corrections.tau_energy import apply_tau_energy_scale_corrections
-from analysis.corrections.rochester import (
-    apply_rochester_corrections_run2,
-    apply_rochester_corrections_run3,
-)
-from analysis.corrections.corrections_manager import (
-    object_corrector_manager,
-    weight_manager,
-)
+import importlib
+
+# the correctors are imported on first use (PEP 562): a worker only pays the import cost
+# (scipy, coffea jetmet_tools and lookup_tools, cloudpickle, ...) of the corrections it applies
+_LAZY_ATTRIBUTES = {
+    "TauCorrector": "analysis.corrections.tau",
+    "BTagCorrector": "analysis.corrections.btag",
+    "MuonCorrector": "analysis.corrections.muon",
+    "add_top_pt_weight": "analysis.corrections.top_pt",
+    "add_lhepdf_weight": "analysis.corrections.lhepdf",
+    "add_pileup_weight": "analysis.corrections.pileup",
+    "apply_jet_corrections": "analysis.corrections.jec",
+    "add_isr_weight": "analysis.corrections.isr_weight",
+    "apply_jerc_corrections": "analysis.corrections.jerc",
+    "ElectronCorrector": "analysis.corrections.electron",
+    "add_pujetid_weight": "analysis.corrections.pujetid",
+    "add_scalevar_weight": "analysis.corrections.lhescale",
+    "METPropagator": "analysis.corrections.met",
+    "apply_met_phi_corrections": "analysis.corrections.met",
+    "add_top_boost_weight": "analysis.corrections.top_boost",
+    "MuonHighPtCorrector": "analysis.corrections.muon_highpt",
+    "add_l1prefiring_weight": "analysis.corrections.l1prefiring",
+    "add_partonshower_weight": "analysis.corrections.partonshower",
+    "apply_electron_ss_corrections": "analysis.corrections.electron_ss",
+    "apply_tau_energy_scale_corrections": "analysis.corrections.tau_energy",
+    "apply_rochester_corrections_run2": "analysis.corrections.rochester",
+    "apply_rochester_corrections_run3": "analysis.corrections.rochester",
+    "object_corrector_manager": "analysis.corrections.corrections_manager",
+    "weight_manager": "analysis.corrections.corrections_manager",
+}
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    # cache it, so __getattr__ is only called once per attribute
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
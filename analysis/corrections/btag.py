@@ -1,16 +1,64 @@
-import re
-import json
-import glob
 import pathlib
 import correctionlib
 import numpy as np
 import awkward as ak
-import importlib.resources
 from coffea import util
 from typing import Type
+from functools import lru_cache
 from coffea.analysis_tools import Weights
-from analysis.corrections.utils import get_pog_json
-from analysis.working_points.utils import get_btag_mask
+from analysis.corrections.utils import get_pog_json, evaluate_sf_variations
+from analysis.working_points.utils import get_btag_mask, get_btag_tagger
+
+
+@lru_cache(maxsize=None)
+def get_btag_cset(year: str):
+    """load (once per process) the b-tagging scale factors correction set"""
+    return correctionlib.CorrectionSet.from_file(
+        get_pog_json(json_name="btag", year=year)
+    )
+
+
+@lru_cache(maxsize=None)
+def get_btag_efficiency_lookup(
+    workflow: str, worging_point: str, category: str, year: str
+):
+    """
+    load (once per process) the MC b-tagging efficiency lookup: efficiency(pt, |eta|, flavor)
+
+    correctionlib JSONs (built with analysis/data/scripts/build_btag_efficiencies.py) are
+    preferred over the coffea dense_lookup pickles
+
+    Parameters:
+    -----------
+        workflow:
+            workflow name
+        worging_point:
+            worging point {loose, medium, tight}
+        category:
+            category name
+        year:
+            dataset year {2016preVFP, 2016postVFP, 2017, 2018, 2022preEE, 2022postEE, 2023preBPix, 2023postBPix}
+    """
+    # check available btag efficiencies (btag_eff_<tagger>_<wp>_<category>_<year>)
+    btag_eff_name_map = {
+        "2b1mu": "btag_eff_mu",
+        "1b1mu": "btag_eff_mu",
+        "2b1e": "btag_eff_ele",
+        "1b1e": "btag_eff_ele",
+    }
+    btag_eff_name = (
+        btag_eff_name_map.get(workflow, f"btag_eff_{workflow}")
+        + f"_{worging_point}_{category}_{year}"
+    )
+    btag_eff_dir = pathlib.Path().cwd() / "analysis" / "data" / "btag_efficiencies"
+    btag_eff_json = btag_eff_dir / f"{btag_eff_name}.json.gz"
+    btag_eff_coffea = btag_eff_dir / f"{btag_eff_name}.coffea"
+    if btag_eff_json.exists():
+        cset = correctionlib.CorrectionSet.from_file(str(btag_eff_json))
+        return cset[btag_eff_name].evaluate
+    if btag_eff_coffea.exists():
+        return util.load(str(btag_eff_coffea))
+    raise ValueError(f"There is no b-tagging efficiency file '{btag_eff_name}'")
 
 
 class BTagCorrector:
@@ -63,7 +111,7 @@ class BTagCorrector:
         self._variation = variation
 
         self._nano_version = "9" if year.startswith("201") else "12"
-        self._tagger = "deepJet" if self._nano_version == "9" else "particleNet"
+        self._tagger = get_btag_tagger(year)
 
         # check available btag SFs
         self._working_point_map = {"tight": "T", "medium": "M", "loose": "L"}
@@ -71,49 +119,31 @@ class BTagCorrector:
             raise ValueError(
                 f"There are no available b-tag SFs for the working point. Please specify {list(self._working_point_map.keys())}"
             )
-        # check available btag efficiencies (btag_eff_<tagger>_<wp>_<year>.coffea)
-        btag_eff_name_map = {
-            "2b1mu": "btag_eff_mu",
-            "1b1mu": "btag_eff_mu",
-            "2b1e": "btag_eff_ele",
-            "1b1e": "btag_eff_ele",
-        }
-        btag_eff_name = (
-            btag_eff_name_map.get(workflow, f"btag_eff_{workflow}")
-            + f"_{self._wp}_{category}_{self._year}.coffea"
-        )
-        btag_eff_file = (
-            pathlib.Path().cwd()
-            / "analysis"
-            / "data"
-            / "btag_efficiencies"
-            / btag_eff_name
-        )
-        if not btag_eff_file.exists():
-            raise ValueError(f"There is no b-tagging efficiency file '{btag_eff_name}'")
-
-        # load efficiency lookup table (only for deepJet)
-        # efflookup(pt, |eta|, flavor)
-        with importlib.resources.path(
-            "analysis.data.btag_efficiencies", btag_eff_name
-        ) as filename:
-            self._efflookup = util.load(str(filename))
-
-        # define correction set
-        self._cset = correctionlib.CorrectionSet.from_file(
-            get_pog_json(json_name="btag", year=year)
+        # load efficiency lookup table and correction set (cached per process)
+        self._efflookup = get_btag_efficiency_lookup(
+            workflow, self._wp, category, self._year
         )
+        self._cset = get_btag_cset(self._year)
 
-        # select bc and light jets
+        # until correctionlib handles jagged data natively we have to flatten and unflatten.
+        # flatten selected jets once and split them into bc and light jets
         # hadron flavor definition: 5=b, 4=c, 0=udsg
-        self._bc_jets = events.selected_jets[events.selected_jets.hadronFlavour >= 4]
-        self._light_jets = events.selected_jets[events.selected_jets.hadronFlavour == 0]
-        self._jet_map = {"bc": self._bc_jets, "light": self._light_jets}
-
-        self._jet_pass_btag = {
-            "bc": get_btag_mask(self._jet_map["bc"], self._year, self._wp),
-            "light": get_btag_mask(self._jet_map["light"], self._year, self._wp),
+        jets = events.selected_jets
+        flat_jets = ak.flatten(jets)
+        flavor_masks = {
+            "bc": jets.hadronFlavour >= 4,
+            "light": jets.hadronFlavour == 0,
         }
+        self._jet_map = {}
+        self._n_jets = {}
+        self._jet_pass_btag = {}
+        for flavor, flavor_mask in flavor_masks.items():
+            flavor_jets = flat_jets[ak.flatten(flavor_mask)]
+            self._jet_map[flavor] = flavor_jets
+            self._n_jets[flavor] = ak.sum(flavor_mask, axis=1)
+            self._jet_pass_btag[flavor] = ak.to_numpy(
+                get_btag_mask(flavor_jets, self._year, self._wp)
+            )
         self.var_naming_map = {
             "bc": "CMS_btag_heavy",
             "light": "CMS_btag_light",
@@ -128,72 +158,44 @@ class BTagCorrector:
             flavor:
                 hadron flavor {'bc', 'light'}
         """
-        # efficiencies
-        eff = self.efficiency(flavor=flavor)
-
-        # mask with events that pass the btag working point
-        passbtag = self._jet_pass_btag[flavor]
-
-        # nominal scale factors
-        btag_sf = self.get_scale_factors(flavor=flavor, syst="central")
-
-        # nominal weights
-        btag_weight = self.get_btag_weight(eff, btag_sf, passbtag)
+        # nominal and systematics scale factors are evaluated in one go
+        systs = ["central"]
+        if self._variation == "nominal":
+            if not self._full_run:
+                systs += ["up", "down"]
+            else:
+                systs += [
+                    "up_correlated",
+                    "down_correlated",
+                    "up_uncorrelated",
+                    "down_uncorrelated",
+                ]
+        btag_weights = self.get_btag_weights(flavor=flavor, systs=systs)
+        btag_weight = btag_weights["central"]
 
         if self._variation == "nominal":
             # systematics
             if not self._full_run:
-                # up and down scale factors
-                btag_sf_up = self.get_scale_factors(flavor=flavor, syst="up")
-                btag_sf_down = self.get_scale_factors(flavor=flavor, syst="down")
-                btag_weight_up = self.get_btag_weight(eff, btag_sf_up, passbtag)
-                btag_weight_down = self.get_btag_weight(eff, btag_sf_down, passbtag)
                 # add weights to Weights container
                 self._weights.add(
                     name=self.var_naming_map[flavor],
                     weight=btag_weight,
-                    weightUp=btag_weight_up,
-                    weightDown=btag_weight_down,
+                    weightUp=btag_weights["up"],
+                    weightDown=btag_weights["down"],
                 )
             else:
-                # up and down correlated scale factors
-                btag_sf_up_correlated = self.get_scale_factors(
-                    flavor=flavor, syst="up_correlated"
-                )
-                btag_sf_down_correlated = self.get_scale_factors(
-                    flavor=flavor, syst="down_correlated"
-                )
-                btag_weight_up_correlated = self.get_btag_weight(
-                    eff, btag_sf_up_correlated, passbtag
-                )
-                btag_weight_down_correlated = self.get_btag_weight(
-                    eff, btag_sf_down_correlated, passbtag
-                )
-                # up and down uncorrelated scale factors
-                btag_sf_up_uncorrelated = self.get_scale_factors(
-                    flavor=flavor, syst="up_uncorrelated"
-                )
-                btag_sf_down_uncorrelated = self.get_scale_factors(
-                    flavor=flavor, syst="down_uncorrelated"
-                )
-                btag_weight_up_uncorrelated = self.get_btag_weight(
-                    eff, btag_sf_up_uncorrelated, passbtag
-                )
-                btag_weight_down_uncorrelated = self.get_btag_weight(
-                    eff, btag_sf_down_uncorrelated, passbtag
-                )
                 # add weights to Weights container
                 self._weights.add(
                     name=f"{self.var_naming_map[flavor]}_correlated",
                     weight=btag_weight,
-                    weightUp=btag_weight_up_correlated,
-                    weightDown=btag_weight_down_correlated,
+                    weightUp=btag_weights["up_correlated"],
+                    weightDown=btag_weights["down_correlated"],
                 )
                 self._weights.add(
                     name=f"{self.var_naming_map[flavor]}_uncorrelated_{self._year[:4]}",
                     weight=ak.ones_like(btag_weight),
-                    weightUp=btag_weight_up_uncorrelated,
-                    weightDown=btag_weight_down_uncorrelated,
+                    weightUp=btag_weights["up_uncorrelated"],
+                    weightDown=btag_weights["down_uncorrelated"],
                 )
         else:
             self._weights.add(
@@ -201,30 +203,39 @@ class BTagCorrector:
                 weight=btag_weight,
             )
 
-    def efficiency(self, flavor: str, fill_value=1) -> ak.Array:
-        """compute the btagging efficiency for 'njets' jets"""
+    def flat_efficiency(self, flavor: str) -> np.ndarray:
+        """compute the btagging efficiency for flat bc or light jets"""
+        j = self._jet_map[flavor]
         return self._efflookup(
-            self._jet_map[flavor].pt,
-            np.abs(self._jet_map[flavor].eta),
-            self._jet_map[flavor].hadronFlavour,
+            ak.to_numpy(j.pt),
+            ak.to_numpy(np.abs(j.eta)),
+            ak.to_numpy(j.hadronFlavour),
         )
 
+    def efficiency(self, flavor: str, fill_value=1) -> ak.Array:
+        """compute the btagging efficiency for 'njets' jets"""
+        return ak.unflatten(self.flat_efficiency(flavor), self._n_jets[flavor])
+
     def get_scale_factors(self, flavor: str, syst="central", fill_value=1) -> ak.Array:
         """
         compute jets scale factors
         """
         return self.get_sf(flavor=flavor, syst=syst)
 
-    def get_sf(self, flavor: str, syst: str = "central") -> ak.Array:
+    def get_flat_sf(self, flavor: str, systs: list) -> np.ndarray:
         """
-        compute the scale factors for bc or light jets
+        compute the scale factors for flat bc or light jets for several systematics at once
 
         Parameters:
         -----------
             flavor:
                 hadron flavor {'bc', 'light'}
-            syst:
-                Name of the systematic {'central', 'down', 'down_correlated', 'down_uncorrelated', 'up', 'up_correlated'}
+            systs:
+                list of systematics {'central', 'down', 'down_correlated', 'down_uncorrelated', 'up', 'up_correlated', 'up_uncorrelated'}
+
+        Returns:
+        --------
+            array of shape (number of jets, number of systematics)
         """
         cset_keys = {
             "bc": f"{self._tagger}_comb",
@@ -234,8 +245,8 @@ class BTagCorrector:
                 else f"{self._tagger}_light"
             ),
         }
-        # until correctionlib handles jagged data natively we have to flatten and unflatten
-        j, nj = ak.flatten(self._jet_map[flavor]), ak.num(self._jet_map[flavor])
+        # jets were flattened at initialization
+        j = self._jet_map[flavor]
 
         # get 'in-limits' jets
         jet_eta_mask = np.abs(j.eta) < 2.499
@@ -248,37 +259,58 @@ class BTagCorrector:
         jets_hadron_flavour = ak.fill_none(
             in_jets.hadronFlavour, 5 if flavor == "bc" else 0
         )
-
-        sf = self._cset[cset_keys[flavor]].evaluate(
-            syst,
-            self._working_point_map[self._wp],
-            np.array(jets_hadron_flavour),
-            np.array(jets_eta),
-            np.array(jets_pt),
+        return evaluate_sf_variations(
+            correction=self._cset[cset_keys[flavor]],
+            inputs=[
+                self._working_point_map[self._wp],
+                jets_hadron_flavour,
+                jets_eta,
+                jets_pt,
+            ],
+            systs=systs,
+            in_limit_mask=in_jet_mask,
+            syst_position=0,
         )
-        sf = ak.where(in_jet_mask, sf, ak.ones_like(sf))
-        return ak.unflatten(sf, nj)
 
-    @staticmethod
-    def get_btag_weight(eff: ak.Array, sf: ak.Array, passbtag: ak.Array) -> ak.Array:
+    def get_sf(self, flavor: str, syst: str = "central") -> ak.Array:
+        """
+        compute the scale factors for bc or light jets
+
+        Parameters:
+        -----------
+            flavor:
+                hadron flavor {'bc', 'light'}
+            syst:
+                Name of the systematic {'central', 'down', 'down_correlated', 'down_uncorrelated', 'up', 'up_correlated'}
+        """
+        sf = self.get_flat_sf(flavor=flavor, systs=[syst])[:, 0]
+        return ak.unflatten(sf, self._n_jets[flavor])
+
+    def get_btag_weights(self, flavor: str, systs: list) -> dict:
         """
-        compute b-tagging weights
+        compute b-tagging weights for several systematics with a single unflatten
+        and product over jets
 
         see: https://twiki.cern.ch/twiki/bin/viewauth/CMS/BTagSFMethods
 
         Parameters:
         -----------
-            eff:
-                btagging efficiencies
-            sf:
-                jets scale factors
-            passbtag:
-                mask with jets that pass the b-tagging working point
+            flavor:
+                hadron flavor {'bc', 'light'}
+            systs:
+                list of systematics {'central', 'down', 'down_correlated', 'down_uncorrelated', 'up', 'up_correlated', 'up_uncorrelated'}
         """
-        # tagged SF = SF * eff / eff = SF
-        tagged_sf = ak.prod(sf.mask[passbtag], axis=-1)
+        # btagging efficiencies, scale factors and mask with jets that pass the b-tagging working point
+        eff = self.flat_efficiency(flavor)[:, None]
+        sf = self.get_flat_sf(flavor=flavor, systs=systs)
+        passbtag = self._jet_pass_btag[flavor][:, None]
 
+        # tagged SF = SF * eff / eff = SF
         # untagged SF = (1 - SF * eff) / (1 - eff)
-        untagged_sf = ak.prod(((1 - sf * eff) / (1 - eff)).mask[~passbtag], axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            jet_weights = np.where(passbtag, sf, (1 - sf * eff) / (1 - eff))
 
-        return ak.fill_none(tagged_sf * untagged_sf, 1.0)
+        btag_weights = ak.fill_none(
+            ak.prod(ak.unflatten(jet_weights, self._n_jets[flavor]), axis=1), 1.0
+        )
+        return {syst: btag_weights[:, i] for i, syst in enumerate(systs)}
@@ -1,28 +1,6 @@
 import numpy as np
 from coffea.analysis_tools import Weights
-from analysis.corrections import (
-    TauCorrector,
-    BTagCorrector,
-    MuonCorrector,
-    ElectronCorrector,
-    MuonHighPtCorrector,
-    add_isr_weight,
-    add_top_pt_weight,
-    add_lhepdf_weight,
-    add_pileup_weight,
-    add_pujetid_weight,
-    add_scalevar_weight,
-    add_top_boost_weight,
-    apply_jet_corrections,
-    apply_jerc_corrections,
-    add_l1prefiring_weight,
-    add_partonshower_weight,
-    apply_met_phi_corrections,
-    apply_electron_ss_corrections,
-    apply_rochester_corrections_run2,
-    apply_rochester_corrections_run3,
-    apply_tau_energy_scale_corrections,
-)
+from analysis import corrections
 
 
 def object_corrector_manager(events, year, run, dataset, workflow_config):
@@ -32,14 +10,14 @@ def object_corrector_manager(events, year, run, dataset, workflow_config):
 
     if "jets" in objcorr_config:
         if run == "2":
-            apply_jet_corrections(events, year)
+            corrections.apply_jet_corrections(events, year)
         elif run == "3":
             apply_jec = True
             apply_jer = False
             apply_junc = False
             if hasattr(events, "genWeight"):
                 apply_jer = True
-            apply_jerc_corrections(
+            corrections.apply_jerc_corrections(
                 events,
                 year=year,
                 dataset=dataset,
@@ -47,26 +25,32 @@ def object_corrector_manager(events, year, run, dataset, workflow_config):
                 apply_jer=apply_jer,
                 apply_junc=apply_junc,
             )
+    # accumulate the MET changes from the muon, electron and tau corrections
+    # and propagate them (and their variations) to MET at once
+    met_key = "MET" if run == "2" else "PuppiMET"
+    met_propagator = corrections.METPropagator(events[met_key])
     if "muons" in objcorr_config:
         # apply rochester corretions to muons
         if run == "2":
-            apply_rochester_corrections_run2(events, year)
+            corrections.apply_rochester_corrections_run2(events, year, met_propagator)
         elif run == "3":
-            apply_rochester_corrections_run3(events, year)
+            corrections.apply_rochester_corrections_run3(events, year, met_propagator)
     if "electrons" in objcorr_config:
         if run == "3":
-            apply_electron_ss_corrections(
+            corrections.apply_electron_ss_corrections(
                 events=events,
                 year=year,
+                met_propagator=met_propagator,
             )
     if "taus" in objcorr_config:
         if hasattr(events, "genWeight"):
             if run == "2":
                 # apply energy corrections to taus (only to MC)
-                apply_tau_energy_scale_corrections(events, year)
+                corrections.apply_tau_energy_scale_corrections(events, year, met_propagator)
+    met_propagator.apply(events, met_key=met_key)
     if "met" in objcorr_config:
         # apply MET phi modulation corrections
-        apply_met_phi_corrections(events, year)
+        corrections.apply_met_phi_corrections(events, year)
 
 
 def weight_manager(
@@ -86,23 +70,23 @@ def weight_manager(
 
         if "l1prefiringWeight" in weights_config:
             if weights_config["l1prefiringWeight"]:
-                add_l1prefiring_weight(pruned_ev, weights_container, year, variation)
+                corrections.add_l1prefiring_weight(pruned_ev, weights_container, year, variation)
 
         if "pileupWeight" in weights_config:
             if weights_config["pileupWeight"]:
-                add_pileup_weight(pruned_ev, weights_container, year, variation)
+                corrections.add_pileup_weight(pruned_ev, weights_container, year, variation)
 
         if "partonshowerWeight" in weights_config:
             if weights_config["partonshowerWeight"]:
                 if "PSWeight" in pruned_ev.fields:
-                    add_partonshower_weight(
+                    corrections.add_partonshower_weight(
                         events=pruned_ev,
                         weights_container=weights_container,
                         variation=variation,
                     )
         if "lhepdfWeight" in weights_config:
             if weights_config["lhepdfWeight"]:
-                add_lhepdf_weight(
+                corrections.add_lhepdf_weight(
                     events=pruned_ev,
                     weights_container=weights_container,
                     variation=variation,
@@ -110,7 +94,7 @@ def weight_manager(
 
         if "lhescaleWeight" in weights_config:
             if weights_config["lhescaleWeight"]:
-                add_scalevar_weight(
+                corrections.add_scalevar_weight(
                     events=pruned_ev,
                     weights_container=weights_container,
                     variation=variation,
@@ -119,7 +103,7 @@ def weight_manager(
         if "topPtWeight" in weights_config:
             if weights_config["topPtWeight"]:
                 if dataset.startswith("TTTo"):
-                    add_top_pt_weight(
+                    corrections.add_top_pt_weight(
                         events=pruned_ev,
                         weights_container=weights_container,
                         dataset=dataset,
@@ -128,7 +112,7 @@ def weight_manager(
 
         if "topBoostWeight" in weights_config:
             if weights_config["topBoostWeight"]:
-                add_top_boost_weight(
+                corrections.add_top_boost_weight(
                     events=pruned_ev,
                     weights_container=weights_container,
                     year=year,
@@ -140,7 +124,7 @@ def weight_manager(
         if "pujetid" in weights_config:
             if weights_config["pujetid"]:
                 if run == "2":
-                    add_pujetid_weight(
+                    corrections.add_pujetid_weight(
                         events=pruned_ev,
                         weights=weights_container,
                         year=year,
@@ -149,7 +133,7 @@ def weight_manager(
                     )
         if "btagging" in weights_config:
             if weights_config["btagging"]:
-                btag_corrector = BTagCorrector(
+                btag_corrector = corrections.BTagCorrector(
                     events=pruned_ev,
                     weights=weights_container,
                     workflow=workflow,
@@ -166,7 +150,7 @@ def weight_manager(
 
         if "ISRWeight" in weights_config:
             if weights_config["ISRWeight"]:
-                add_isr_weight(
+                corrections.add_isr_weight(
                     events=pruned_ev,
                     weights=weights_container,
                     year=year,
@@ -179,7 +163,7 @@ def weight_manager(
         if "electron" in weights_config:
             if weights_config["electron"]:
                 if "selected_electrons" in pruned_ev.fields:
-                    electron_corrector = ElectronCorrector(
+                    electron_corrector = corrections.ElectronCorrector(
                         events=pruned_ev,
                         weights=weights_container,
                         year=year,
@@ -208,7 +192,7 @@ def weight_manager(
         if "muon" in weights_config:
             if weights_config["muon"]:
                 if "selected_muons" in pruned_ev.fields:
-                    muon_corrector = MuonCorrector(
+                    muon_corrector = corrections.MuonCorrector(
                         events=pruned_ev,
                         weights=weights_container,
                         year=year,
@@ -235,7 +219,7 @@ def weight_manager(
         if "tau" in weights_config:
             if weights_config["tau"]:
                 if "selected_taus" in pruned_ev.fields:
-                    tau_corrector = TauCorrector(
+                    tau_corrector = corrections.TauCorrector(
                         events=pruned_ev,
                         weights=weights_container,
                         year=year,
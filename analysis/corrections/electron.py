@@ -6,7 +6,7 @@ import awkward as ak
 import importlib.resources
 from typing import Type
 from pathlib import Path
-from .utils import unflat_sf
+from .utils import get_sf_variations
 from coffea.analysis_tools import Weights
 from analysis.corrections.utils import pog_years, get_pog_json, get_electron_hlt_json
 
@@ -105,10 +105,9 @@ class ElectronCorrector:
         electron_eta = ak.fill_none(in_electrons.eta + in_electrons.deltaEtaSC, 0.0)
         electron_phi = ak.fill_none(in_electrons.phi, 0)
 
-        # get nominal scale factors
+        # get correction inputs (without the systematic label)
         cset_args = [
             self.year_map[self.year],
-            "sf",
             self.id_map[id_working_point],
             electron_eta,
             electron_pt,
@@ -117,52 +116,30 @@ class ElectronCorrector:
             cset_args += [electron_phi]
 
         id_key = "UL-Electron-ID-SF" if self.run_key == "Run2" else "Electron-ID-SF"
-        nominal_sf = unflat_sf(
-            self.cset[id_key].evaluate(*cset_args),
-            in_electrons_mask,
-            self.electrons_counts,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["sf"]
+        if self.variation == "nominal":
+            systs += ["sfup", "sfdown"]
+        sfs = get_sf_variations(
+            correction=self.cset[id_key],
+            inputs=cset_args,
+            systs=systs,
+            in_limit_mask=in_electrons_mask,
+            n=self.electrons_counts,
+            syst_position=1,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            cset_args_up = [
-                self.year_map[self.year],
-                "sfup",
-                self.id_map[id_working_point],
-                electron_eta,
-                electron_pt,
-            ]
-            cset_args_down = [
-                self.year_map[self.year],
-                "sfdown",
-                self.id_map[id_working_point],
-                electron_eta,
-                electron_pt,
-            ]
-            if self.year.startswith("2023"):
-                cset_args_up += [electron_phi]
-                cset_args_down += [electron_phi]
-
-            up_sf = unflat_sf(
-                self.cset[id_key].evaluate(*cset_args_up),
-                in_electrons_mask,
-                self.electrons_counts,
-            )
-            down_sf = unflat_sf(
-                self.cset[id_key].evaluate(*cset_args_down),
-                in_electrons_mask,
-                self.electrons_counts,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"CMS_eff_e_id_{self.year_key}",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["sf"],
+                weightUp=sfs["sfup"],
+                weightDown=sfs["sfdown"],
             )
         else:
             self.weights.add(
                 name=f"CMS_eff_e_id_{self.year_key}",
-                weight=nominal_sf,
+                weight=sfs["sf"],
             )
 
     def add_reco_weight(self, reco: str) -> None:
@@ -207,10 +184,9 @@ class ElectronCorrector:
         electron_eta = ak.fill_none(in_electrons.eta + in_electrons.deltaEtaSC, 0.0)
         electron_phi = ak.fill_none(in_electrons.phi, 0.0)
 
-        # get nominal scale factors
+        # get correction inputs (without the systematic label)
         cset_args = [
             self.year_map[self.year],
-            "sf",
             reco,
             electron_eta,
             electron_pt,
@@ -219,52 +195,30 @@ class ElectronCorrector:
             cset_args += [electron_phi]
 
         id_key = "UL-Electron-ID-SF" if self.run_key == "Run2" else "Electron-ID-SF"
-        nominal_sf = unflat_sf(
-            self.cset[id_key].evaluate(*cset_args),
-            in_electrons_mask,
-            self.electrons_counts,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["sf"]
+        if self.variation == "nominal":
+            systs += ["sfup", "sfdown"]
+        sfs = get_sf_variations(
+            correction=self.cset[id_key],
+            inputs=cset_args,
+            systs=systs,
+            in_limit_mask=in_electrons_mask,
+            n=self.electrons_counts,
+            syst_position=1,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            cset_args_up = [
-                self.year_map[self.year],
-                "sfup",
-                reco,
-                electron_eta,
-                electron_pt,
-            ]
-            cset_args_down = [
-                self.year_map[self.year],
-                "sfdown",
-                reco,
-                electron_eta,
-                electron_pt,
-            ]
-            if self.year.startswith("2023"):
-                cset_args_up += [electron_phi]
-                cset_args_down += [electron_phi]
-
-            up_sf = unflat_sf(
-                self.cset[id_key].evaluate(*cset_args_up),
-                in_electrons_mask,
-                self.electrons_counts,
-            )
-            down_sf = unflat_sf(
-                self.cset[id_key].evaluate(*cset_args_down),
-                in_electrons_mask,
-                self.electrons_counts,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=var_naming_map[reco],
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["sf"],
+                weightUp=sfs["sfup"],
+                weightDown=sfs["sfdown"],
             )
         else:
             self.weights.add(
                 name=var_naming_map[reco],
-                weight=nominal_sf,
+                weight=sfs["sf"],
             )
 
     def add_hlt_weights(self, id_wp):
@@ -2,7 +2,7 @@ import correctionlib
 import numpy as np
 import awkward as ak
 from pathlib import Path
-from analysis.corrections.met import corrected_polar_met
+from analysis.corrections.met import METPropagator
 
 
 def filter_boundaries(pt_corr, pt, nested=True):
@@ -48,7 +48,17 @@ def filter_boundaries(pt_corr, pt, nested=True):
 def apply_electron_ss_corrections(
     events: ak.Array,
     year: str,
+    met_propagator: METPropagator = None,
 ):
+    """
+    apply electron scale and smearing corrections for Run3
+
+    Parameters:
+    -----------
+        met_propagator:
+            MET propagation accumulator to register the electron pT changes with.
+            If None, the changes are propagated to PuppiMET right away
+    """
     json_path = (
         Path.cwd() / "analysis" / "data" / f"{year}_electronSS_EtDependent.json.gz"
     )
@@ -61,10 +71,6 @@ def apply_electron_ss_corrections(
     smear_evaluator = cset[f"EGMSmearAndSyst_ElePTsplit_{year_map.get(year, year)}"]
 
     events["Electron", "pt_raw"] = ak.ones_like(events.Electron.pt) * events.Electron.pt
-    events["PuppiMET", "pt_raw"] = ak.ones_like(events.PuppiMET.pt) * events.PuppiMET.pt
-    events["PuppiMET", "phi_raw"] = (
-        ak.ones_like(events.PuppiMET.phi) * events.PuppiMET.phi
-    )
 
     electrons = ak.flatten(events.Electron)
     counts = ak.num(events.Electron)
@@ -91,13 +97,14 @@ def apply_electron_ss_corrections(
 
     events["Electron", "pt"] = corrected_pt
 
-    # Propagate changes in muon pT to PuppiMET
-    met_pt, met_phi = corrected_polar_met(
-        met_pt=events.PuppiMET.pt_raw,
-        met_phi=events.PuppiMET.phi_raw,
+    # Propagate changes in electron pT to PuppiMET
+    apply_met_propagation = met_propagator is None
+    if apply_met_propagation:
+        met_propagator = METPropagator(events.PuppiMET)
+    met_propagator.add(
         other_phi=events.Electron.phi,
         other_pt_old=events.Electron.pt_raw,
         other_pt_new=events.Electron.pt,
     )
-    events["PuppiMET", "pt"] = met_pt
-    events["PuppiMET", "phi"] = met_phi
+    if apply_met_propagation:
+        met_propagator.apply(events, met_key="PuppiMET")
@@ -2,15 +2,29 @@ import correctionlib
 import numpy as np
 import awkward as ak
 from analysis.corrections.utils import get_pog_json
+from analysis.corrections.met import METPropagator
 
 
-def apply_jetvetomaps(events: ak.Array, year: str, mapname: str = "jetvetomap"):
+def get_jetvetomap_mask(jets: ak.Array, year: str, mapname: str = "jetvetomap"):
     """
     These are the jet veto maps showing regions with an excess of jets (hot zones) and lack of jets
     (cold zones). Using the phi-symmetry of the CMS detector, these areas with detector and or
     calibration issues can be pinpointed.
 
     Non-zero value indicates that the region is vetoed
+
+    Parameters:
+    -----------
+        jets:
+            Jet collection
+        year:
+            dataset year {2016preVFP, 2016postVFP, 2017, 2018, 2022preEE, 2022postEE, 2023preBPix, 2023postBPix}
+        mapname:
+            veto map name
+
+    Returns:
+    --------
+        jet-level mask, True for jets outside the vetoed regions
     """
     hname = {
         "2016preVFP": "Summer19UL16_V1",
@@ -22,8 +36,6 @@ def apply_jetvetomaps(events: ak.Array, year: str, mapname: str = "jetvetomap"):
         "2023preBPix": "Summer23Prompt23_RunC_V1",
         "2023postBPix": "Summer23BPixPrompt23_RunD_V1",
     }
-    # select veto jets
-    jets = events.Jet
     j, n = ak.flatten(jets), ak.num(jets)
     jet_eta_mask = np.abs(j.eta) < 5.19
     jet_phi_mask = np.abs(j.phi) < 3.14
@@ -33,31 +45,44 @@ def apply_jetvetomaps(events: ak.Array, year: str, mapname: str = "jetvetomap"):
     jets_phi = ak.fill_none(in_jets.phi, 0.0)
     cset = correctionlib.CorrectionSet.from_file(get_pog_json("jetvetomaps", year))
     vetomaps = cset[hname[year]].evaluate(mapname, jets_eta, jets_phi)
-    vetomaps = ak.unflatten(vetomaps, n) == 0
+    return ak.unflatten(vetomaps, n) == 0
+
+
+def add_jetvetomap_mask(events: ak.Array, year: str, mapname: str = "jetvetomap"):
+    """
+    add the jet veto map decision as a 'passJetVetoMap' jet field.
+
+    It must be called before the jet corrections, so that the (eta, phi based) decision
+    is computed once per chunk and carried by the corrected and shifted jet collections
+    """
+    events["Jet", "passJetVetoMap"] = get_jetvetomap_mask(events.Jet, year, mapname)
+
+
+def apply_jetvetomaps(events: ak.Array, year: str, mapname: str = "jetvetomap"):
+    """
+    remove jets within the vetoed regions and update MET.
+
+    Uses the 'passJetVetoMap' jet field if available (see add_jetvetomap_mask),
+    otherwise the veto maps are evaluated
+    """
+    if "passJetVetoMap" in events.Jet.fields:
+        vetomaps = events.Jet.passJetVetoMap
+    else:
+        vetomaps = get_jetvetomap_mask(events.Jet, year, mapname)
     jets_veto = events.Jet[vetomaps]
+    jets_vetoed = events.Jet[~vetomaps]
 
     # update MET
     met_key = (
         "PuppiMET" if (year.startswith("2022") or year.startswith("2023")) else "MET"
     )
-    met_pt = events[met_key].pt
-    met_phi = events[met_key].phi
-    # Jet veto pt(x,y) per event
-    jet_veto_pt_x = jets_veto.pt * np.cos(jets_veto.phi)
-    jet_veto_pt_y = jets_veto.pt * np.sin(jets_veto.phi)
-    jet_pt_x = events.Jet.pt * np.cos(events.Jet.phi)
-    jet_pt_y = events.Jet.pt * np.sin(events.Jet.phi)
-    # get x and y changes
-    delta_x = ak.sum(jet_pt_x, axis=-1) - ak.sum(jet_veto_pt_x, axis=-1)
-    delta_y = ak.sum(jet_pt_y, axis=-1) - ak.sum(jet_veto_pt_y, axis=-1)
-    # propagate changes to MET (x, y) components
-    met_px = met_pt * np.cos(met_phi) - delta_x
-    met_py = met_pt * np.sin(met_phi) - delta_y
-    # propagate changes to MET (pT, phi) components
-    new_met_pt = np.sqrt((met_px**2.0 + met_py**2.0))
-    new_met_phi = np.arctan2(met_py, met_px)
-
+    met_propagator = METPropagator(events[met_key])
+    # get x and y changes (pt(x,y) of the removed jets per event)
+    met_propagator.add_delta(
+        delta_x=ak.sum(jets_vetoed.pt * np.cos(jets_vetoed.phi), axis=-1),
+        delta_y=ak.sum(jets_vetoed.pt * np.sin(jets_vetoed.phi), axis=-1),
+    )
     # update fields
     events["Jet"] = jets_veto
-    events[met_key, "pt"] = new_met_pt
-    events[met_key, "phi"] = new_met_phi
+    # propagate changes to MET
+    met_propagator.apply(events, met_key=met_key, save_raw=False)
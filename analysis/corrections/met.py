@@ -91,32 +91,115 @@ def apply_met_phi_corrections(
             pass
 
 
-def corrected_polar_met(
-    met_pt,
-    met_phi,
-    other_phi,
-    other_pt_old,
-    other_pt_new,
-    positive=None,
-    dx=None,
-    dy=None,
-) -> tuple:
+class METPropagator:
     """
-    helper function to compute new MET polar components after some other object pT correction.
+    MET propagation accumulator.
 
-    https://github.com/CoffeaTeam/coffea/blob/master/src/coffea/jetmet_tools/CorrectedMETFactory.py#L6
+    Object corrections register the (px, py) changes of the corrected objects for the
+    nominal and systematic variations. The corrected MET and its systematic variations
+    are computed once, in cartesian form, when applied to the events
+
+    Parameters:
+    -----------
+        met:
+            MET collection before the object corrections
     """
-    sin, cos = np.sin(other_phi), np.cos(other_phi)
-    met_px = met_pt * np.cos(met_phi) - ak.sum(
-        (other_pt_new - other_pt_old) * cos, axis=1
-    )
-    met_py = met_pt * np.sin(met_phi) - ak.sum(
-        (other_pt_new - other_pt_old) * sin, axis=1
-    )
-    if positive is not None and dx is not None and dy is not None:
-        met_px = met_px + dx if positive else x - dx
-        met_py = met_py + dy if positive else y - dy
-
-    corrected_met_pt = np.hypot(met_px, met_py)
-    corrected_met_phi = np.arctan2(met_py, met_px)
-    return corrected_met_pt, corrected_met_phi
+
+    def __init__(self, met: ak.Array) -> None:
+        self.met = met
+        self.met_px = met.pt * np.cos(met.phi)
+        self.met_py = met.pt * np.sin(met.phi)
+        # accumulated nominal (px, py) changes
+        self.delta_x = 0.0
+        self.delta_y = 0.0
+        # systematic (px, py) changes relative to the nominal ones
+        # {name: {variation: (delta_x, delta_y)}}
+        self.systematics = {}
+        self.n_corrections = 0
+
+    def add(
+        self,
+        other_phi: ak.Array,
+        other_pt_old: ak.Array,
+        other_pt_new: ak.Array,
+        name: str = None,
+        variations: dict = None,
+    ) -> None:
+        """
+        register an object pT correction
+
+        Parameters:
+        -----------
+            other_phi:
+                azimuthal angle of the corrected objects
+            other_pt_old:
+                objects pT before the correction
+            other_pt_new:
+                objects pT after the (nominal) correction
+            name:
+                name of the MET systematic field {rochester, tau_energy, ...}
+            variations:
+                objects pT of the systematic variations {'up': pt_up, 'down': pt_down}
+        """
+        cos, sin = np.cos(other_phi), np.sin(other_phi)
+        self.add_delta(
+            ak.sum((other_pt_new - other_pt_old) * cos, axis=1),
+            ak.sum((other_pt_new - other_pt_old) * sin, axis=1),
+        )
+        if variations is not None:
+            self.systematics[name] = {
+                variation: (
+                    ak.sum((pt - other_pt_new) * cos, axis=1),
+                    ak.sum((pt - other_pt_new) * sin, axis=1),
+                )
+                for variation, pt in variations.items()
+            }
+
+    def add_delta(self, delta_x: ak.Array, delta_y: ak.Array) -> None:
+        """register a (px, py) change to be subtracted from MET"""
+        self.delta_x = self.delta_x + delta_x
+        self.delta_y = self.delta_y + delta_y
+        self.n_corrections += 1
+
+    def apply(self, events: ak.Array, met_key: str = "MET", save_raw: bool = True):
+        """
+        update the MET collection with the corrected pT and phi, and add the systematic
+        variations as 'METSystematic' fields
+
+        Parameters:
+        -----------
+            events:
+                Events array
+            met_key:
+                MET collection name {MET, PuppiMET}
+            save_raw:
+                whether to save the MET before the corrections as 'pt_raw' and 'phi_raw'
+        """
+        if self.n_corrections == 0:
+            return
+        met_px = self.met_px - self.delta_x
+        met_py = self.met_py - self.delta_y
+        if save_raw:
+            events[met_key, "pt_raw"] = ak.ones_like(self.met.pt) * self.met.pt
+            events[met_key, "phi_raw"] = ak.ones_like(self.met.phi) * self.met.phi
+        events[met_key, "pt"] = np.hypot(met_px, met_py)
+        events[met_key, "phi"] = np.arctan2(met_py, met_px)
+
+        met = events[met_key]
+        for name, variations in self.systematics.items():
+            met_variations = {}
+            for variation, (delta_x, delta_y) in variations.items():
+                variation_px = met_px - delta_x
+                variation_py = met_py - delta_y
+                met_variation = ak.with_field(
+                    met, np.hypot(variation_px, variation_py), where="pt"
+                )
+                met_variations[variation] = ak.with_field(
+                    met_variation, np.arctan2(variation_py, variation_px), where="phi"
+                )
+            # Combine into METSystematic structure
+            events[met_key] = ak.with_field(
+                events[met_key],
+                ak.zip(met_variations, depth_limit=1, with_name="METSystematic"),
+                where=name,
+            )
@@ -4,7 +4,7 @@ import numpy as np
 import awkward as ak
 from typing import Type
 from pathlib import Path
-from .utils import unflat_sf
+from .utils import get_sf_variations
 from coffea.analysis_tools import Weights
 from analysis.corrections.utils import pog_years, get_pog_json, get_muon_hlt_json
 
@@ -93,41 +93,29 @@ class MuonCorrector:
                 "2017": "NUM_TrackerMuons_DEN_genTracks",
                 "2018": "NUM_TrackerMuons_DEN_genTracks",
             }
-            # get nominal scale factors
-            nominal_sf = unflat_sf(
-                self.cset[reco_corrections[self.year]].evaluate(
-                    muon_eta, muon_pt, "nominal"
-                ),
-                in_muon_mask,
-                self.muons_counts,
+            # get nominal (and 'up' and 'down') scale factors
+            systs = ["nominal"]
+            if self.variation == "nominal":
+                systs += ["systup", "systdown"]
+            sfs = get_sf_variations(
+                correction=self.cset[reco_corrections[self.year]],
+                inputs=[muon_eta, muon_pt],
+                systs=systs,
+                in_limit_mask=in_muon_mask,
+                n=self.muons_counts,
             )
             if self.variation == "nominal":
-                # get 'up' and 'down' scale factors
-                up_sf = unflat_sf(
-                    self.cset[reco_corrections[self.year]].evaluate(
-                        muon_eta, muon_pt, "systup"
-                    ),
-                    in_muon_mask,
-                    self.muons_counts,
-                )
-                down_sf = unflat_sf(
-                    self.cset[reco_corrections[self.year]].evaluate(
-                        muon_eta, muon_pt, "systdown"
-                    ),
-                    in_muon_mask,
-                    self.muons_counts,
-                )
                 # add scale factors to weights container
                 self.weights.add(
                     name=f"CMS_eff_m_reco_{self.year_key}",
-                    weight=nominal_sf,
-                    weightUp=up_sf,
-                    weightDown=down_sf,
+                    weight=sfs["nominal"],
+                    weightUp=sfs["systup"],
+                    weightDown=sfs["systdown"],
                 )
             else:
                 self.weights.add(
                     name=f"CMS_eff_m_reco_{self.year_key}",
-                    weight=nominal_sf,
+                    weight=sfs["nominal"],
                 )
 
     def add_id_weight(self):
@@ -150,41 +138,29 @@ class MuonCorrector:
             "medium": "NUM_MediumID_DEN_TrackerMuons",
             "tight": "NUM_TightID_DEN_TrackerMuons",
         }
-        # get nominal scale factors
-        nominal_sf = unflat_sf(
-            self.cset[id_corrections[self.id_wp]].evaluate(
-                muon_eta, muon_pt, "nominal"
-            ),
-            in_muon_mask,
-            self.muons_counts,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nominal"]
+        if self.variation == "nominal":
+            systs += ["systup", "systdown"]
+        sfs = get_sf_variations(
+            correction=self.cset[id_corrections[self.id_wp]],
+            inputs=[muon_eta, muon_pt],
+            systs=systs,
+            in_limit_mask=in_muon_mask,
+            n=self.muons_counts,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset[id_corrections[self.id_wp]].evaluate(
-                    muon_eta, muon_pt, "systup"
-                ),
-                in_muon_mask,
-                self.muons_counts,
-            )
-            down_sf = unflat_sf(
-                self.cset[id_corrections[self.id_wp]].evaluate(
-                    muon_eta, muon_pt, "systdown"
-                ),
-                in_muon_mask,
-                self.muons_counts,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"CMS_eff_m_id_{self.year_key}",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["nominal"],
+                weightUp=sfs["systup"],
+                weightDown=sfs["systdown"],
             )
         else:
             self.weights.add(
                 name=f"CMS_eff_m_id_{self.year_key}",
-                weight=nominal_sf,
+                weight=sfs["nominal"],
             )
 
     def add_iso_weight(self):
@@ -240,35 +216,29 @@ class MuonCorrector:
         muon_pt = ak.fill_none(in_muons.pt, 29.0)
         muon_eta = np.abs(ak.fill_none(in_muons.eta, 0.0))
 
-        # get nominal scale factors
-        nominal_sf = unflat_sf(
-            self.cset[correction_name].evaluate(muon_eta, muon_pt, "nominal"),
-            in_muon_mask,
-            self.muons_counts,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nominal"]
+        if self.variation == "nominal":
+            systs += ["systup", "systdown"]
+        sfs = get_sf_variations(
+            correction=self.cset[correction_name],
+            inputs=[muon_eta, muon_pt],
+            systs=systs,
+            in_limit_mask=in_muon_mask,
+            n=self.muons_counts,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset[correction_name].evaluate(muon_eta, muon_pt, "systup"),
-                in_muon_mask,
-                self.muons_counts,
-            )
-            down_sf = unflat_sf(
-                self.cset[correction_name].evaluate(muon_eta, muon_pt, "systdown"),
-                in_muon_mask,
-                self.muons_counts,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"CMS_eff_m_iso_{self.year_key}",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["nominal"],
+                weightUp=sfs["systup"],
+                weightDown=sfs["systdown"],
             )
         else:
             self.weights.add(
                 name=f"CMS_eff_m_iso_{self.year_key}",
-                weight=nominal_sf,
+                weight=sfs["nominal"],
             )
 
     def add_triggeriso_weight(self) -> None:
@@ -312,14 +282,14 @@ class MuonCorrector:
         if self.variation == "nominal":
             if kind == "single":
                 # for single muon events, compute SF from POG SF
-                single_sf = self.cset[sfs_keys[self.year]].evaluate(
-                    muon_eta, muon_pt, "nominal"
-                )
-                nominal_sf = unflat_sf(
-                    single_sf,
-                    in_muon_mask,
-                    self.muons_counts,
+                sfs = get_sf_variations(
+                    correction=self.cset[sfs_keys[self.year]],
+                    inputs=[muon_eta, muon_pt],
+                    systs=["nominal", "systup", "systdown"],
+                    in_limit_mask=in_muon_mask,
+                    n=self.muons_counts,
                 )
+                nominal_sf = sfs["nominal"]
             if kind == "double":
                 # for double muon events, compute SF from muons' efficiencies
                 double_cset = correctionlib.CorrectionSet.from_file(
@@ -355,27 +325,11 @@ class MuonCorrector:
             if self.variation == "nominal":
                 # get 'up' and 'down' scale factors
                 if kind == "single":
-                    up_sf = self.cset[sfs_keys[self.year]].evaluate(
-                        muon_eta, muon_pt, "systup"
-                    )
-                    up_sf = unflat_sf(
-                        up_sf,
-                        in_muon_mask,
-                        self.muons_counts,
-                    )
-                    down_sf = self.cset[sfs_keys[self.year]].evaluate(
-                        muon_eta, muon_pt, "systdown"
-                    )
-                    down_sf = unflat_sf(
-                        down_sf,
-                        in_muon_mask,
-                        self.muons_counts,
-                    )
                     self.weights.add(
                         name=f"CMS_eff_m_trigger_{self.year_key}",
                         weight=nominal_sf,
-                        weightUp=up_sf,
-                        weightDown=down_sf,
+                        weightUp=sfs["systup"],
+                        weightDown=sfs["systdown"],
                     )
                 elif kind == "double":
                     self.weights.add(
@@ -4,7 +4,7 @@ import numpy as np
 import awkward as ak
 from typing import Type
 from pathlib import Path
-from .utils import unflat_sf
+from .utils import get_sf_variations
 from coffea.analysis_tools import Weights
 from analysis.corrections.utils import pog_years, get_pog_json
 
@@ -78,41 +78,29 @@ class MuonHighPtCorrector:
             "2017": "NUM_GlobalMuons_DEN_TrackerMuonProbes",
             "2018": "NUM_GlobalMuons_DEN_TrackerMuonProbes",
         }
-        # get nominal scale factors
-        nominal_sf = unflat_sf(
-            self.cset[reco_corrections[self.year]].evaluate(
-                muon_eta, muon_pt, "nominal"
-            ),
-            in_muon_mask,
-            self.n,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nominal"]
+        if self.variation == "nominal":
+            systs += ["systup", "systdown"]
+        sfs = get_sf_variations(
+            correction=self.cset[reco_corrections[self.year]],
+            inputs=[muon_eta, muon_pt],
+            systs=systs,
+            in_limit_mask=in_muon_mask,
+            n=self.n,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset[reco_corrections[self.year]].evaluate(
-                    muon_eta, muon_pt, "systup"
-                ),
-                in_muon_mask,
-                self.n,
-            )
-            down_sf = unflat_sf(
-                self.cset[reco_corrections[self.year]].evaluate(
-                    muon_eta, muon_pt, "systdown"
-                ),
-                in_muon_mask,
-                self.n,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"muon_reco",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["nominal"],
+                weightUp=sfs["systup"],
+                weightDown=sfs["systdown"],
             )
         else:
             self.weights.add(
                 name=f"muon_reco",
-                weight=nominal_sf,
+                weight=sfs["nominal"],
             )
 
     def add_id_weight(self):
@@ -138,41 +126,29 @@ class MuonHighPtCorrector:
             "2018": {"highpt": "NUM_HighPtID_DEN_GlobalMuonProbes"},
         }
 
-        # get nominal scale factors
-        nominal_sf = unflat_sf(
-            self.cset[id_corrections[self.year][self.id_wp]].evaluate(
-                muon_eta, muon_pt, "nominal"
-            ),
-            in_muon_mask,
-            self.n,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nominal"]
+        if self.variation == "nominal":
+            systs += ["systup", "systdown"]
+        sfs = get_sf_variations(
+            correction=self.cset[id_corrections[self.year][self.id_wp]],
+            inputs=[muon_eta, muon_pt],
+            systs=systs,
+            in_limit_mask=in_muon_mask,
+            n=self.n,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset[id_corrections[self.year][self.id_wp]].evaluate(
-                    muon_eta, muon_pt, "systup"
-                ),
-                in_muon_mask,
-                self.n,
-            )
-            down_sf = unflat_sf(
-                self.cset[id_corrections[self.year][self.id_wp]].evaluate(
-                    muon_eta, muon_pt, "systdown"
-                ),
-                in_muon_mask,
-                self.n,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"muon_highptid",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["nominal"],
+                weightUp=sfs["systup"],
+                weightDown=sfs["systdown"],
             )
         else:
             self.weights.add(
                 name=f"muon_highptid",
-                weight=nominal_sf,
+                weight=sfs["nominal"],
             )
 
     def add_iso_weight(self):
@@ -217,35 +193,29 @@ class MuonHighPtCorrector:
         correction_name = iso_corrections[self.year][self.iso_wp]
         assert correction_name, "No Iso SF's available"
 
-        # get nominal scale factors
-        nominal_sf = unflat_sf(
-            self.cset[correction_name].evaluate(muon_eta, muon_pt, "nominal"),
-            in_muon_mask,
-            self.n,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nominal"]
+        if self.variation == "nominal":
+            systs += ["systup", "systdown"]
+        sfs = get_sf_variations(
+            correction=self.cset[correction_name],
+            inputs=[muon_eta, muon_pt],
+            systs=systs,
+            in_limit_mask=in_muon_mask,
+            n=self.n,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset[correction_name].evaluate(muon_eta, muon_pt, "systup"),
-                in_muon_mask,
-                self.n,
-            )
-            down_sf = unflat_sf(
-                self.cset[correction_name].evaluate(muon_eta, muon_pt, "systdown"),
-                in_muon_mask,
-                self.n,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"muon_iso_{self.iso_wp}",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["nominal"],
+                weightUp=sfs["systup"],
+                weightDown=sfs["systdown"],
             )
         else:
             self.weights.add(
                 name=f"muon_iso_{self.iso_wp}",
-                weight=nominal_sf,
+                weight=sfs["nominal"],
             )
 
     def add_triggeriso_weight(self, hlt_paths) -> None:
@@ -304,38 +274,27 @@ class MuonHighPtCorrector:
             "2017": "NUM_HLT_DEN_HighPtTightRelIsoProbes",
             "2018": "NUM_HLT_DEN_HighPtTightRelIsoProbes",
         }
-        # get nominal scale factors
-        sf = self.cset[sfs_keys[self.year]].evaluate(muon_eta, muon_pt, "nominal")
-        nominal_sf = unflat_sf(
-            sf,
-            in_muon_mask,
-            self.n,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nominal"]
+        if self.variation == "nominal":
+            systs += ["systup", "systdown"]
+        sfs = get_sf_variations(
+            correction=self.cset[sfs_keys[self.year]],
+            inputs=[muon_eta, muon_pt],
+            systs=systs,
+            in_limit_mask=in_muon_mask,
+            n=self.n,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = self.cset[sfs_keys[self.year]].evaluate(muon_eta, muon_pt, "systup")
-            up_sf = unflat_sf(
-                up_sf,
-                in_muon_mask,
-                self.n,
-            )
-            down_sf = self.cset[sfs_keys[self.year]].evaluate(
-                muon_eta, muon_pt, "systdown"
-            )
-            down_sf = unflat_sf(
-                down_sf,
-                in_muon_mask,
-                self.n,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"muon_highpt_triggeriso",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["nominal"],
+                weightUp=sfs["systup"],
+                weightDown=sfs["systdown"],
             )
         else:
             self.weights.add(
                 name=f"muon_highpt_triggeriso",
-                weight=nominal_sf,
+                weight=sfs["nominal"],
             )
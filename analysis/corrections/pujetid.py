@@ -2,7 +2,7 @@ import correctionlib
 import numpy as np
 import awkward as ak
 from typing import Type
-from .utils import unflat_sf
+from .utils import get_sf_variations
 from coffea.analysis_tools import Weights
 from analysis.corrections.utils import get_pog_json
 
@@ -76,37 +76,28 @@ def add_pujetid_weight(
 
     # define correction set
     cset = correctionlib.CorrectionSet.from_file(get_pog_json("pujetid", year))
-    # get nominal scale factors
+    # get nominal (and 'up' and 'down') scale factors
     # If jet in 'in-limits' jets, then take the computed SF, otherwise assign 1
     # Unflatten to original shape
-    nominal_sf = unflat_sf(
-        cset["PUJetID_eff"].evaluate(jets_eta, jets_pt, "nom", wp_map[working_point]),
-        in_jet_mask,
-        n,
+    systs = ["nom"]
+    if variation == "nominal":
+        systs += ["up", "down"]
+    sfs = get_sf_variations(
+        correction=cset["PUJetID_eff"],
+        inputs=[jets_eta, jets_pt, wp_map[working_point]],
+        systs=systs,
+        in_limit_mask=in_jet_mask,
+        n=n,
+        syst_position=2,
     )
     if variation == "nominal":
-        # get 'up' and 'down' variations
-        up_sf = unflat_sf(
-            cset["PUJetID_eff"].evaluate(
-                jets_eta, jets_pt, "up", wp_map[working_point]
-            ),
-            in_jet_mask,
-            n,
-        )
-        down_sf = unflat_sf(
-            cset["PUJetID_eff"].evaluate(
-                jets_eta, jets_pt, "down", wp_map[working_point]
-            ),
-            in_jet_mask,
-            n,
-        )
         # add nominal, up and down scale factors to weights container
         weights.add(
             name=f"CMS_eff_j_PUJET_id_{year_key}",
-            weight=nominal_sf,
-            weightUp=up_sf,
-            weightDown=down_sf,
+            weight=sfs["nom"],
+            weightUp=sfs["up"],
+            weightDown=sfs["down"],
         )
     else:
         # add nominal scale factors to weights container
-        weights.add(name=f"CMS_eff_j_PUJET_id_{year_key}", weight=nominal_sf)
+        weights.add(name=f"CMS_eff_j_PUJET_id_{year_key}", weight=sfs["nom"])
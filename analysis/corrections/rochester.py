@@ -4,7 +4,7 @@ import correctionlib
 from pathlib import Path
 from random import random
 from scipy.special import erfinv, erf
-from analysis.corrections.met import corrected_polar_met
+from analysis.corrections.met import METPropagator
 from coffea.lookup_tools import txt_converters, rochester_lookup
 
 
@@ -392,13 +392,20 @@ def pt_scale_var(pt, eta, phi, charge, updn, cset, nested=False):
     return pt_var
 
 
-def apply_rochester_corrections_run3(events: ak.Array, year: str):
+def apply_rochester_corrections_run3(
+    events: ak.Array, year: str, met_propagator: METPropagator = None
+):
+    """
+    apply muon scale and resolution corrections for Run3
+
+    Parameters:
+    -----------
+        met_propagator:
+            MET propagation accumulator to register the muon pT changes with.
+            If None, the changes are propagated to PuppiMET right away
+    """
     # save original muon pT
     events["Muon", "pt_raw"] = ak.ones_like(events.Muon.pt) * events.Muon.pt
-    events["PuppiMET", "pt_raw"] = ak.ones_like(events.PuppiMET.pt) * events.PuppiMET.pt
-    events["PuppiMET", "phi_raw"] = (
-        ak.ones_like(events.PuppiMET.phi) * events.PuppiMET.phi
-    )
 
     # get correction set
     json_path = Path.cwd() / "analysis" / "data" / f"{year}_muonSS.json.gz"
@@ -436,19 +443,28 @@ def apply_rochester_corrections_run3(events: ak.Array, year: str):
     # update muon pT
     events["Muon", "pt"] = ptcorr
     # Propagate changes in muon pT to PuppiMET
-    met_pt, met_phi = corrected_polar_met(
-        met_pt=events.PuppiMET.pt_raw,
-        met_phi=events.PuppiMET.phi_raw,
+    apply_met_propagation = met_propagator is None
+    if apply_met_propagation:
+        met_propagator = METPropagator(events.PuppiMET)
+    met_propagator.add(
         other_phi=events.Muon.phi,
         other_pt_old=events.Muon.pt_raw,
         other_pt_new=events.Muon.pt,
     )
-    events["PuppiMET", "pt"] = met_pt
-    events["PuppiMET", "phi"] = met_phi
+    if apply_met_propagation:
+        met_propagator.apply(events, met_key="PuppiMET")
 
 
-def apply_rochester_corrections_run2(events, year):
-    """apply rochester corrections for Run2"""
+def apply_rochester_corrections_run2(events, year, met_propagator=None):
+    """
+    apply rochester corrections for Run2
+
+    Parameters:
+    -----------
+        met_propagator:
+            MET propagation accumulator to register the muon pT changes (and its 'rochester'
+            variations) with. If None, the changes are propagated to MET right away
+    """
     # https://twiki.cern.ch/twiki/bin/viewauth/CMS/RochcorMuon
     rochester_data = txt_converters.convert_rochester_file(
         f"analysis/data/RoccoR{year}UL.txt", loaduncs=True
@@ -507,10 +523,8 @@ def apply_rochester_corrections_run2(events, year):
             events.Muon.charge, events.Muon.pt, events.Muon.eta, events.Muon.phi
         )
 
-    # Backup original pt and MET values
+    # Backup original pt values
     events["Muon", "pt_raw"] = events.Muon.pt
-    events["MET", "pt_raw"] = events.MET.pt
-    events["MET", "phi_raw"] = events.MET.phi
 
     muons, counts, fields = events.Muon, ak.num(events.Muon), ak.fields(events.Muon)
     out = ak.flatten(muons)
@@ -538,44 +552,19 @@ def apply_rochester_corrections_run2(events, year):
     out = ak.zip(out_dict, depth_limit=1, parameters=out_parms, behavior=out.behavior)
     events["Muon"] = ak.unflatten(out, counts)
 
-    # Propagate corrections to MET
-    met_pt, met_phi = corrected_polar_met(
-        events.MET.pt_raw,
-        events.MET.phi_raw,
-        events.Muon.phi,
-        events.Muon.pt_raw,
-        events.Muon.pt,
-    )
-    events["MET", "pt"] = met_pt
-    events["MET", "phi"] = met_phi
-
-    # Propagate muon pt shifts to MET
-    met_up_pt, met_up_phi = corrected_polar_met(
-        events.MET.pt_raw,
-        events.MET.phi_raw,
-        events.Muon.phi,
-        events.Muon.pt_raw,
-        events.Muon.rochester.up.pt,
-    )
-    met_down_pt, met_down_phi = corrected_polar_met(
-        events.MET.pt_raw,
-        events.MET.phi_raw,
-        events.Muon.phi,
-        events.Muon.pt_raw,
-        events.Muon.rochester.down.pt,
-    )
-    # Apply MET pt and phi shifts
-    met_up = ak.with_field(events.MET, met_up_pt, where="pt")
-    met_up = ak.with_field(met_up, met_up_phi, where="phi")
-
-    met_down = ak.with_field(events.MET, met_down_pt, where="pt")
-    met_down = ak.with_field(met_down, met_down_phi, where="phi")
-
-    # Combine into METSystematic structure
-    met_rochester_systematics = ak.zip(
-        {"up": met_up, "down": met_down}, depth_limit=1, with_name="METSystematic"
-    )
-    # Attach to events.MET
-    events["MET"] = ak.with_field(
-        events.MET, met_rochester_systematics, where="rochester"
+    # Propagate corrections (and muon pt shifts) to MET
+    apply_met_propagation = met_propagator is None
+    if apply_met_propagation:
+        met_propagator = METPropagator(events.MET)
+    met_propagator.add(
+        other_phi=events.Muon.phi,
+        other_pt_old=events.Muon.pt_raw,
+        other_pt_new=events.Muon.pt,
+        name="rochester",
+        variations={
+            "up": events.Muon.rochester.up.pt,
+            "down": events.Muon.rochester.down.pt,
+        },
     )
+    if apply_met_propagation:
+        met_propagator.apply(events, met_key="MET")
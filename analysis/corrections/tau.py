@@ -6,7 +6,7 @@ import awkward as ak
 import importlib.resources
 from typing import Type
 from pathlib import Path
-from .utils import unflat_sf
+from .utils import get_sf_variations
 from coffea.analysis_tools import Weights
 from analysis.corrections.utils import pog_years, get_pog_json
 
@@ -118,43 +118,31 @@ class TauCorrector:
 
         # syst
         syst = "nom"
-        # get nominal scale factors
-        nominal_sf = unflat_sf(
-            self.cset["DeepTau2017v2p1VSe"].evaluate(
-                tau_eta, tau_genMatch, self.wp_map[self.tau_vs_ele], "nom"
-            ),
-            in_tau_mask,
-            self.n,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nom"]
+        if self.variation == "nominal":
+            systs += ["up", "down"]
+        sfs = get_sf_variations(
+            correction=self.cset["DeepTau2017v2p1VSe"],
+            inputs=[tau_eta, tau_genMatch, self.wp_map[self.tau_vs_ele]],
+            systs=systs,
+            in_limit_mask=in_tau_mask,
+            n=self.n,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset["DeepTau2017v2p1VSe"].evaluate(
-                    tau_eta, tau_genMatch, self.wp_map[self.tau_vs_ele], "up"
-                ),
-                in_tau_mask,
-                self.n,
-            )
-            down_sf = unflat_sf(
-                self.cset["DeepTau2017v2p1VSe"].evaluate(
-                    tau_eta, tau_genMatch, self.wp_map[self.tau_vs_ele], "down"
-                ),
-                in_tau_mask,
-                self.n,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"CMS_eff_tau_idDeepTauVSe_{self.year_key}",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["nom"],
+                weightUp=sfs["up"],
+                weightDown=sfs["down"],
             )
         else:
             self.weights.add(
                 name=f"CMS_eff_tau_idDeepTauVSe_{self.year_key}",
-                weight=nominal_sf,
+                weight=sfs["nom"],
             )
-        return nominal_sf
+        return sfs["nom"]
 
     # mu -> tau_h fake rate SFs for DeepTau2017v2p1VSmu
     # eta = (0, 2.3]; genMatch = 0,2; wp = Loose, Medium, Tight, VLoose ; syst: down, nom, up
@@ -178,43 +166,31 @@ class TauCorrector:
         tau_eta = ak.fill_none(in_limit_taus.eta, 0)
         tau_genMatch = ak.fill_none(in_limit_taus.genPartFlav, 0.0)
 
-        # get nominal scale factors
-        nominal_sf = unflat_sf(
-            self.cset["DeepTau2017v2p1VSmu"].evaluate(
-                tau_eta, tau_genMatch, self.wp_map[self.tau_vs_mu], "nom"
-            ),
-            in_tau_mask,
-            self.n,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nom"]
+        if self.variation == "nominal":
+            systs += ["up", "down"]
+        sfs = get_sf_variations(
+            correction=self.cset["DeepTau2017v2p1VSmu"],
+            inputs=[tau_eta, tau_genMatch, self.wp_map[self.tau_vs_mu]],
+            systs=systs,
+            in_limit_mask=in_tau_mask,
+            n=self.n,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset["DeepTau2017v2p1VSmu"].evaluate(
-                    tau_eta, tau_genMatch, self.wp_map[self.tau_vs_mu], "up"
-                ),
-                in_tau_mask,
-                self.n,
-            )
-            down_sf = unflat_sf(
-                self.cset["DeepTau2017v2p1VSmu"].evaluate(
-                    tau_eta, tau_genMatch, self.wp_map[self.tau_vs_mu], "down"
-                ),
-                in_tau_mask,
-                self.n,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"CMS_eff_tau_idDeepTauVSmu_{self.year_key}",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["nom"],
+                weightUp=sfs["up"],
+                weightDown=sfs["down"],
             )
         else:
             self.weights.add(
                 name=f"CMS_eff_tau_idDeepTauVSmu_{self.year_key}",
-                weight=nominal_sf,
+                weight=sfs["nom"],
             )
-        return nominal_sf
+        return sfs["nom"]
 
     # By default, use the pT-dependent SFs with the 'pt' flag
     # pt = (-inf, inf); dm = 0, 1, 2, 10, 11; genmatch = 0, 1, 2, 3, 4, 5, 6; wp = Loose, Medium, Tight, VTight; wp_VSe = Tight, VVLoose; syst = down, nom, up; flag = dm, pt
@@ -251,61 +227,39 @@ class TauCorrector:
         tau_dm = ak.fill_none(in_limit_taus.decayMode, 0)
         tau_genMatch = ak.fill_none(in_limit_taus.genPartFlav, 0.0)
 
-        # get nominal scale factors
-        nominal_sf = unflat_sf(
-            self.cset["DeepTau2017v2p1VSjet"].evaluate(
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["default"]
+        if self.variation == "nominal":
+            systs += ["up", "down"]
+        sfs = get_sf_variations(
+            correction=self.cset["DeepTau2017v2p1VSjet"],
+            inputs=[
                 tau_pt,
                 tau_dm,
                 tau_genMatch,
                 self.wp_map[self.tau_vs_jet],
                 self.wp_map[self.tau_vs_ele],
-                "default",
                 flag,
-            ),
-            in_tau_mask,
-            self.n,
+            ],
+            systs=systs,
+            in_limit_mask=in_tau_mask,
+            n=self.n,
+            syst_position=5,
         )
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset["DeepTau2017v2p1VSjet"].evaluate(
-                    tau_pt,
-                    tau_dm,
-                    tau_genMatch,
-                    self.wp_map[self.tau_vs_jet],
-                    self.wp_map[self.tau_vs_ele],
-                    "up",
-                    flag,
-                ),
-                in_tau_mask,
-                self.n,
-            )
-            down_sf = unflat_sf(
-                self.cset["DeepTau2017v2p1VSjet"].evaluate(
-                    tau_pt,
-                    tau_dm,
-                    tau_genMatch,
-                    self.wp_map[self.tau_vs_jet],
-                    self.wp_map[self.tau_vs_ele],
-                    "down",
-                    flag,
-                ),
-                in_tau_mask,
-                self.n,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"CMS_eff_tau_idDeepTauVSjet_{self.year_key}",
-                weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weight=sfs["default"],
+                weightUp=sfs["up"],
+                weightDown=sfs["down"],
             )
         else:
             self.weights.add(
                 name=f"CMS_eff_tau_idDeepTauVSjet_{self.year_key}",
-                weight=nominal_sf,
+                weight=sfs["default"],
             )
-        return nominal_sf
+        return sfs["default"]
 
         # By default, use the pT-dependent SFs with the 'pt' flag
 
@@ -340,47 +294,25 @@ class TauCorrector:
         trigtype = trigger
         corrtype = info
 
-        # get nominal scale factors
-        sf = unflat_sf(
-            self.cset["tau_trigger"].evaluate(
-                tau_pt, tau_dm, trigtype, self.wp_map[self.tau_vs_jet], corrtype, "nom"
-            ),
-            tau_mask,
-            self.n,
+        # get nominal (and 'up' and 'down') scale factors
+        systs = ["nom"]
+        if self.variation == "nominal":
+            systs += ["up", "down"]
+        sfs = get_sf_variations(
+            correction=self.cset["tau_trigger"],
+            inputs=[tau_pt, tau_dm, trigtype, self.wp_map[self.tau_vs_jet], corrtype],
+            systs=systs,
+            in_limit_mask=tau_mask,
+            n=self.n,
         )
-        nominal_sf = np.where(mask_trigger, sf, 1.0)
+        nominal_sf = np.where(mask_trigger, sfs["nom"], 1.0)
         if self.variation == "nominal":
-            # get 'up' and 'down' scale factors
-            up_sf = unflat_sf(
-                self.cset["tau_trigger"].evaluate(
-                    tau_pt,
-                    tau_dm,
-                    trigtype,
-                    self.wp_map[self.tau_vs_jet],
-                    corrtype,
-                    "up",
-                ),
-                tau_mask,
-                self.n,
-            )
-            down_sf = unflat_sf(
-                self.cset["tau_trigger"].evaluate(
-                    tau_pt,
-                    tau_dm,
-                    trigtype,
-                    self.wp_map[self.tau_vs_jet],
-                    corrtype,
-                    "down",
-                ),
-                tau_mask,
-                self.n,
-            )
             # add scale factors to weights container
             self.weights.add(
                 name=f"CMS_eff_t_trigger_{self.year_key}",
                 weight=nominal_sf,
-                weightUp=up_sf,
-                weightDown=down_sf,
+                weightUp=sfs["up"],
+                weightDown=sfs["down"],
             )
         else:
             self.weights.add(
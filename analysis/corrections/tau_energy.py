@@ -3,7 +3,7 @@ import correctionlib
 import numpy as np
 import awkward as ak
 from analysis.corrections.utils import get_pog_json
-from analysis.corrections.met import corrected_polar_met
+from analysis.corrections.met import METPropagator
 
 # ----------------------------------------------------------------------------------- #
 # -- The tau energy scale (TES) corrections for taus are provided  ------------------ #
@@ -39,7 +39,16 @@ def mask_energy_corrections(tau):
     return tau_mask
 
 
-def apply_tau_energy_scale_corrections(events, year):
+def apply_tau_energy_scale_corrections(events, year, met_propagator=None):
+    """
+    apply tau energy scale corrections (only to MC)
+
+    Parameters:
+    -----------
+        met_propagator:
+            MET propagation accumulator to register the tau pT changes (and its 'tau_energy'
+            variations) with. If None, the changes are propagated to MET right away
+    """
     # define tau pt_raw field
     events["Tau", "pt_raw"] = ak.ones_like(events.Tau.pt) * events.Tau.pt
     events["Tau", "mass_raw"] = ak.ones_like(events.Tau.mass) * events.Tau.mass
@@ -104,43 +113,19 @@ def apply_tau_energy_scale_corrections(events, year):
     out = ak.zip(out_dict, depth_limit=1, parameters=out_parms, behavior=out.behavior)
     events["Tau"] = ak.unflatten(out, counts)
 
-    # propagate tau pT corrections to MET
-    corrected_met_pt, corrected_met_phi = corrected_polar_met(
-        met_pt=events.MET.pt,
-        met_phi=events.MET.phi,
+    # propagate tau pT corrections (and tau pt shifts) to MET
+    apply_met_propagation = met_propagator is None
+    if apply_met_propagation:
+        met_propagator = METPropagator(events.MET)
+    met_propagator.add(
         other_phi=events.Tau.phi,
         other_pt_old=events.Tau.pt_raw,
         other_pt_new=events.Tau.pt,
+        name="tau_energy",
+        variations={
+            "up": events.Tau.tau_energy.up.pt,
+            "down": events.Tau.tau_energy.down.pt,
+        },
     )
-    # update MET fields
-    events["MET", "pt"] = corrected_met_pt
-    events["MET", "phi"] = corrected_met_phi
-
-    # Propagate muon pt shifts to MET
-    met_up_pt, met_up_phi = corrected_polar_met(
-        events.MET.pt_raw,
-        events.MET.phi_raw,
-        events.Tau.phi,
-        events.Tau.pt_raw,
-        events.Tau.tau_energy.up.pt,
-    )
-    met_down_pt, met_down_phi = corrected_polar_met(
-        events.MET.pt_raw,
-        events.MET.phi_raw,
-        events.Tau.phi,
-        events.Tau.pt_raw,
-        events.Tau.tau_energy.down.pt,
-    )
-    # Apply MET pt and phi shifts
-    met_up = ak.with_field(events.MET, met_up_pt, where="pt")
-    met_up = ak.with_field(met_up, met_up_phi, where="phi")
-
-    met_down = ak.with_field(events.MET, met_down_pt, where="pt")
-    met_down = ak.with_field(met_down, met_down_phi, where="phi")
-
-    # Combine into METSystematic structure
-    met_tau_systematics = ak.zip(
-        {"up": met_up, "down": met_down}, depth_limit=1, with_name="METSystematic"
-    )
-    # Attach to events.MET
-    events["MET"] = ak.with_field(events.MET, met_tau_systematics, where="tau_energy")
\ No newline at end of file
+    if apply_met_propagation:
+        met_propagator.apply(events, met_key="MET")
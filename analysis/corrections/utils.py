@@ -1,22 +1,19 @@
+import os
 import re
 import json
 import gzip
-import cloudpickle
 import correctionlib
 import numpy as np
 import awkward as ak
-import importlib.resources
-from coffea import util
 from pathlib import Path
-from typing import Type, Tuple
-from coffea.lookup_tools import extractor
-from coffea.analysis_tools import Weights
-from coffea.nanoevents.methods.base import NanoEventsArray
 from correctionlib.schemav2 import Correction, CorrectionSet
 
 
-# CorrectionLib files are available from
-POG_CORRECTION_PATH = "/cvmfs/cms.cern.ch/rsync/cms-nanoAOD/jsonpog-integration"
+# CorrectionLib files are available from (the POG_CORRECTION_PATH environment variable
+# redirects them to another root with the same layout, e.g. the benchmark stand-in payloads)
+POG_CORRECTION_PATH = os.environ.get(
+    "POG_CORRECTION_PATH", "/cvmfs/cms.cern.ch/rsync/cms-nanoAOD/jsonpog-integration"
+)
 
 # summary of pog scale factors: https://cms-nanoaod-integration.web.cern.ch/commonJSONSFs/
 POG_JSONS = {
@@ -74,22 +71,81 @@ def get_electron_hlt_json(
     return f"{Path.cwd()}/analysis/data/EGamma_HLT_{kind}_{year}.json.gz"
 
 
-def unflat_sf(sf: ak.Array, in_limit_mask: ak.Array, n: ak.Array):
+def evaluate_sf_variations(
+    correction,
+    inputs: list,
+    systs: list,
+    in_limit_mask: ak.Array,
+    syst_position: int = None,
+) -> np.ndarray:
     """
-    get scale factors for in-limit objects (otherwise assign 1).
-    Unflat array to original shape and multiply scale factors event-wise
+    evaluate a correction on flat objects for several systematic labels at once.
+    Objects outside the correction limits get a scale factor of 1
 
     Parameters:
     -----------
-        sf:
-            Array with 1D scale factors
+        correction:
+            correctionlib correction
+        inputs:
+            list of correction inputs (1D arrays or scalars) without the systematic label
+        systs:
+            list of systematic labels to evaluate. e.g. ['nominal', 'systup', 'systdown']
         in_limit_mask:
-            Array mask for events with objects within correction limits
+            Array mask for objects within correction limits
+        syst_position:
+            position of the systematic label within the correction inputs. If None, it is the last input
+
+    Returns:
+    --------
+        array of shape (number of objects, number of systematics)
+    """
+    # prepare flat input arrays once for all systematics
+    inputs = [ak.to_numpy(x) if isinstance(x, ak.Array) else x for x in inputs]
+    if syst_position is None:
+        syst_position = len(inputs)
+    sfs = np.stack(
+        [
+            correction.evaluate(
+                *inputs[:syst_position], syst, *inputs[syst_position:]
+            )
+            for syst in systs
+        ],
+        axis=-1,
+    )
+    in_limit_mask = ak.to_numpy(in_limit_mask).astype(bool)
+    return np.where(in_limit_mask[:, None], sfs, 1.0)
+
+
+def get_sf_variations(
+    correction,
+    inputs: list,
+    systs: list,
+    in_limit_mask: ak.Array,
+    n: ak.Array,
+    syst_position: int = None,
+) -> dict:
+    """
+    get event-wise scale factors for several systematic labels with a single
+    unflatten and product over all of them (see 'evaluate_sf_variations')
+
+    Parameters:
+    -----------
         n:
             Array with number of objects per event
+
+    Returns:
+    --------
+        dictionary with the event-wise scale factors of each systematic label
     """
-    sf = ak.where(in_limit_mask, sf, ak.ones_like(sf))
-    return ak.fill_none(ak.prod(ak.unflatten(sf, n), axis=1), value=1)
+    sfs = evaluate_sf_variations(
+        correction=correction,
+        inputs=inputs,
+        systs=systs,
+        in_limit_mask=in_limit_mask,
+        syst_position=syst_position,
+    )
+    sfs = ak.fill_none(ak.prod(ak.unflatten(sfs, n), axis=1), value=1)
+    return {syst: sfs[:, i] for i, syst in enumerate(systs)}
 
 
 def get_jer_cset(jer_ptres_tag: str, jer_sf_tag: str, year: str):
@@ -0,0 +1,88 @@
+import gzip
+import argparse
+import numpy as np
+from pathlib import Path
+from coffea.util import load
+import correctionlib.schemav2 as cs
+
+# convert the b-tagging efficiency lookup tables (coffea dense_lookup pickles)
+# into correctionlib JSONs: efficiency(pt, abseta, flavor)
+btag_eff_path = Path(__file__).resolve().parent.parent / "btag_efficiencies"
+
+
+def dense_lookup_to_correction(efflookup, name: str) -> cs.Correction:
+    """
+    build a correctionlib correction from a coffea 3D dense_lookup (pt, |eta|, hadron flavour)
+
+    Parameters:
+    -----------
+        efflookup:
+            coffea dense_lookup with the b-tagging efficiencies
+        name:
+            correction name
+    """
+    inputs = ["pt", "abseta", "flavor"]
+    edges = [np.asarray(axis, dtype=float).tolist() for axis in efflookup._axes]
+    values = np.asarray(efflookup._values, dtype=float)
+    return cs.Correction(
+        name=name,
+        description="MC b-tagging efficiencies",
+        version=1,
+        inputs=[
+            cs.Variable(name="pt", type="real", description="jet transverse momentum"),
+            cs.Variable(name="abseta", type="real", description="jet |eta|"),
+            cs.Variable(name="flavor", type="real", description="jet hadron flavour"),
+        ],
+        output=cs.Variable(name="efficiency", type="real"),
+        data=cs.MultiBinning(
+            nodetype="multibinning",
+            inputs=inputs,
+            edges=edges,
+            # content is flattened in row-major order
+            content=values.flatten().tolist(),
+            # dense_lookup clips out-of-range values to the edge bins
+            flow="clamp",
+        ),
+    )
+
+
+def convert(coffea_file: Path) -> Path:
+    efflookup = load(str(coffea_file))
+    name = coffea_file.stem
+    cset = cs.CorrectionSet(
+        schema_version=2,
+        description=f"{name} b-tagging efficiencies",
+        corrections=[dense_lookup_to_correction(efflookup, name)],
+    )
+    json_file = coffea_file.with_suffix(".json.gz")
+    with gzip.open(json_file, "wt") as fout:
+        fout.write(cset.json(exclude_unset=True))
+    # check the conversion
+    ceval = cset.to_evaluator()
+    pt = np.array([10.0, 25.0, 75.0, 400.0, 2000.0] * 3)
+    abseta = np.array([0.0, 0.5, 1.5, 2.4, 3.0] * 3)
+    flavor = np.repeat([0, 4, 5], 5)
+    if not np.allclose(
+        ceval[name].evaluate(pt, abseta, flavor), efflookup(pt, abseta, flavor)
+    ):
+        raise ValueError(f"Conversion of {coffea_file.name} does not match")
+    return json_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input_files",
+        nargs="*",
+        default=None,
+        help="b-tagging efficiency .coffea files to convert (default: all files in analysis/data/btag_efficiencies)",
+    )
+    args = parser.parse_args()
+
+    input_files = (
+        [Path(f) for f in args.input_files]
+        if args.input_files
+        else sorted(btag_eff_path.glob("btag_eff_*.coffea"))
+    )
+    for input_file in input_files:
+        print(f"{input_file.name} -> {convert(input_file).name}")
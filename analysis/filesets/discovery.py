@@ -0,0 +1,349 @@
+"""
+Concurrent discovery of the input filesets of data, MC and signal datasets
+
+Each dataset is queried in its own task of a bounded thread pool, through a pluggable backend:
+rucio (data and MC, with the replica of each file picked by site health score), dasgoclient
+(signal samples in prod/phys03) or a local stand-in catalogue (offline tests). The replicas of
+each dataset are cached with a TTL in 'analysis/filesets/{year}_discovery_cache.json', and each
+dataset is merged into 'fileset_{year}_NANO_lxplus.json' as soon as it is discovered, leaving
+the other datasets of the fileset untouched
+
+Usage:
+    python3 analysis/filesets/discovery.py --year 2017 --backend rucio --samples DYJetsToLL_inclusive_50
+    python3 analysis/filesets/discovery.py --year 2017 --backend local --catalogue catalogue.json
+"""
+
+import os
+import sys
+import json
+import time
+import yaml
+import fcntl
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from analysis.filesets.site_health import SiteHealth, choose_replicas, get_stats_path
+
+FILESETS_DIR = Path.cwd() / "analysis" / "filesets"
+# default lifetime (in hours) of the cached dataset replicas
+CACHE_TTL = 24.0
+
+
+@contextmanager
+def locked(path: Path):
+    """hold an exclusive lock on a file (shared by the discovery processes of a year)"""
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_json(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_json(content: dict, path: Path) -> None:
+    """write a json atomically (readers never see a partially written file)"""
+    partial = path.with_name(path.name + ".part")
+    with open(partial, "w") as f:
+        json.dump(content, f, indent=4, sort_keys=True)
+    os.replace(partial, path)
+
+
+class RucioBackend:
+    """
+    all the replicas of the files of a dataset (in the allowed sites) from rucio
+
+    Parameters:
+    -----------
+        allowlist:
+            sites where replicas are looked for
+        blocklist:
+            sites whose replicas are ignored
+    """
+
+    name = "rucio"
+
+    def __init__(self, allowlist: list, blocklist: list):
+        from coffea.dataset_tools import rucio_utils
+
+        self.rucio_utils = rucio_utils
+        self.allowlist = allowlist
+        self.blocklist = blocklist
+        # rucio clients are not shared between threads
+        self.local = threading.local()
+
+    def get_replicas(self, query: str) -> list:
+        if not hasattr(self.local, "client"):
+            self.local.client = self.rucio_utils.get_rucio_client()
+        files, sites, _ = self.rucio_utils.get_dataset_files_replicas(
+            f"/{query}",
+            allowlist_sites=self.allowlist,
+            blocklist_sites=self.blocklist,
+            mode="full",
+            client=self.local.client,
+        )
+        return [list(zip(urls, url_sites)) for urls, url_sites in zip(files, sites)]
+
+
+class DASBackend:
+    """
+    files of a (private) dataset from dasgoclient, read from a given xrootd site
+
+    Parameters:
+    -----------
+        site:
+            xrootd endpoint the files are read from
+        instance:
+            DBS instance of the datasets
+    """
+
+    name = "das"
+
+    def __init__(self, site: str, instance: str = "prod/phys03"):
+        self.site = site
+        self.instance = instance
+
+    def get_replicas(self, query: str) -> list:
+        output = subprocess.run(
+            ["dasgoclient", f"-query=file dataset=/{query} instance={self.instance}"],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        lfns = [line.strip().replace(",", "") for line in output.stdout.split("\n")]
+        return [[(f"{self.site}/{lfn}", self.site)] for lfn in lfns if lfn]
+
+
+class LocalCatalogueBackend:
+    """
+    stand-in of rucio/DAS for offline tests: a json catalogue {query: files}, where each file
+    is either an url or a list of [url, site] replicas
+
+    Parameters:
+    -----------
+        path:
+            catalogue path
+        allowlist:
+            if given, replicas of other sites are ignored
+        blocklist:
+            sites whose replicas are ignored
+        delay:
+            seconds each query takes (to emulate the catalogue latency)
+    """
+
+    name = "local"
+
+    def __init__(self, path: str, allowlist: list = None, blocklist: list = None, delay: float = 0.0):
+        self.catalogue = read_json(Path(path))
+        self.allowlist = allowlist
+        self.blocklist = blocklist or []
+        self.delay = delay
+
+    def is_allowed(self, site: str) -> bool:
+        if site is None:
+            return True
+        return site not in self.blocklist and (self.allowlist is None or site in self.allowlist)
+
+    def get_replicas(self, query: str) -> list:
+        time.sleep(self.delay)
+        if query not in self.catalogue:
+            raise KeyError(f"Dataset {query} is not in the catalogue")
+        files = [[(f, None)] if isinstance(f, str) else f for f in self.catalogue[query]]
+        return [
+            [(url, site) for url, site in replicas if self.is_allowed(site)]
+            for replicas in files
+        ]
+
+
+def get_fileset_key(sample: str) -> str:
+    """fileset key of a sample (data eras split in several samples are merged)"""
+    return sample.split("_")[0] if sample.startswith("Single") else sample
+
+
+class FilesetDiscovery:
+    """
+    discover the files of the datasets of a year concurrently and merge them into the fileset
+
+    Parameters:
+    -----------
+        year:
+            dataset year
+        backend:
+            backend answering the dataset queries (get_replicas(query) method)
+        max_workers:
+            number of concurrent dataset queries
+        ttl:
+            lifetime (in hours) of the cached dataset replicas
+        scores:
+            site health scores used to pick the file replicas. If None, files are spread
+            evenly over the sites of their replicas
+        filesets_dir:
+            directory of the dataset configs, fileset and cache
+    """
+
+    def __init__(
+        self,
+        year: str,
+        backend,
+        max_workers: int = 8,
+        ttl: float = CACHE_TTL,
+        scores: dict = None,
+        filesets_dir: Path = FILESETS_DIR,
+    ):
+        self.year = year
+        self.backend = backend
+        self.max_workers = max_workers
+        self.ttl = ttl * 3600
+        self.scores = scores
+        self.cache_path = Path(filesets_dir) / f"{year}_discovery_cache.json"
+        self.fileset_path = Path(filesets_dir) / f"fileset_{year}_NANO_lxplus.json"
+
+    def get_cached(self, query: str):
+        """return the cached replicas of a dataset (None if missing or expired)"""
+        with locked(self.cache_path):
+            entry = read_json(self.cache_path).get(query)
+        if entry is None or time.time() - entry["time"] > self.ttl:
+            return None
+        return entry["replicas"]
+
+    def cache(self, query: str, replicas: list) -> None:
+        with locked(self.cache_path):
+            cache = read_json(self.cache_path)
+            cache[query] = {"time": time.time(), "backend": self.backend.name, "replicas": replicas}
+            write_json(cache, self.cache_path)
+
+    def get_replicas(self, query: str, refresh: bool = False) -> list:
+        replicas = None if refresh else self.get_cached(query)
+        if replicas is None:
+            replicas = self.backend.get_replicas(query)
+            self.cache(query, replicas)
+        return replicas
+
+    def merge(self, files: dict) -> None:
+        """update some fileset keys {key: files} of the fileset (the other keys are kept)"""
+        with locked(self.fileset_path):
+            fileset = read_json(self.fileset_path)
+            fileset.update(files)
+            write_json(fileset, self.fileset_path)
+
+    def discover(self, queries: dict, refresh: bool = False) -> dict:
+        """
+        discover the files of some samples and merge them into the fileset as they complete
+
+        Parameters:
+        -----------
+            queries:
+                dictionary {sample: dataset query}
+            refresh:
+                if True, the cache is ignored
+
+        Returns:
+        --------
+            dictionary {sample: files} of the discovered samples (failed samples are reported)
+        """
+        # samples merged into the same fileset key are merged together
+        groups = {}
+        for sample in queries:
+            groups.setdefault(get_fileset_key(sample), []).append(sample)
+        discovered, pending = {}, {key: len(samples) for key, samples in groups.items()}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.get_replicas, query, refresh): sample
+                for sample, query in queries.items()
+            }
+            for future in as_completed(futures):
+                sample = futures[future]
+                key = get_fileset_key(sample)
+                try:
+                    replicas = [r for r in future.result() if r]
+                except Exception as e:
+                    print(f"Could not discover {sample}: {type(e).__name__}: {e}")
+                    groups.pop(key, None)
+                    continue
+                discovered[sample] = choose_replicas(replicas, self.scores)
+                print(f"Discovered {sample}: {len(discovered[sample])} files")
+                pending[key] -= 1
+                if key in groups and pending[key] == 0:
+                    self.merge({key: [f for s in groups[key] for f in discovered[s]]})
+        return discovered
+
+
+def get_dataset_queries(year: str, samples: list = None, signal: bool = None) -> dict:
+    """
+    return the dataset queries {sample: query} of a year
+
+    Parameters:
+    -----------
+        year:
+            dataset year
+        samples:
+            samples to query. If None, all the samples of the year
+        signal:
+            if True (False), only the signal (data and MC) samples. If None, all samples
+    """
+    run_key = "Run3" if year.startswith("2022") or year.startswith("2023") else "Run2"
+    nano_version = "nanov9" if run_key == "Run2" else "nanov12"
+    with open(FILESETS_DIR / f"{year}_{nano_version}.yaml", "r") as f:
+        dataset_configs = yaml.safe_load(f)
+    if samples:
+        # data eras merged into the same fileset key are always queried together
+        keys = {get_fileset_key(sample) for sample in samples}
+        samples = [s for s in dataset_configs if get_fileset_key(s) in keys]
+    else:
+        samples = list(dataset_configs)
+    if signal is not None:
+        samples = [s for s in samples if s.lower().startswith("signal") == signal]
+    return {sample: dataset_configs[sample]["query"] for sample in samples}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "-y",
+        "--year",
+        dest="year",
+        type=str,
+        choices=["2016preVFP", "2016postVFP", "2017", "2018", "2022preEE", "2022postEE", "2023preBPix", "2023postBPix"],
+    )
+    parser.add_argument("--samples", nargs="*", type=str, help="(Optional) List of samples to use. If omitted, all available samples will be used")
+    parser.add_argument("--backend", type=str, default="rucio", choices=["rucio", "das", "local"], help="rucio (data and MC samples), das (signal samples) or a local catalogue (all samples)")
+    parser.add_argument("--replicas_strategy", type=str, default="score", choices=["score", "round-robin"], help="pick each file replica by site health score or spread the files evenly over the sites")
+    parser.add_argument("--site", type=str, default="root://xrootd-vanderbilt.sites.opensciencegrid.org:1094", help="site from which to read the signal samples (das backend)")
+    parser.add_argument("--catalogue", type=str, help="json catalogue of the local backend")
+    parser.add_argument("--workers", type=int, default=8, help="number of concurrent dataset queries")
+    parser.add_argument("--ttl", type=float, default=CACHE_TTL, help="lifetime (in hours) of the cached dataset replicas")
+    parser.add_argument("--refresh", action="store_true", help="ignore the cached dataset replicas")
+    args = parser.parse_args()
+
+    sites_file = FILESETS_DIR / f"{args.year}_sites.yaml"
+    with open(sites_file, "r") as f:
+        sites = yaml.safe_load(f)
+    if args.backend == "rucio":
+        backend = RucioBackend(sites["white"], sites["black"])
+        queries = get_dataset_queries(args.year, args.samples, signal=False)
+    elif args.backend == "das":
+        backend = DASBackend(args.site)
+        queries = get_dataset_queries(args.year, args.samples, signal=True)
+    else:
+        if args.catalogue is None:
+            raise ValueError("Please specify the catalogue of the local backend (--catalogue)")
+        backend = LocalCatalogueBackend(args.catalogue, sites["white"], sites["black"])
+        queries = get_dataset_queries(args.year, args.samples)
+    scores = None
+    if args.replicas_strategy == "score":
+        scores = SiteHealth.load(get_stats_path(args.year)).get_scores(sites["white"])
+
+    discovery = FilesetDiscovery(args.year, backend, args.workers, args.ttl, scores)
+    discovery.discover(queries, args.refresh)
@@ -0,0 +1,145 @@
+"""
+Generator weight sums of the NanoAOD files, read from their 'Runs' tree
+
+The genEventSumw and genEventCount of each file (and its number of events) are read once and cached
+in the fileset metadata index 'analysis/filesets/{year}_fileset_metadata.json', keyed by LFN so all
+the replicas of a file share their entry. Jobs sum them over their input files (reading the files
+missing from the index) and store them in the output metadata ('norm'), so the normalisation of a
+dataset is accumulated with its outputs and does not depend on the events actually processed
+
+Usage:
+    python3 analysis/filesets/normalisation.py --year 2017 --samples DYJetsToLL_inclusive_50
+"""
+
+import sys
+import uproot
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from analysis.utils.staging import get_replicas
+from analysis.filesets.discovery import FILESETS_DIR, locked, read_json, write_json
+
+# sums of the file entries stored in the output metadata
+NORM_FIELDS = ["genEventSumw", "genEventCount", "nevents"]
+
+
+def get_index_path(year: str, filesets_dir: Path = FILESETS_DIR) -> Path:
+    return Path(filesets_dir) / f"{year}_fileset_metadata.json"
+
+
+def get_file_key(url: str) -> str:
+    """index key of a file: its LFN (shared by all its replicas) or the url of non-CMS files"""
+    return url[url.index("/store/") :] if "/store/" in url else url
+
+
+def read_runs(url: str) -> dict:
+    """
+    read the generator weight sums and number of events of a NanoAOD file (trying its replicas)
+
+    Returns:
+    --------
+        dictionary with the 'genEventSumw' and 'genEventCount' sums of the 'Runs' tree (None for
+        data) and the number of events 'nevents' of the 'Events' tree
+    """
+    errors = []
+    for replica in get_replicas(url):
+        try:
+            with uproot.open(replica) as f:
+                entry = {"genEventSumw": None, "genEventCount": None}
+                if "Runs" in f and "genEventSumw" in f["Runs"]:
+                    runs = f["Runs"].arrays(["genEventSumw", "genEventCount"], library="np")
+                    entry["genEventSumw"] = float(runs["genEventSumw"].sum())
+                    entry["genEventCount"] = int(runs["genEventCount"].sum())
+                entry["nevents"] = int(f["Events"].num_entries)
+                return entry
+        except OSError as e:
+            errors.append(f"{replica}: {e}")
+    raise OSError(f"Could not read the 'Runs' tree of {url} ({'; '.join(errors)})")
+
+
+class FilesetMetadataIndex:
+    """
+    cache of the generator weight sums of the files of a year
+
+    Parameters:
+    -----------
+        year:
+            dataset year
+        filesets_dir:
+            directory of the index
+    """
+
+    def __init__(self, year: str, filesets_dir: Path = FILESETS_DIR):
+        self.path = get_index_path(year, filesets_dir)
+        self.entries = read_json(self.path)
+
+    def get(self, url: str) -> dict:
+        """return the index entry of a file (None if missing)"""
+        return self.entries.get(get_file_key(url))
+
+    def update(self, files: list, max_workers: int = 8) -> int:
+        """
+        read the files missing from the index (concurrently) and save them.
+        Returns the number of files read
+        """
+        missing = list(dict.fromkeys(f for f in files if self.get(f) is None))
+        if not missing:
+            return 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            entries = dict(zip(map(get_file_key, missing), executor.map(read_runs, missing)))
+        # other processes may have updated the index meanwhile
+        with locked(self.path):
+            self.entries = {**read_json(self.path), **entries}
+            write_json(self.entries, self.path)
+        return len(missing)
+
+
+def get_files_norm(files: list, index: FilesetMetadataIndex = None) -> dict:
+    """
+    sum the generator weight sums of some files (read from the index, or from the files missing
+    from it). 'genEventSumw' and 'genEventCount' are zero for data
+
+    Returns:
+    --------
+        dictionary with the summed NORM_FIELDS and the number of 'files'
+    """
+    norm = {field: 0 for field in NORM_FIELDS}
+    for url in files:
+        entry = index.get(url) if index is not None else None
+        if entry is None:
+            entry = read_runs(url)
+        for field in NORM_FIELDS:
+            norm[field] += entry[field] or 0
+    norm["files"] = len(files)
+    return norm
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "-y",
+        "--year",
+        dest="year",
+        type=str,
+        choices=["2016preVFP", "2016postVFP", "2017", "2018", "2022preEE", "2022postEE", "2023preBPix", "2023postBPix"],
+    )
+    parser.add_argument("--samples", nargs="*", type=str, help="(Optional) List of samples to index. If omitted, all the samples of the fileset")
+    parser.add_argument("--workers", type=int, default=8, help="number of files read concurrently")
+    args = parser.parse_args()
+
+    fileset = read_json(FILESETS_DIR / f"fileset_{args.year}_NANO_lxplus.json")
+    samples = args.samples or list(fileset)
+    index = FilesetMetadataIndex(args.year)
+    for sample in samples:
+        if sample not in fileset:
+            print(f"{sample} is not in the fileset")
+            continue
+        n_read = index.update(fileset[sample], args.workers)
+        norm = get_files_norm(fileset[sample], index)
+        print(
+            f"{sample}: {norm['files']} files ({n_read} read), {norm['nevents']} events, "
+            f"genEventCount {norm['genEventCount']}, genEventSumw {norm['genEventSumw']:.6g}"
+        )
@@ -0,0 +1,308 @@
+"""
+Per-site health scores of the xrootd input sites, from the telemetry of past condor jobs
+
+The throughput (bytes read per second of job wall time), input file open latency and xrootd error
+rate of the jobs served by each site are accumulated with an exponential time decay, and stored in
+'analysis/filesets/{year}_site_stats.yaml' (next to the '{year}_sites.yaml' white/black lists).
+The scores are used by discovery.py to pick the replica of each file
+
+Usage:
+    python3 analysis/filesets/site_health.py --year 2017
+"""
+
+import sys
+import yaml
+import sqlite3
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from analysis.filesets.xrootd_sites import xroot_to_site
+
+# half-life (in days) of the telemetry weight
+HALF_LIFE = 7.0
+# pseudo-jobs of the error rate prior and prior error rate (sites without telemetry)
+PRIOR_JOBS = 2.0
+PRIOR_ERROR_RATE = 0.1
+# open latency (in seconds) at which the score of a site is halved
+LATENCY_SCALE = 5.0
+# decayed sums kept per site
+STATS_FIELDS = [
+    "jobs",
+    "errors",
+    "throughput",
+    "throughput_weight",
+    "latency",
+    "latency_weight",
+]
+
+
+def get_stats_path(year: str) -> Path:
+    return Path.cwd() / "analysis" / "filesets" / f"{year}_site_stats.yaml"
+
+
+def get_endpoint_site(endpoint: str) -> str:
+    """return the site of an xrootd endpoint (the endpoint itself if unknown)"""
+    return xroot_to_site.get(endpoint, endpoint)
+
+
+def get_job_key(job) -> str:
+    """return the key ('{dataset}:{jobnum}:{attempts}') of an attempt of a ledger job"""
+    return f"{job['dataset']}:{job['jobnum']}:{job['attempts']}"
+
+
+def to_timestamp(value) -> float:
+    """return the unix time of a ledger time ('YYYY-MM-DD HH:MM:SS') or of a unix time"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+class SiteHealth:
+    """
+    time-decayed telemetry and health scores of the input sites
+
+    Parameters:
+    -----------
+        stats:
+            stored stats ({'sites': {site: decayed sums}, 'ledgers': {ledger: ingested job keys}})
+        half_life:
+            half-life (in days) of the telemetry weight
+    """
+
+    def __init__(self, stats: dict = None, half_life: float = HALF_LIFE):
+        stats = stats or {}
+        self.sites = stats.get("sites", {})
+        self.ledgers = stats.get("ledgers", {})
+        self.half_life = half_life * 86400
+
+    @classmethod
+    def load(cls, path: str, half_life: float = HALF_LIFE):
+        if not Path(path).exists():
+            return cls(half_life=half_life)
+        with open(path, "r") as f:
+            return cls(yaml.safe_load(f), half_life)
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            yaml.dump(
+                {"sites": self.sites, "ledgers": self.ledgers}, f, default_flow_style=False
+            )
+
+    def add_observation(
+        self,
+        site: str,
+        time: float,
+        bytes_per_s: float = None,
+        open_latency: float = None,
+        error: bool = False,
+    ) -> None:
+        """
+        add the telemetry of a job read from a site
+
+        Parameters:
+        -----------
+            site:
+                input site of the job
+            time:
+                unix time of the observation (job end)
+            bytes_per_s:
+                bytes read per second of job wall time
+            open_latency:
+                seconds to open an input file
+            error:
+                whether the job failed reading from the site
+        """
+        record = self.sites.setdefault(
+            site, {"updated": time, **{field: 0.0 for field in STATS_FIELDS}}
+        )
+        # decay the sums to the latest observation (older observations are decayed instead)
+        if time > record["updated"]:
+            decay = 0.5 ** ((time - record["updated"]) / self.half_life)
+            for field in STATS_FIELDS:
+                record[field] *= decay
+            record["updated"] = time
+        weight = 0.5 ** ((record["updated"] - time) / self.half_life)
+        record["jobs"] += weight
+        record["errors"] += weight * error
+        if bytes_per_s is not None:
+            record["throughput"] += weight * bytes_per_s
+            record["throughput_weight"] += weight
+        if open_latency is not None:
+            record["latency"] += weight * open_latency
+            record["latency_weight"] += weight
+
+    def update_from_ledger(self, path: str) -> int:
+        """
+        add the telemetry of the jobs of a job ledger not ingested yet
+
+        Each job attempt (dataset, jobnum, attempts) is ingested once, whatever the order in which
+        the ledger records the jobs. Jobs done contribute their throughput and open latency, jobs
+        failed with xrootd errors contribute an error to each failing endpoint site. Returns the
+        number of added jobs
+        """
+        connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        connection.row_factory = sqlite3.Row
+        columns = [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]
+        ended_jobs = connection.execute(
+            """
+            SELECT * FROM jobs WHERE end_time IS NOT NULL
+            AND (status = 'done' OR failure_class = 'xrootd') ORDER BY end_time
+            """
+        ).fetchall()
+        connection.close()
+        ingested = self.ledgers.get(str(path), [])
+        if isinstance(ingested, str):
+            # stats saved with the end time of the last ingested job
+            ingested = [get_job_key(job) for job in ended_jobs if job["end_time"] <= ingested]
+        ingested = set(ingested)
+        jobs = [job for job in ended_jobs if get_job_key(job) not in ingested]
+        for job in jobs:
+            time = to_timestamp(job["end_time"])
+            if job["status"] == "done":
+                if job["input_site"] is None:
+                    continue
+                bytes_read = job["bytes_read"] if "bytes_read" in columns else None
+                self.add_observation(
+                    job["input_site"],
+                    time,
+                    bytes_per_s=(
+                        bytes_read / job["wall_time"]
+                        if bytes_read and job["wall_time"]
+                        else None
+                    ),
+                    open_latency=job["open_latency"] if "open_latency" in columns else None,
+                )
+            else:
+                endpoints = (job["xrootd_errors"] or "").split(",")
+                sites = {get_endpoint_site(e) for e in endpoints if e} or {job["input_site"]}
+                for site in sites - {None}:
+                    self.add_observation(site, time, error=True)
+            ingested.add(get_job_key(job))
+        # attempts replaced in the ledger (resubmitted jobs) can not be read again
+        self.ledgers[str(path)] = sorted(ingested & {get_job_key(job) for job in ended_jobs})
+        return len(jobs)
+
+    def get_site_metrics(self, site: str) -> dict:
+        """return the mean throughput and open latency (None if unknown) and the error rate of a site"""
+        record = self.sites.get(site, {field: 0.0 for field in STATS_FIELDS})
+        return {
+            "throughput": (
+                record["throughput"] / record["throughput_weight"]
+                if record["throughput_weight"] > 0
+                else None
+            ),
+            "open_latency": (
+                record["latency"] / record["latency_weight"]
+                if record["latency_weight"] > 0
+                else None
+            ),
+            "error_rate": (record["errors"] + PRIOR_JOBS * PRIOR_ERROR_RATE)
+            / (record["jobs"] + PRIOR_JOBS),
+            "jobs": record["jobs"],
+        }
+
+    def get_scores(self, sites: list) -> dict:
+        """
+        return the health score of each site: throughput * (1 - error rate) / (1 + latency / LATENCY_SCALE)
+
+        Sites without throughput (or latency) telemetry get the median of the known sites, so
+        they are neither favoured nor starved
+        """
+        metrics = {site: self.get_site_metrics(site) for site in sites}
+        defaults = {}
+        for key, fallback in [("throughput", 1.0), ("open_latency", 0.0)]:
+            known = sorted(
+                m[key] for m in self.get_all_metrics().values() if m[key] is not None
+            )
+            defaults[key] = known[len(known) // 2] if known else fallback
+        scores = {}
+        for site, m in metrics.items():
+            throughput = m["throughput"] if m["throughput"] is not None else defaults["throughput"]
+            latency = (
+                m["open_latency"] if m["open_latency"] is not None else defaults["open_latency"]
+            )
+            scores[site] = throughput * (1 - m["error_rate"]) / (1 + latency / LATENCY_SCALE)
+        return scores
+
+    def get_all_metrics(self) -> dict:
+        return {site: self.get_site_metrics(site) for site in self.sites}
+
+
+def choose_replicas(files_replicas: list, scores: dict) -> list:
+    """
+    pick the replica of each file by site score
+
+    Files are assigned in turn to the replica site maximizing score / (1 + files already assigned
+    to the site), so each site gets a share of the files proportional to its score instead of
+    all files going to the best site
+
+    Parameters:
+    -----------
+        files_replicas:
+            list (one item per file) of lists of (url, site) replicas
+        scores:
+            site health scores. If None, all sites have the same score (files are spread evenly)
+
+    Returns:
+    --------
+        list with the url of the chosen replica of each file
+    """
+    assigned = {}
+    chosen = []
+    for replicas in files_replicas:
+        url, site = max(
+            replicas,
+            key=lambda replica: (1.0 if scores is None else scores.get(replica[1], 0.0))
+            / (1 + assigned.get(replica[1], 0)),
+        )
+        assigned[site] = assigned.get(site, 0) + 1
+        chosen.append(url)
+    return chosen
+
+
+def update_site_stats(year: str, ledger_paths: list = None) -> SiteHealth:
+    """
+    update the site stats of a year from the job ledgers (by default, those of all the
+    campaigns of the year under condor/) and save them
+
+    Returns:
+    --------
+        updated SiteHealth
+    """
+    if ledger_paths is None:
+        ledger_paths = sorted((Path.cwd() / "condor").glob(f"**/{year}/jobs.db"))
+    stats_path = get_stats_path(year)
+    health = SiteHealth.load(stats_path)
+    for ledger_path in ledger_paths:
+        health.update_from_ledger(ledger_path)
+    health.save(stats_path)
+    return health
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "-y",
+        "--year",
+        dest="year",
+        type=str,
+        choices=["2016preVFP", "2016postVFP", "2017", "2018", "2022preEE", "2022postEE", "2023preBPix", "2023postBPix"],
+    )
+    parser.add_argument("--ledgers", nargs="*", help="(Optional) job ledgers to read. If omitted, all ledgers of the year under condor/ are read")
+    args = parser.parse_args()
+
+    health = update_site_stats(args.year, args.ledgers)
+    metrics = health.get_all_metrics()
+    scores = health.get_scores(list(metrics))
+    print(f"{'site':<25}{'jobs':>8}{'MB/s':>10}{'open [s]':>10}{'errors':>8}{'score':>10}")
+    for site in sorted(scores, key=scores.get, reverse=True):
+        m = metrics[site]
+        throughput = f"{m['throughput'] / 1e6:.2f}" if m["throughput"] is not None else "-"
+        latency = f"{m['open_latency']:.2f}" if m["open_latency"] is not None else "-"
+        print(
+            f"{site:<25}{m['jobs']:>8.1f}{throughput:>10}{latency:>10}"
+            f"{100 * m['error_rate']:>7.1f}%{scores[site] / 1e6:>10.2f}"
+        )
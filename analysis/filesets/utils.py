@@ -172,18 +172,17 @@ def fileset_checker(samples: list, year: str):
     filesets_path = Path.cwd() / "analysis" / "filesets"
     fileset_file = filesets_path / f"fileset_{year}_NANO_lxplus.json"
 
-    build_input_fileset = False
-    if not fileset_file.exists():
-        build_input_fileset = True
-    else:
+    missing_samples = samples
+    if fileset_file.exists():
         with open(fileset_file, "r") as f:
             filesets = json.load(f)
-        build_input_fileset = any(ds not in filesets for ds in samples)
+        # only the missing samples are discovered (and merged into the existing fileset)
+        missing_samples = [ds for ds in samples if ds not in filesets]
 
-    if build_input_fileset:
+    if missing_samples:
         print("\nBuilding input filesets for:")
-        print(yaml.dump(samples, default_flow_style=False, sort_keys=False, indent=2))
-        cmd = f"python3 fetch.py --year {year} --samples {' '.join(samples)}"
+        print(yaml.dump(missing_samples, default_flow_style=False, sort_keys=False, indent=2))
+        cmd = f"python3 fetch.py --year {year} --samples {' '.join(missing_samples)}"
         subprocess.run(cmd, shell=True)
 
 
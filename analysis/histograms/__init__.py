@@ -1,3 +1,4 @@
 from analysis.histograms.hist_builder import HistBuilder as HistBuilder
 from analysis.histograms.hist_filler import fill_histograms as fill_histograms
+from analysis.histograms.hist_accumulator import accumulate_outputs as accumulate_outputs
 from analysis.histograms.histogram_config import VariableAxis, RegularAxis, IntCategoryAxis, IntegerAxis, StrCategoryAxis, HistogramConfig, BooleanAxis
\ No newline at end of file
@@ -0,0 +1,175 @@
+import copy
+import hist
+import numpy as np
+from coffea.processor import accumulate
+
+# storages whose bins can be merged by summing the raw storage arrays
+ADDITIVE_STORAGES = (hist.storage.Double, hist.storage.Int64, hist.storage.Weight)
+CATEGORY_AXES = (hist.axis.StrCategory, hist.axis.IntCategory)
+
+
+def is_category_axis(axis) -> bool:
+    return isinstance(axis, CATEGORY_AXES) and axis.traits.growth
+
+
+def get_aligned_axes(histograms: list):
+    """
+    return the axes of the merged histogram, or None if the histograms can not be merged
+    by summing their storage arrays. Growing category axes (e.g. 'variation') may have
+    different categories, which are aligned to the union of categories; every other axis must match
+    """
+    reference = histograms[0]
+    if not issubclass(reference.storage_type, ADDITIVE_STORAGES):
+        return None
+    union_categories = [
+        list(axis) if is_category_axis(axis) else None for axis in reference.axes
+    ]
+    for histogram in histograms[1:]:
+        if histogram.storage_type is not reference.storage_type:
+            return None
+        if len(histogram.axes) != len(reference.axes):
+            return None
+        for i, (axis, reference_axis) in enumerate(zip(histogram.axes, reference.axes)):
+            if is_category_axis(reference_axis):
+                if (
+                    type(axis) is not type(reference_axis)
+                    or axis.name != reference_axis.name
+                    or not axis.traits.growth
+                ):
+                    return None
+                for category in axis:
+                    if category not in union_categories[i]:
+                        union_categories[i].append(category)
+            elif axis != reference_axis:
+                return None
+    axes = []
+    for axis, categories in zip(reference.axes, union_categories):
+        if categories is None or len(categories) == len(axis):
+            axes.append(axis)
+        else:
+            axes.append(
+                type(axis)(
+                    categories,
+                    name=axis.name,
+                    label=axis.__dict__.get("label", ""),
+                    growth=True,
+                )
+            )
+    return axes
+
+
+def get_bin_index(axis, merged_axis):
+    """
+    return the (flow) bins of 'merged_axis' matching the bins of 'axis': a slice if the
+    bins of 'axis' are the first bins of 'merged_axis', otherwise an index array
+    """
+    if not is_category_axis(merged_axis):
+        return slice(None)
+    index = np.array([merged_axis.index(category) for category in axis], dtype=int)
+    if np.array_equal(index, np.arange(len(index))):
+        return slice(0, len(index))
+    return index
+
+
+def add_view(merged_view: np.ndarray, view: np.ndarray, bin_index: list) -> None:
+    """add a storage array into the (flow) storage array of the merged histogram in-place"""
+    if all(isinstance(index, slice) for index in bin_index):
+        selector = tuple(bin_index)
+    else:
+        selector = np.ix_(
+            *[
+                np.arange(size)[index] if isinstance(index, slice) else index
+                for index, size in zip(bin_index, merged_view.shape)
+            ]
+        )
+    if merged_view.dtype.names:
+        # weighted storage: sum of weights and sum of squared weights
+        for field in merged_view.dtype.names:
+            field_view = merged_view[field]
+            field_view[selector] += view[field]
+    else:
+        merged_view[selector] += view
+
+
+def merge_histograms(histograms: list, in_place: bool = False) -> hist.Hist:
+    """
+    sum histograms by adding their raw (flow) storage arrays into a preallocated result.
+
+    Axes compatibility is checked once for the whole group. If the histograms can not be
+    aligned (different binning, non-additive storage, ...) hist semantics are used instead
+
+    Parameters:
+    -----------
+        histograms:
+            histograms to merge
+        in_place:
+            if True, the first histogram may be used (and modified) as the result
+    """
+    if len(histograms) == 1:
+        return histograms[0] if in_place else histograms[0].copy()
+    axes = get_aligned_axes(histograms)
+    if axes is None:
+        if in_place:
+            return accumulate(histograms[1:], accum=histograms[0])
+        return accumulate(histograms)
+
+    reference = histograms[0]
+    to_add = histograms
+    if in_place and all(
+        axis is reference_axis for axis, reference_axis in zip(axes, reference.axes)
+    ):
+        merged = reference
+        to_add = histograms[1:]
+    else:
+        merged = hist.Hist(*axes, storage=reference.storage_type())
+    merged_view = np.asarray(merged.view(flow=True))
+    for histogram in to_add:
+        bin_index = [
+            get_bin_index(axis, merged_axis)
+            for axis, merged_axis in zip(histogram.axes, merged.axes)
+        ]
+        add_view(merged_view, np.asarray(histogram.view(flow=True)), bin_index)
+    return merged
+
+
+def merge_outputs(items: list, in_place: bool):
+    """merge a group of accumulatables, dispatching histograms to merge_histograms"""
+    if len(items) == 1:
+        return items[0] if in_place else copy.deepcopy(items[0])
+    if all(isinstance(item, hist.Hist) for item in items):
+        return merge_histograms(items, in_place=in_place)
+    if all(type(item) is dict for item in items):
+        merged = items[0] if in_place else {}
+        for key in dict.fromkeys(key for item in items for key in item):
+            values = [item[key] for item in items if key in item]
+            # values of the first item can be reused if it is merged in-place
+            reuse_first = in_place and key in items[0]
+            merged[key] = merge_outputs(values, in_place=reuse_first)
+        return merged
+    if in_place:
+        return accumulate(items[1:], accum=items[0])
+    return accumulate(items)
+
+
+def accumulate_outputs(items, accum=None):
+    """
+    accumulate processor outputs (nested dictionaries of histograms and metadata).
+
+    Drop-in replacement of coffea's processor.accumulate: histograms of each merge group are
+    aligned once and summed in-place into a preallocated histogram
+
+    Parameters:
+    -----------
+        items:
+            outputs to accumulate
+        accum:
+            if given, outputs are accumulated into (and may modify) this output
+    """
+    items = [item for item in items if item is not None]
+    if accum is not None:
+        return merge_outputs([accum] + items, in_place=True)
+    if not items:
+        return None
+    if len(items) == 1:
+        return items[0]
+    return merge_outputs(items, in_place=False)
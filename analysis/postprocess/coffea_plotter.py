@@ -1,6 +1,10 @@
+import time
 import yaml
 import logging
+import tarfile
 import numpy as np
+import pandas as pd
+import multiprocessing
 import mplhep as hep
 import matplotlib.pyplot as plt
 from pathlib import Path
@@ -9,14 +13,13 @@ from matplotlib.lines import Line2D
 from coffea.processor import accumulate
 from hist.intervals import poisson_interval
 from matplotlib.offsetbox import AnchoredText
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from analysis.filesets.utils import get_process_maps
 from analysis.histograms import VariableAxis, IntegerAxis
 from analysis.workflows.config import WorkflowConfigBuilder
-from analysis.postprocess.utils import (
-    setup_logger,
-    divide_by_binwidth,
-    get_variations_keys,
-)
+from analysis.postprocess.histogram_store import HistogramStore
+from analysis.postprocess.systematics import VariationProjector, get_envelope
+from analysis.postprocess.utils import setup_logger, divide_by_binwidth
 
 np.seterr(invalid="ignore")
 np.seterr(divide="ignore")
@@ -29,11 +32,19 @@ class CoffeaPlotter:
         year: str,
         processed_histograms: dict,
         output_dir: str,
+        projector: VariationProjector = None,
     ):
         self.workflow = workflow
         self.year = year
+        # processed histograms dictionary or (lazy) HistogramStore
         self.processed_histograms = processed_histograms
         self.output_dir = output_dir
+        # (variation, bin) projections, shared with the results and uncertainty tables
+        if projector is None:
+            projector = VariationProjector(processed_histograms)
+        self.projector = projector
+        # figure and axes templates by layout (with/without ratio panel)
+        self.figures = {}
 
         # get histogram config
         config_builder = WorkflowConfigBuilder(workflow=workflow)
@@ -58,6 +69,16 @@ class CoffeaPlotter:
             color_map = yaml.safe_load(f)
         self.color_map = {p: c for p, c in color_map.items() if p in processes}
 
+    def get_process_histogram(self, process, variable, category):
+        """returns the process histogram with a 'variable' axis"""
+        histogram_name = self.projector.find_histogram(process, variable)
+        if isinstance(self.processed_histograms, HistogramStore):
+            # read only the plotted category from the store
+            return self.processed_histograms.get(
+                process, histogram_name, category=category
+            )
+        return self.processed_histograms[process][histogram_name]
+
     def get_histogram(
         self,
         variable,
@@ -78,52 +99,23 @@ class CoffeaPlotter:
             histogram = divide_by_binwidth(histogram)
         return histogram
 
-    def get_variations(
-        self,
-        variable,
-        category,
-        variation,
-        histogram,
-    ):
-        """returns variation histogram by processes/variable/category"""
-        # get variable histogram for nominal variation and category
-        selectorup = {"variation": f"{variation}Up"}
-        selectordown = {"variation": f"{variation}Down"}
-        if "category" in histogram.axes.name:
-            selectorup["category"] = category
-            selectordown["category"] = category
-        histogram_up = histogram[selectorup].project(variable)
-        histogram_down = histogram[selectordown].project(variable)
+    def get_variations(self, variable, category, processes):
+        """returns the (variation, bin) projection of the sum of processes/variable/category"""
+        projection = self.projector.get_total(processes, variable, category)
         # if axis type is variable divide by bin width
         if isinstance(self.histogram_config.axes[variable], VariableAxis):
-            histogram_up = divide_by_binwidth(histogram_up)
-            histogram_down = divide_by_binwidth(histogram_down)
-
-        return histogram_up, histogram_down
+            projection = projection.scale(1 / np.diff(projection.edges))
+        return projection
 
     def collect_histograms_for_plotting(self, variable, category, blind):
         histogram_info = {}
         if "mc" in self.datasets:
-            histogram_info["mc"] = {"nominal": {}, "variations": {}}
+            histogram_info["mc"] = {"nominal": {}, "variations": None}
         if "signal" in self.datasets:
             histogram_info["signal"] = {"nominal": {}}
 
-        for process, histogram_dict in self.processed_histograms.items():
-            axis_exists = False
-            if variable in histogram_dict:
-                aux_histogram = histogram_dict[variable]
-                axis_exists = True
-            else:
-                for key in histogram_dict:
-                    if variable in histogram_dict[key].axes.name:
-                        aux_histogram = histogram_dict[key]
-                        axis_exists = True
-                        break
-
-            if not axis_exists:
-                raise ValueError(
-                    f"'{variable}' axis not found in workflow's output histogram"
-                )
+        for process in self.processed_histograms:
+            aux_histogram = self.get_process_histogram(process, variable, category)
 
             if process == "Data":
                 histogram_info["data"] = self.get_histogram(
@@ -144,65 +136,31 @@ class CoffeaPlotter:
                     variation="nominal",
                     histogram=aux_histogram,
                 )
-                # save variations histograms
-                if (key == "mc") and ("variation" in aux_histogram.axes.name):
-                    for variation in get_variations_keys(self.processed_histograms):
-                        var_cats = [v for v in aux_histogram.axes["variation"]]
-                        if not f"{variation}Up" in var_cats:
-                            continue
-                        up, down = self.get_variations(
-                            variable=variable,
-                            category=category,
-                            variation=variation,
-                            histogram=aux_histogram,
-                        )
-                        if f"{variation}Up" in histogram_info[key]["variations"]:
-                            histogram_info[key]["variations"][f"{variation}Up"] += up
-                            histogram_info[key]["variations"][f"{variation}Down"] += up
-                        else:
-                            histogram_info[key]["variations"][f"{variation}Up"] = up
-                            histogram_info[key]["variations"][f"{variation}Down"] = down
+        if "mc" in histogram_info:
+            # save variations of the total MC
+            histogram_info["mc"]["variations"] = self.get_variations(
+                variable=variable,
+                category=category,
+                processes=list(histogram_info["mc"]["nominal"]),
+            )
 
         return histogram_info
 
     def plot_uncert_band(self, histogram_info, ax):
-        if histogram_info["mc"]["variations"]:
-            # initialize up/down errors with statisticall error
-            mcstat_err2 = self.nominal_variances
-            err2_up = mcstat_err2
-            err2_down = mcstat_err2
-            for variation in get_variations_keys(self.processed_histograms):
-                # Up/down variations for a single MC sample
-                var_up = histogram_info["mc"]["variations"][f"{variation}Up"].values()
-                var_down = histogram_info["mc"]["variations"][
-                    f"{variation}Down"
-                ].values()
-                # Compute the uncertainties corresponding to the up/down variations
-                err_up = var_up - self.nominal_values
-                err_down = var_down - self.nominal_values
-                # Compute the flags to check which of the two variations (up and down) are pushing the nominal value up and down
-                up_is_up = err_up > 0
-                down_is_down = err_down < 0
-                # Compute the flag to check if the uncertainty is one-sided, i.e. when both variations are up or down
-                is_onesided = up_is_up ^ down_is_down
-                # Sum in quadrature of the systematic uncertainties taking into account if the uncertainty is one- or double-sided
-                err2_up_twosided = np.where(up_is_up, err_up**2, err_down**2)
-                err2_down_twosided = np.where(up_is_up, err_down**2, err_up**2)
-                err2_max = np.maximum(err2_up_twosided, err2_down_twosided)
-                err2_up_onesided = np.where(is_onesided & up_is_up, err2_max, 0)
-                err2_down_onesided = np.where(is_onesided & down_is_down, err2_max, 0)
-                err2_up_combined = np.where(
-                    is_onesided, err2_up_onesided, err2_up_twosided
-                )
-                err2_down_combined = np.where(
-                    is_onesided, err2_down_onesided, err2_down_twosided
-                )
-                # Sum in quadrature of the systematic uncertainty corresponding to a MC sample
-                err2_up += err2_up_combined
-                err2_down += err2_down_combined
+        # initialize up/down errors with statistical error
+        mcstat_err2 = self.nominal_variances
+        err2_up = mcstat_err2
+        err2_down = mcstat_err2
+        variations = histogram_info["mc"]["variations"]
+        systematics = variations.get_systematics()
+        if systematics:
+            # sum in quadrature of the systematic uncertainties of all variations
+            syst_err2_up, syst_err2_down = get_envelope(
+                self.nominal_values, *variations.get_up_down(systematics)
+            )
+            err2_up = mcstat_err2 + syst_err2_up
+            err2_down = mcstat_err2 + syst_err2_down
         else:
-            err2_up = np.sqrt(self.nominal_values)
-            err2_down = np.sqrt(self.nominal_values)
             self.style["uncert_band_kwargs"]["label"] = "Stat unc"
 
         self.band_up = self.nominal_values + np.sqrt(err2_up)
@@ -250,6 +208,36 @@ class CoffeaPlotter:
         xmin, xmax = rax.get_xlim()
         rax.hlines(1, xmin, xmax, color="k", linestyle=":")
 
+    def get_figure(self, add_ratio: bool):
+        """returns the (cleared) figure and axes of a layout. Figures are created once per layout"""
+        if add_ratio not in self.figures:
+            # set plot params
+            hep.style.use(hep.style.CMS)
+            plt.rcParams.update(self.style["rcParams"])
+            if add_ratio:
+                fig, (ax, rax) = plt.subplots(
+                    nrows=2,
+                    ncols=1,
+                    figsize=(9, 10),
+                    tight_layout=True,
+                    gridspec_kw={"height_ratios": (4, 1)},
+                    sharex=True,
+                )
+            else:
+                fig, ax = plt.subplots(
+                    nrows=1,
+                    ncols=1,
+                    figsize=(9, 9),
+                    tight_layout=True,
+                )
+                rax = None
+            self.figures[add_ratio] = (fig, ax, rax)
+        fig, ax, rax = self.figures[add_ratio]
+        for axis in [ax, rax]:
+            if axis is not None:
+                axis.cla()
+        return fig, ax, rax
+
     def plot_histograms(
         self,
         variable: str,
@@ -261,9 +249,6 @@ class CoffeaPlotter:
         blind: bool = False,
     ):
         setup_logger(self.output_dir)
-        # set plot params
-        hep.style.use(hep.style.CMS)
-        plt.rcParams.update(self.style["rcParams"])
         # get nominal MC histograms
         histogram_info = self.collect_histograms_for_plotting(variable, category, blind)
 
@@ -293,21 +278,7 @@ class CoffeaPlotter:
         if blind:
             add_ratio = False
 
-        fig, (ax, rax) = plt.subplots(
-            nrows=2,
-            ncols=1,
-            figsize=(9, 10),
-            tight_layout=True,
-            gridspec_kw={"height_ratios": (4, 1)},
-            sharex=True,
-        )
-        if not add_ratio:
-            fig, ax = plt.subplots(
-                nrows=1,
-                ncols=1,
-                figsize=(9, 9),
-                tight_layout=True,
-            )
+        fig, ax, rax = self.get_figure(add_ratio)
         hep.histplot(
             nominal_mc_hists,
             label=mc_labels,
@@ -425,4 +396,107 @@ class CoffeaPlotter:
             output_path.mkdir(parents=True, exist_ok=True)
         figname = f"{str(output_path)}/{self.workflow}_{category}_{variable}_{self.year}.{extension}"
         fig.savefig(figname)
-        plt.close()
+        return figname
+
+
+# plotter of the plotting worker processes (see plot_all_histograms)
+_worker_plotter = None
+
+
+def init_worker_plotter(plotter_kwargs: dict) -> None:
+    """build the plotter of a worker process. Histograms are inherited from the parent process"""
+    global _worker_plotter
+    processed_histograms = plotter_kwargs["processed_histograms"]
+    if isinstance(processed_histograms, HistogramStore):
+        # HDF5 file handles can not be shared between processes
+        plotter_kwargs = dict(plotter_kwargs)
+        plotter_kwargs["processed_histograms"] = HistogramStore(processed_histograms.path)
+        plotter_kwargs["projector"] = None
+    _worker_plotter = CoffeaPlotter(**plotter_kwargs)
+
+
+def plot_worker(category: str, variable: str, plot_kwargs: dict, plotter=None):
+    """plot a (category, variable) histogram with 'plotter' (default: the worker plotter)"""
+    if plotter is None:
+        plotter = _worker_plotter
+    start = time.perf_counter()
+    figname = plotter.plot_histograms(
+        variable=variable, category=category, **plot_kwargs
+    )
+    return category, variable, figname, time.perf_counter() - start
+
+
+def plot_all_histograms(
+    plotter_kwargs: dict,
+    categories: list,
+    variables: list,
+    plot_kwargs: dict,
+    tarball_name: str,
+    workers: int = 1,
+) -> pd.DataFrame:
+    """
+    plot all (category, variable) histograms, optionally in a process pool,
+    and add each plot to its category tarball as soon as it is saved
+
+    Parameters:
+    -----------
+        plotter_kwargs:
+            CoffeaPlotter arguments
+        categories:
+            categories to plot
+        variables:
+            variables to plot
+        plot_kwargs:
+            CoffeaPlotter.plot_histograms arguments (other than variable and category)
+        tarball_name:
+            name of the plots tarball saved in each category directory
+        workers:
+            number of worker processes
+
+    Returns:
+    --------
+        timing report with the seconds spent per plot
+    """
+    output_dir = Path(plotter_kwargs["output_dir"])
+    jobs = [(category, variable) for category in categories for variable in variables]
+    tarballs = {}
+    for category in categories:
+        category_dir = output_dir / category
+        category_dir.mkdir(parents=True, exist_ok=True)
+        tarballs[category] = tarfile.open(category_dir / tarball_name, "w:gz")
+
+    timing = []
+
+    def add_plot(result):
+        category, variable, figname, seconds = result
+        logging.info(f"{category}: {variable} ({seconds:.2f} s)")
+        tarballs[category].add(figname, arcname=Path(figname).name)
+        timing.append(
+            {"category": category, "variable": variable, "seconds": seconds}
+        )
+
+    try:
+        if workers <= 1:
+            plotter = CoffeaPlotter(**plotter_kwargs)
+            for category, variable in jobs:
+                add_plot(plot_worker(category, variable, plot_kwargs, plotter))
+        else:
+            # forked workers share the preloaded histograms (and projections) of this process
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=init_worker_plotter,
+                initargs=(plotter_kwargs,),
+            ) as executor:
+                futures = [
+                    executor.submit(plot_worker, category, variable, plot_kwargs)
+                    for category, variable in jobs
+                ]
+                for future in as_completed(futures):
+                    add_plot(future.result())
+    finally:
+        for tarball in tarballs.values():
+            tarball.close()
+
+    timing_df = pd.DataFrame(timing, columns=["category", "variable", "seconds"])
+    return timing_df.sort_values("seconds", ascending=False, ignore_index=True)
@@ -1,13 +1,73 @@
+import gc
 import yaml
-import glob
 import logging
 import numpy as np
 import pandas as pd
 from pathlib import Path
 from coffea.util import load, save
-from coffea.processor import accumulate
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from analysis.histograms import accumulate_outputs
 from analysis.filesets.utils import get_dataset_config, get_process_maps
-from analysis.postprocess.utils import print_header, get_variations_keys
+from analysis.postprocess.manifest import PostprocessManifest
+from analysis.postprocess.perf_report import save_sample_perf
+from analysis.postprocess.utils import print_header
+from analysis.postprocess.systematics import VariationProjector, get_envelope
+
+# relative difference allowed between the per-event and 'Runs' trees generator weight sums
+SUMW_TOLERANCE = 1e-3
+
+
+def load_luminosities() -> dict:
+    """return the integrated luminosities [1/pb] of each year"""
+    lumi_file = Path.cwd() / "analysis" / "postprocess" / "luminosity.yaml"
+    with open(lumi_file, "r") as f:
+        return yaml.safe_load(f)
+
+
+def get_norm_inputs(samples: list, year: str) -> dict:
+    """return the inputs of the lumi-xsec normalisation of each sample"""
+    dataset_config = get_dataset_config(year)
+    luminosity = load_luminosities()[year]
+    return {
+        sample: {
+            "xsec": dataset_config[sample]["xsec"],
+            "era": dataset_config[sample]["era"],
+            "luminosity": luminosity,
+        }
+        for sample in samples
+    }
+
+
+def stream_accumulate(fnames: list):
+    """
+    accumulate coffea files with a streaming pairwise (tree) reduction.
+
+    Files are loaded one at a time and merged with partial results of the same
+    size, so at most ~log2(len(fnames)) partial accumulators are kept in memory
+
+    Parameters:
+    -----------
+        fnames:
+            coffea files to accumulate
+    """
+    # stack of (level, partial accumulator) where level is log2 of the number of merged files
+    partials = []
+    for fname in fnames:
+        output = load(fname)
+        if not output:
+            continue
+        level = 0
+        while partials and partials[-1][0] == level:
+            # loaded outputs are owned by this function, so they can be merged in-place
+            output = accumulate_outputs([output], accum=partials.pop()[1])
+            level += 1
+        partials.append((level, output))
+    if not partials:
+        return None
+    output = partials.pop()[1]
+    while partials:
+        output = accumulate_outputs([output], accum=partials.pop()[1])
+    return output
 
 
 def save_process_histograms_by_sample(
@@ -19,35 +79,13 @@ def save_process_histograms_by_sample(
 ):
     print_header(f"Processing {sample} outputs")
 
-    metadata = {}
-    histograms = {}
-    grouped_metadata = {}
-    grouped_histograms = {}
-
     logging.info("Accumulating histograms and metadata...")
-    grouped_histograms = []
-    grouped_metadata = {}
-    for fname in grouped_outputs[sample]:
-        output = load(fname)
-        if output:
-            # group histograms by sample
-            grouped_histograms.append(output["histograms"])
-            # group metadata by sample
-            for meta_key in output["metadata"]:
-                if meta_key in grouped_metadata:
-                    grouped_metadata[meta_key].append(output["metadata"][meta_key])
-                else:
-                    grouped_metadata[meta_key] = [output["metadata"][meta_key]]
-
-    histograms = accumulate(grouped_histograms)
-    metadata = {}
-    for meta_key in grouped_metadata:
-        metadata[meta_key] = accumulate(grouped_metadata[meta_key])
+    output = stream_accumulate(grouped_outputs[sample])
+    histograms = output["histograms"]
+    metadata = output["metadata"]
 
     logging.info("Scaling lumi-xsec weights")
-    lumi_file = Path.cwd() / "analysis" / "postprocess" / "luminosity.yaml"
-    with open(lumi_file, "r") as f:
-        luminosities = yaml.safe_load(f)
+    luminosities = load_luminosities()
 
     weights = {}
     xsecs = {}
@@ -56,7 +94,28 @@ def save_process_histograms_by_sample(
     dataset_config = get_dataset_config(year)
     xsec = dataset_config[sample]["xsec"]
     sumw = metadata["sumw"]
-    if dataset_config[sample]["era"] == "MC":
+    is_mc = dataset_config[sample]["era"] == "MC"
+    if "norm" in metadata:
+        # generator weight sum (events, for data) of the input files, from their 'Runs' trees
+        norm = metadata["norm"]
+        total_sumw = norm["genEventSumw"] if is_mc else norm["nevents"]
+        # processed fraction of the generator weight: below 1 in sampling mode, otherwise the
+        # per-event sumw is only a cross-check of the 'Runs' trees
+        fraction = sumw / total_sumw
+        if "sampling" in metadata:
+            logging.info(f"sampled fraction: {fraction}")
+        else:
+            if abs(fraction - 1) > SUMW_TOLERANCE:
+                logging.warning(
+                    f"per-event sumw ({sumw}) differs from the 'Runs' trees sumw ({total_sumw})"
+                )
+            fraction = 1
+        if is_mc:
+            weight = (luminosities[year] * xsec) / total_sumw / fraction
+        else:
+            weight = 1 / fraction
+        logging.info(f"'Runs' trees sumw: {total_sumw}")
+    elif is_mc:
         weight = (luminosities[year] * xsec) / sumw
 
     logging.info(f"luminosity [1/pb]: {luminosities[year]}")
@@ -71,6 +130,10 @@ def save_process_histograms_by_sample(
     logging.info(f"saving histograms")
     save(scaled_histograms, f"{output_dir}/{sample}.coffea")
 
+    if "perf" in metadata:
+        # processor stages performance (outputs processed with profiling enabled)
+        save_sample_perf(metadata["perf"], sample, output_dir)
+
     scaled_cutflow = {}
     for category in categories:
         logging.info(f"saving cutflow for category {category}\n")
@@ -96,17 +159,17 @@ def save_process_histograms_by_process(
     categories,
 ):
     print_header(f"Processing {process} outputs")
-    # group and accumulate output files by sample
-    extension = ".coffea"
+    # accumulate the scaled histograms of the process samples
     output_files = []
     for sample in process_samples_map[process]:
-        output_files += glob.glob(f"{output_dir}/{sample}*{extension}", recursive=True)
+        sample_file = Path(f"{output_dir}/{sample}.coffea")
+        if not sample_file.exists():
+            logging.warning(f"{sample} has no postprocessed histograms, skipping it")
+            continue
+        output_files.append(sample_file)
 
     logging.info(f"saving {process} histograms")
-    hist_to_accumulate = []
-    for out in output_files:
-        hist_to_accumulate.append(load(out))
-    output_histograms = {process: accumulate(hist_to_accumulate)}
+    output_histograms = {process: stream_accumulate(output_files)}
     save(output_histograms, f"{output_dir}/{process}.coffea")
 
     cutflow = {}
@@ -126,16 +189,156 @@ def save_process_histograms_by_process(
         cutflow_file = Path(f"{output_dir}/{category}/cutflow_{category}_{process}.csv")
         cutflow_df.to_csv(cutflow_file)
 
+    return output_histograms
+
+
+def postprocess_outputs(
+    grouped_outputs: dict,
+    year: str,
+    output_dir: str,
+    process_samples_map: dict,
+    categories,
+    workers: int = 1,
+) -> dict:
+    """
+    save per-sample and per-process histograms and cutflows.
+
+    Only samples whose input files or normalisation inputs changed since the last run (see
+    PostprocessManifest) and the processes depending on them are merged again. With more than
+    one worker, samples are merged in a process pool and each process is submitted as soon
+    as all of its samples have been saved
+
+    Parameters:
+    -----------
+        grouped_outputs:
+            map from sample name to its output files
+        year:
+            dataset year
+        output_dir:
+            postprocessing output directory
+        process_samples_map:
+            map from process name to its samples
+        categories:
+            workflow categories
+        workers:
+            number of worker processes
+
+    Returns:
+    --------
+        map from process name to its merged histograms, for the merged processes
+    """
+    manifest = PostprocessManifest(output_dir)
+    samples = manifest.get_changed_samples(
+        grouped_outputs, get_norm_inputs(grouped_outputs, year), output_dir
+    )
+    processes = manifest.get_changed_processes(
+        process_samples_map, samples, output_dir
+    )
+    logging.info(
+        f"{len(samples)}/{len(grouped_outputs)} samples and "
+        f"{len(processes)}/{len(process_samples_map)} processes to merge"
+    )
+    sample_kwargs = dict(
+        grouped_outputs=grouped_outputs,
+        year=year,
+        output_dir=output_dir,
+        categories=categories,
+    )
+    process_kwargs = dict(
+        year=year,
+        output_dir=output_dir,
+        process_samples_map=process_samples_map,
+        categories=categories,
+    )
+    processed_histograms = {}
+    if workers <= 1:
+        for sample in samples:
+            save_process_histograms_by_sample(sample=sample, **sample_kwargs)
+            gc.collect()
+        for process in processes:
+            processed_histograms.update(
+                save_process_histograms_by_process(process=process, **process_kwargs)
+            )
+            gc.collect()
+        manifest.save()
+        return processed_histograms
+
+    # samples still to be saved by process
+    pending_samples = {
+        process: set(process_samples_map[process]) & set(samples)
+        for process in processes
+    }
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for sample in samples:
+            future = executor.submit(
+                save_process_histograms_by_sample, sample=sample, **sample_kwargs
+            )
+            futures[future] = ("sample", sample)
+        for process, pending in pending_samples.items():
+            if not pending:
+                future = executor.submit(
+                    save_process_histograms_by_process, process=process, **process_kwargs
+                )
+                futures[future] = ("process", process)
+        while futures:
+            done = next(as_completed(futures))
+            kind, name = futures.pop(done)
+            # raise worker exceptions
+            result = done.result()
+            logging.info(f"{kind} {name} saved")
+            if kind == "process":
+                processed_histograms.update(result)
+                continue
+            for process, pending in pending_samples.items():
+                if name in pending:
+                    pending.remove(name)
+                    if not pending:
+                        future = executor.submit(
+                            save_process_histograms_by_process,
+                            process=process,
+                            **process_kwargs,
+                        )
+                        futures[future] = ("process", process)
+    manifest.save()
+    return processed_histograms
+
 
 def load_processed_histograms(
     year: str,
     output_dir: str,
     process_samples_map: dict,
+    histograms: dict = None,
 ):
+    """
+    merge the per-process histograms and save them to '{year}_processed_histograms.coffea'
+
+    Parameters:
+    -----------
+        year:
+            dataset year
+        output_dir:
+            postprocessing output directory
+        process_samples_map:
+            map from process name to its samples
+        histograms:
+            per-process histograms already in memory. Missing processes are loaded from disk
+    """
+    if histograms is None:
+        histograms = {}
+    processed_file = Path(f"{output_dir}/{year}_processed_histograms.coffea")
+    if not histograms and processed_file.exists():
+        # nothing was merged again
+        processed_histograms = load(processed_file)
+        if set(processed_histograms) == set(process_samples_map):
+            return processed_histograms
     processed_histograms = {}
     for process in process_samples_map:
-        processed_histograms.update(load(f"{output_dir}/{process}.coffea"))
-    save(processed_histograms, f"{output_dir}/{year}_processed_histograms.coffea")
+        if process in histograms:
+            processed_histograms[process] = histograms[process]
+        else:
+            processed_histograms.update(load(f"{output_dir}/{process}.coffea"))
+    save(processed_histograms, processed_file)
     return processed_histograms
 
 
@@ -150,74 +353,45 @@ def find_kin_and_axis(processed_histograms, name="jet_multiplicity"):
     raise ValueError(f"No histogram with a '{name}' axis found.")
 
 
-def get_results_report(processed_histograms, workflow_config, category, columns_to_drop, blind):
+def get_results_report(
+    processed_histograms,
+    workflow_config,
+    category,
+    columns_to_drop,
+    blind,
+    projector=None,
+):
+    if projector is None:
+        projector = VariationProjector(processed_histograms)
     kin, aux_var = find_kin_and_axis(processed_histograms)
     nominal = {}
-    variations = {}
     mcstat_err = {}
     bin_error_up = {}
     bin_error_down = {}
     for process in processed_histograms:
-        aux_hist = processed_histograms[process][kin]
-        nominal_selector = {"variation": "nominal"}
-        if "category" in aux_hist.axes.name:
-            nominal_selector["category"] = category
-        nominal_hist = aux_hist[nominal_selector].project(aux_var)
-        nominal[process] = nominal_hist
-
-        mcstat_err[process] = {}
-        bin_error_up[process] = {}
-        bin_error_down[process] = {}
-        mcstat_err2 = nominal_hist.variances()
+        # (variation, bin) projection of the process histogram
+        projection = projector.get(process, aux_var, category, histogram_name=kin)
+        nominal[process] = projection.nominal_values
+        mcstat_err2 = projection.nominal_variances
         mcstat_err[process] = np.sum(np.sqrt(mcstat_err2))
-        err2_up = mcstat_err2
-        err2_down = mcstat_err2
 
         if process == "Data":
             continue
 
-        for variation in get_variations_keys(processed_histograms):
-            if f"{variation}Up" not in aux_hist.axes["variation"]:
-                continue
-            selectorup = {"variation": f"{variation}Up"}
-            selectordown = {"variation": f"{variation}Down"}
-            if "category" in aux_hist.axes.name:
-                selectorup["category"] = category
-                selectordown["category"] = category
-            var_up = aux_hist[selectorup].project(aux_var).values()
-            var_down = aux_hist[selectordown].project(aux_var).values()
-            # Compute the uncertainties corresponding to the up/down variations
-            err_up = var_up - nominal_hist.values()
-            err_down = var_down - nominal_hist.values()
-            # Compute the flags to check which of the two variations (up and down) are pushing the nominal value up and down
-            up_is_up = err_up > 0
-            down_is_down = err_down < 0
-            # Compute the flag to check if the uncertainty is one-sided, i.e. when both variations are up or down
-            is_onesided = up_is_up ^ down_is_down
-            # Sum in quadrature of the systematic uncertainties taking into account if the uncertainty is one- or double-sided
-            err2_up_twosided = np.where(up_is_up, err_up**2, err_down**2)
-            err2_down_twosided = np.where(up_is_up, err_down**2, err_up**2)
-            err2_max = np.maximum(err2_up_twosided, err2_down_twosided)
-            err2_up_onesided = np.where(is_onesided & up_is_up, err2_max, 0)
-            err2_down_onesided = np.where(is_onesided & down_is_down, err2_max, 0)
-            err2_up_combined = np.where(is_onesided, err2_up_onesided, err2_up_twosided)
-            err2_down_combined = np.where(
-                is_onesided, err2_down_onesided, err2_down_twosided
-            )
-            # Sum in quadrature of the systematic uncertainty corresponding to a MC sample
-            err2_up += err2_up_combined
-            err2_down += err2_down_combined
-
-        bin_error_up[process] = np.sum(np.sqrt(err2_up))
-        bin_error_down[process] = np.sum(np.sqrt(err2_down))
+        # up/down systematic uncertainties of all variations at once
+        err2_up, err2_down = get_envelope(
+            projection.nominal_values, *projection.get_up_down()
+        )
+        bin_error_up[process] = np.sum(np.sqrt(mcstat_err2 + err2_up))
+        bin_error_down[process] = np.sum(np.sqrt(mcstat_err2 + err2_down))
 
     mcs = []
     results = {}
     for process in nominal:
         results[process] = {}
-        results[process]["events"] = np.sum(nominal[process].values())
+        results[process]["events"] = np.sum(nominal[process])
         if process == "Data":
-            results[process]["stat err"] = np.sqrt(np.sum(nominal[process].values()))
+            results[process]["stat err"] = np.sqrt(np.sum(nominal[process]))
         else:
             if process not in columns_to_drop:
                 mcs.append(process)
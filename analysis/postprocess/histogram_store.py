@@ -0,0 +1,343 @@
+import hist
+import json
+import h5py
+import argparse
+import numpy as np
+from pathlib import Path
+from coffea.util import load
+from collections.abc import Mapping
+
+# dataset key used for histograms without a category/variation axis
+NO_AXIS_KEY = "_"
+# axes stored as one dataset per bin
+SPLIT_AXES = ["category", "variation"]
+
+
+def axis_to_dict(axis) -> dict:
+    """serialize a hist axis (type, binning and flow options) to a dictionary"""
+    # axis.label falls back to the axis name if no label was set
+    axis_dict = {"name": axis.name, "label": axis.__dict__.get("label", "")}
+    if isinstance(axis, hist.axis.Boolean):
+        axis_dict["type"] = "Boolean"
+    elif isinstance(axis, hist.axis.StrCategory):
+        axis_dict["type"] = "StrCategory"
+        axis_dict["categories"] = list(axis)
+        axis_dict["growth"] = axis.traits.growth
+        axis_dict["overflow"] = axis.traits.overflow
+    elif isinstance(axis, hist.axis.IntCategory):
+        axis_dict["type"] = "IntCategory"
+        axis_dict["categories"] = [int(c) for c in axis]
+        axis_dict["growth"] = axis.traits.growth
+        axis_dict["overflow"] = axis.traits.overflow
+    else:
+        if isinstance(axis, hist.axis.Regular):
+            axis_dict["type"] = "Regular"
+            axis_dict["bins"] = axis.size
+            axis_dict["start"] = float(axis.edges[0])
+            axis_dict["stop"] = float(axis.edges[-1])
+        elif isinstance(axis, hist.axis.Integer):
+            axis_dict["type"] = "Integer"
+            axis_dict["start"] = int(axis.edges[0])
+            axis_dict["stop"] = int(axis.edges[-1])
+        elif isinstance(axis, hist.axis.Variable):
+            axis_dict["type"] = "Variable"
+            axis_dict["edges"] = axis.edges.tolist()
+        else:
+            raise ValueError(f"Axis type {type(axis)} is not supported")
+        axis_dict["underflow"] = axis.traits.underflow
+        axis_dict["overflow"] = axis.traits.overflow
+        axis_dict["growth"] = axis.traits.growth
+    return axis_dict
+
+
+def dict_to_axis(axis_dict: dict, categories: list = None):
+    """
+    build a hist axis from its serialized dictionary
+
+    Parameters:
+    -----------
+        axis_dict:
+            serialized axis (see axis_to_dict)
+        categories:
+            categories of a category axis. If None, the stored categories are used
+    """
+    axis_dict = dict(axis_dict)
+    axis_type = axis_dict.pop("type")
+    if axis_type == "Boolean":
+        return hist.axis.Boolean(**axis_dict)
+    if axis_type in ["StrCategory", "IntCategory"]:
+        stored_categories = axis_dict.pop("categories")
+        if categories is None:
+            categories = stored_categories
+        axis_opt = {
+            "StrCategory": hist.axis.StrCategory,
+            "IntCategory": hist.axis.IntCategory,
+        }
+        return axis_opt[axis_type](categories, **axis_dict)
+    if axis_type == "Regular":
+        return hist.axis.Regular(
+            axis_dict.pop("bins"),
+            axis_dict.pop("start"),
+            axis_dict.pop("stop"),
+            **axis_dict,
+        )
+    if axis_type == "Integer":
+        return hist.axis.Integer(
+            axis_dict.pop("start"), axis_dict.pop("stop"), **axis_dict
+        )
+    return hist.axis.Variable(axis_dict.pop("edges"), **axis_dict)
+
+
+def get_split_index(histogram: hist.Hist, axis_name: str, bin_name: str):
+    """return the (flow) view index of a category/variation bin, or None if there is no such axis"""
+    if axis_name not in histogram.axes.name:
+        return None
+    return histogram.axes[axis_name].index(bin_name)
+
+
+def save_histogram(group: h5py.Group, histogram: hist.Hist) -> None:
+    """
+    save a histogram to a HDF5 group: one dataset per (category, variation)
+    holding the (flow) bin contents of the remaining axes
+
+    Parameters:
+    -----------
+        group:
+            HDF5 group of the histogram
+        histogram:
+            histogram to store
+    """
+    axes_names = list(histogram.axes.name)
+    group.attrs["axes"] = json.dumps([axis_to_dict(axis) for axis in histogram.axes])
+    group.attrs["storage"] = histogram.storage_type.__name__
+    split_bins = {}
+    for axis_name in SPLIT_AXES:
+        split_bins[axis_name] = (
+            list(histogram.axes[axis_name])
+            if axis_name in axes_names
+            else [NO_AXIS_KEY]
+        )
+    view = histogram.view(flow=True)
+    for category in split_bins["category"]:
+        category_group = group.require_group(category)
+        for variation in split_bins["variation"]:
+            selector = [slice(None)] * len(axes_names)
+            for axis_name, bin_name in zip(SPLIT_AXES, [category, variation]):
+                index = get_split_index(histogram, axis_name, bin_name)
+                if index is not None:
+                    selector[axes_names.index(axis_name)] = index
+            # contiguous (non-chunked) datasets can be memory-mapped when loading
+            category_group.create_dataset(
+                variation, data=np.ascontiguousarray(view[tuple(selector)])
+            )
+
+
+def save_histogram_store(processed_histograms: dict, path: str) -> None:
+    """
+    save processed histograms ({process: {histogram: hist.Hist}}) to a HDF5 histogram store
+
+    The store has one group per process and histogram with the axes metadata as attributes,
+    and one dataset per category and variation
+    """
+    with h5py.File(path, "w") as f:
+        for process, histograms in processed_histograms.items():
+            process_group = f.require_group(process)
+            for histogram_name, histogram in histograms.items():
+                save_histogram(process_group.create_group(histogram_name), histogram)
+
+
+def convert_to_store(coffea_file: str, path: str = None) -> Path:
+    """convert a '{year}_processed_histograms.coffea' file into a HDF5 histogram store"""
+    coffea_file = Path(coffea_file)
+    path = Path(path) if path is not None else coffea_file.with_suffix(".h5")
+    save_histogram_store(load(coffea_file), path)
+    return path
+
+
+class ProcessHistograms(Mapping):
+    """lazy map from histogram name to the (fully loaded) histogram of a process"""
+
+    def __init__(self, store, process: str):
+        self.store = store
+        self.process = process
+
+    def __getitem__(self, histogram_name):
+        if histogram_name not in self.store.get_histogram_names(self.process):
+            raise KeyError(histogram_name)
+        return self.store.get(self.process, histogram_name)
+
+    def __iter__(self):
+        return iter(self.store.get_histogram_names(self.process))
+
+    def __len__(self):
+        return len(self.store.get_histogram_names(self.process))
+
+
+class HistogramStore(Mapping):
+    """
+    Lazy reader of a HDF5 histogram store (see save_histogram_store)
+
+    It behaves as the processed histograms dictionary ({process: {histogram: hist.Hist}}),
+    but histograms are only read when accessed. 'get' reads only the requested
+    (category, variation) datasets, memory-mapping them when possible
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.file = h5py.File(self.path, "r")
+
+    def __getitem__(self, process):
+        if process not in self.file:
+            raise KeyError(process)
+        return ProcessHistograms(self, process)
+
+    def __iter__(self):
+        return iter(self.file.keys())
+
+    def __len__(self):
+        return len(self.file)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def get_histogram_names(self, process: str) -> list:
+        return list(self.file[process].keys())
+
+    def get_axes(self, process: str, histogram_name: str) -> list:
+        """return the serialized axes of a histogram"""
+        return json.loads(self.file[process][histogram_name].attrs["axes"])
+
+    def get_axes_names(self, process: str, histogram_name: str) -> list:
+        return [axis["name"] for axis in self.get_axes(process, histogram_name)]
+
+    def find_histogram(self, process: str, variable: str) -> str:
+        """return the name of the process histogram with a 'variable' axis"""
+        histogram_names = self.get_histogram_names(process)
+        if variable in histogram_names:
+            return variable
+        for histogram_name in histogram_names:
+            if variable in self.get_axes_names(process, histogram_name):
+                return histogram_name
+        raise ValueError(f"'{variable}' axis not found in workflow's output histogram")
+
+    def get_variations(self, process: str, histogram_name: str) -> list:
+        """return the variations of a histogram (without reading its contents)"""
+        for axis in self.get_axes(process, histogram_name):
+            if axis["name"] == "variation":
+                return axis["categories"]
+        return []
+
+    def get_variations_keys(self) -> list:
+        """return the systematic names (without Up/Down) of the MC histograms"""
+        for process in self:
+            if process == "Data":
+                continue
+            for histogram_name in self.get_histogram_names(process):
+                variations = self.get_variations(process, histogram_name)
+                return list(
+                    set(
+                        [
+                            var.replace("Up", "").replace("Down", "")
+                            for var in variations
+                            if var != "nominal"
+                        ]
+                    )
+                )
+        return []
+
+    def read_dataset(self, dataset: h5py.Dataset) -> np.ndarray:
+        """memory-map a contiguous dataset, otherwise read it"""
+        offset = dataset.id.get_offset()
+        if dataset.chunks is None and offset is not None:
+            return np.memmap(
+                self.path,
+                dtype=dataset.dtype,
+                mode="r",
+                shape=dataset.shape,
+                offset=offset,
+            )
+        return dataset[()]
+
+    def get(
+        self,
+        process: str,
+        histogram_name: str,
+        category: str = None,
+        variation: str = None,
+    ) -> hist.Hist:
+        """
+        read a histogram, restricted to the requested category and variation
+
+        Parameters:
+        -----------
+            process:
+                process name
+            histogram_name:
+                histogram name
+            category:
+                category (or list of categories) to read. If None, all categories are read
+            variation:
+                variation (or list of variations) to read. If None, all variations are read
+
+        Returns:
+        --------
+            histogram with the same axes as the stored one, with the category and
+            variation axes restricted to the requested bins
+        """
+        group = self.file[process][histogram_name]
+        axes = self.get_axes(process, histogram_name)
+        axes_names = [axis["name"] for axis in axes]
+        selection = {"category": category, "variation": variation}
+        split_bins = {}
+        hist_axes = []
+        for axis in axes:
+            if axis["name"] in SPLIT_AXES:
+                bins = selection[axis["name"]]
+                if bins is None:
+                    bins = axis["categories"]
+                elif isinstance(bins, str):
+                    bins = [bins]
+                missing = [b for b in bins if b not in axis["categories"]]
+                if missing:
+                    raise ValueError(
+                        f"Invalid {axis['name']} {missing}. Please specify {axis['categories']}"
+                    )
+                split_bins[axis["name"]] = bins
+                hist_axes.append(dict_to_axis(axis, categories=bins))
+            else:
+                hist_axes.append(dict_to_axis(axis))
+        for axis_name in SPLIT_AXES:
+            if axis_name not in split_bins:
+                split_bins[axis_name] = [NO_AXIS_KEY]
+
+        storage = {"Weight": hist.storage.Weight(), "Double": hist.storage.Double()}
+        histogram = hist.Hist(*hist_axes, storage=storage[group.attrs["storage"]])
+        view = histogram.view(flow=True)
+        for category_name in split_bins["category"]:
+            for variation_name in split_bins["variation"]:
+                selector = [slice(None)] * len(axes_names)
+                for axis_name, bin_name in zip(
+                    SPLIT_AXES, [category_name, variation_name]
+                ):
+                    index = get_split_index(histogram, axis_name, bin_name)
+                    if index is not None:
+                        selector[axes_names.index(axis_name)] = index
+                view[tuple(selector)] = self.read_dataset(
+                    group[category_name][variation_name]
+                )
+        return histogram
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert processed histograms (.coffea) into HDF5 histogram stores"
+    )
+    parser.add_argument(
+        "--input_files",
+        nargs="+",
+        required=True,
+        help="processed histograms .coffea files to convert",
+    )
+    args = parser.parse_args()
+    for input_file in args.input_files:
+        print(f"{input_file} -> {convert_to_store(input_file)}")
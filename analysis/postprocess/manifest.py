@@ -0,0 +1,137 @@
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+
+MANIFEST_NAME = "postprocess_manifest.json"
+
+
+def get_file_hash(fname: str, chunk_size: int = 1 << 20) -> str:
+    """compute the sha256 hash of a file"""
+    sha256 = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_file_record(fname: str, record: dict = None) -> dict:
+    """
+    return the size, mtime and sha256 hash of a file
+
+    Parameters:
+    -----------
+        fname:
+            file path
+        record:
+            previous file record. Its hash is reused if size and mtime did not change
+    """
+    stat = Path(fname).stat()
+    if (
+        record is not None
+        and record["size"] == stat.st_size
+        and record["mtime"] == stat.st_mtime
+    ):
+        return record
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": get_file_hash(fname),
+    }
+
+
+def get_hashes(records: dict) -> dict:
+    """map each file of a sample records to its hash"""
+    return {fname: record["sha256"] for fname, record in records.items()}
+
+
+class PostprocessManifest:
+    """
+    Record of the inputs used to build the postprocessed histograms of an output directory
+
+    The manifest maps each sample to its input files (size, mtime and sha256 hash) and
+    normalisation inputs (xsec, era and luminosity), and each process to its samples, so that
+    postprocessing only re-merges the samples whose inputs changed and the processes that
+    depend on them
+    """
+
+    def __init__(self, output_dir: str):
+        self.path = Path(output_dir) / MANIFEST_NAME
+        self.samples = {}
+        self.processes = {}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                manifest = json.load(f)
+            self.samples = manifest["samples"]
+            self.processes = manifest["processes"]
+
+    def get_changed_samples(
+        self, grouped_outputs: dict, norm_inputs: dict, output_dir: str
+    ) -> list:
+        """
+        return the samples whose input files or normalisation inputs changed (or whose merged
+        output is missing) and update the sample records
+
+        Parameters:
+        -----------
+            grouped_outputs:
+                map from sample name to its output files
+            norm_inputs:
+                map from sample name to its normalisation inputs (xsec, era and luminosity)
+            output_dir:
+                postprocessing output directory
+        """
+        changed_samples = []
+        samples = {}
+        for sample, fnames in grouped_outputs.items():
+            old_sample = self.samples.get(sample, {})
+            old_records = old_sample.get("files", {})
+            records = {
+                fname: get_file_record(fname, old_records.get(fname))
+                for fname in sorted(fnames)
+            }
+            samples[sample] = {"files": records, "norm": norm_inputs[sample]}
+            # a file whose mtime changed but whose content did not is not a change
+            if (
+                get_hashes(records) != get_hashes(old_records)
+                or norm_inputs[sample] != old_sample.get("norm")
+                or not Path(f"{output_dir}/{sample}.coffea").exists()
+            ):
+                changed_samples.append(sample)
+        self.samples = samples
+        return changed_samples
+
+    def get_changed_processes(
+        self, process_samples_map: dict, changed_samples: list, output_dir: str
+    ) -> list:
+        """
+        return the processes with changed samples (or whose merged output is missing)
+        and update the process records
+
+        Parameters:
+        -----------
+            process_samples_map:
+                map from process name to its samples
+            changed_samples:
+                samples whose input files changed
+            output_dir:
+                postprocessing output directory
+        """
+        changed_processes = []
+        processes = {}
+        for process, samples in process_samples_map.items():
+            processes[process] = sorted(samples)
+            if (
+                processes[process] != self.processes.get(process)
+                or set(samples) & set(changed_samples)
+                or not Path(f"{output_dir}/{process}.coffea").exists()
+            ):
+                changed_processes.append(process)
+        self.processes = processes
+        return changed_processes
+
+    def save(self) -> None:
+        with open(self.path, "w") as f:
+            json.dump({"samples": self.samples, "processes": self.processes}, f)
+        logging.info(f"manifest saved to {self.path}")
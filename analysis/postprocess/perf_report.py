@@ -0,0 +1,65 @@
+import json
+import glob
+import pandas as pd
+from pathlib import Path
+from analysis.histograms import accumulate_outputs
+
+# directory (within the postprocessing output directory) of the per-sample performance records
+PERF_DIR = "perf"
+
+
+def save_sample_perf(perf: dict, sample: str, output_dir: str) -> None:
+    """save the accumulated performance records of a sample to '{output_dir}/perf/{sample}.json'"""
+    perf_dir = Path(output_dir) / PERF_DIR
+    perf_dir.mkdir(parents=True, exist_ok=True)
+    with open(perf_dir / f"{sample}.json", "w") as f:
+        json.dump(perf, f)
+
+
+def load_perf(output_dir: str) -> dict:
+    """load and accumulate the performance records of all samples (None if there are none)"""
+    perf = []
+    for fname in sorted(glob.glob(f"{output_dir}/{PERF_DIR}/*.json")):
+        with open(fname, "r") as f:
+            perf.append(json.load(f))
+    return accumulate_outputs(perf)
+
+
+def get_stage_report(perf: dict, by_shift: bool = False) -> pd.DataFrame:
+    """
+    rank the processor stages by their total wall time
+
+    Parameters:
+    -----------
+        perf:
+            accumulated performance records (output["metadata"]["perf"])
+        by_shift:
+            if True, stages are reported per shift
+
+    Returns:
+    --------
+        DataFrame with the calls, total time, time fraction, processed events, time per event
+        and mean peak allocated memory per call of each stage
+    """
+    rows = []
+    for stage, shifts in perf["stages"].items():
+        for shift, record in shifts.items():
+            rows.append({"stage": stage, "shift": shift, **record})
+    df = pd.DataFrame(rows)
+    index = ["stage", "shift"] if by_shift else ["stage"]
+    df = df.groupby(index)[["calls", "time", "events", "peak_alloc_bytes"]].sum()
+    report = pd.DataFrame(index=df.index)
+    report["calls"] = df["calls"]
+    report["time [s]"] = df["time"]
+    report["time [%]"] = 100 * df["time"] / df["time"].sum()
+    report["events"] = df["events"]
+    report["time/event [us]"] = 1e6 * df["time"] / df["events"].where(df["events"] > 0)
+    report["peak alloc/call [MB]"] = df["peak_alloc_bytes"] / df["calls"] / 1e6
+    return report.sort_values("time [s]", ascending=False)
+
+
+def get_chunk_report(perf: dict, n: int = 10) -> pd.DataFrame:
+    """return the 'n' slowest chunks with their processing rate"""
+    chunks = pd.DataFrame(perf["chunks"])
+    chunks["events/s"] = chunks["events"] / chunks["time"]
+    return chunks.sort_values("time", ascending=False).head(n)
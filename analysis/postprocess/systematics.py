@@ -0,0 +1,280 @@
+import numpy as np
+from analysis.postprocess.histogram_store import HistogramStore
+
+
+class VariationProjection:
+    """
+    Dense (variation, bin) projection of a histogram onto a variable
+
+    Parameters:
+    -----------
+        values:
+            bin contents with shape (n_variations, n_bins)
+        variances:
+            bin variances with shape (n_variations, n_bins)
+        variations:
+            variation names, in the order of the first axis
+        edges:
+            bin edges of the projected variable
+    """
+
+    def __init__(
+        self,
+        values: np.ndarray,
+        variances: np.ndarray,
+        variations: list,
+        edges: np.ndarray,
+    ):
+        self.values = values
+        self.variances = variances
+        self.variations = list(variations)
+        self.edges = edges
+        self.index = {variation: i for i, variation in enumerate(self.variations)}
+
+    @property
+    def nominal_values(self) -> np.ndarray:
+        return self.values[self.index["nominal"]]
+
+    @property
+    def nominal_variances(self) -> np.ndarray:
+        return self.variances[self.index["nominal"]]
+
+    def get_systematics(self) -> list:
+        """return the systematic names (without Up/Down) with both Up and Down variations"""
+        return [
+            variation[: -len("Up")]
+            for variation in self.variations
+            if variation.endswith("Up")
+            and f"{variation[: -len('Up')]}Down" in self.index
+        ]
+
+    def get_up_down(self, systematics: list = None):
+        """
+        return the Up and Down bin contents of the systematics, with shape (n_systematics, n_bins)
+
+        Parameters:
+        -----------
+            systematics:
+                systematic names. If None, all systematics with Up and Down variations are used
+        """
+        if systematics is None:
+            systematics = self.get_systematics()
+        up_index = [self.index[f"{syst}Up"] for syst in systematics]
+        down_index = [self.index[f"{syst}Down"] for syst in systematics]
+        return self.values[up_index], self.values[down_index]
+
+    def scale(self, factor: np.ndarray):
+        """return the projection with values scaled by 'factor' (and variances by factor^2)"""
+        return VariationProjection(
+            self.values * factor,
+            self.variances * factor**2,
+            self.variations,
+            self.edges,
+        )
+
+
+def project_variations(histogram, variable: str, category: str = None):
+    """
+    project a histogram onto 'variable' for all its variations at once
+
+    Parameters:
+    -----------
+        histogram:
+            hist.Hist with a 'variable' axis and, optionally, 'variation' and 'category' axes
+        variable:
+            variable to project on
+        category:
+            category to select. If None (or if there is no category axis), categories are summed
+    """
+    if category is not None and "category" in histogram.axes.name:
+        histogram = histogram[{"category": category}]
+    if "variation" in histogram.axes.name:
+        projected = histogram.project(variable, "variation")
+        variations = list(projected.axes["variation"])
+    else:
+        projected = histogram.project(variable)
+        variations = ["nominal"]
+    values = projected.values()
+    variances = projected.variances()
+    if variances is None:
+        variances = np.zeros_like(values)
+    # (bin, variation) -> (variation, bin)
+    values = np.array(values, dtype=float).reshape(-1, len(variations)).T
+    variances = np.array(variances, dtype=float).reshape(-1, len(variations)).T
+    return VariationProjection(
+        values, variances, variations, projected.axes[variable].edges
+    )
+
+
+def sum_projections(projections: list) -> VariationProjection:
+    """
+    sum projections (e.g. of several processes), aligning variations by name.
+
+    A variation missing in a projection is taken as its nominal (the total MC of
+    uncertainty_table and of the plots uncertainty band then includes the processes without
+    that variation at their nominal value, instead of failing on histograms with different
+    variations)
+    """
+    variations = []
+    for projection in projections:
+        for variation in projection.variations:
+            if variation not in variations:
+                variations.append(variation)
+    values = np.zeros((len(variations), len(projections[0].edges) - 1))
+    variances = np.zeros_like(values)
+    for projection in projections:
+        index = [
+            projection.index.get(variation, projection.index["nominal"])
+            for variation in variations
+        ]
+        values += projection.values[index]
+        variances += projection.variances[index]
+    return VariationProjection(values, variances, variations, projections[0].edges)
+
+
+def get_envelope(nominal: np.ndarray, up: np.ndarray, down: np.ndarray):
+    """
+    compute the squared Up/Down systematic uncertainty of each bin, summing the systematics in quadrature.
+
+    Variations pushing the nominal value in opposite directions (two-sided) contribute to
+    the Up/Down uncertainties accordingly, while for one-sided variations (both variations
+    pushing in the same direction) the largest deviation is assigned to that direction
+
+    Parameters:
+    -----------
+        nominal:
+            nominal bin contents with shape (n_bins,)
+        up:
+            Up bin contents with shape (n_systematics, n_bins)
+        down:
+            Down bin contents with shape (n_systematics, n_bins)
+
+    Returns:
+    --------
+        squared Up and Down uncertainties with shape (n_bins,)
+    """
+    # uncertainties corresponding to the up/down variations
+    err_up = up - nominal
+    err_down = down - nominal
+    # flags to check which of the two variations are pushing the nominal value up and down
+    up_is_up = err_up > 0
+    down_is_down = err_down < 0
+    # one-sided uncertainty, i.e. when both variations are up or down
+    is_onesided = up_is_up ^ down_is_down
+    err2_up_twosided = np.where(up_is_up, err_up**2, err_down**2)
+    err2_down_twosided = np.where(up_is_up, err_down**2, err_up**2)
+    err2_max = np.maximum(err2_up_twosided, err2_down_twosided)
+    err2_up_onesided = np.where(is_onesided & up_is_up, err2_max, 0)
+    err2_down_onesided = np.where(is_onesided & down_is_down, err2_max, 0)
+    err2_up = np.where(is_onesided, err2_up_onesided, err2_up_twosided)
+    err2_down = np.where(is_onesided, err2_down_onesided, err2_down_twosided)
+    # sum in quadrature of the systematic uncertainties
+    return np.sum(err2_up, axis=0), np.sum(err2_down, axis=0)
+
+
+def get_impacts(nominal: np.ndarray, up: np.ndarray, down: np.ndarray):
+    """
+    compute the relative Up/Down impact of each systematic, summing the bins in quadrature
+
+    Parameters:
+    -----------
+        nominal:
+            nominal bin contents with shape (n_bins,)
+        up:
+            Up bin contents with shape (n_systematics, n_bins)
+        down:
+            Down bin contents with shape (n_systematics, n_bins)
+
+    Returns:
+    --------
+        Up and Down relative impacts with shape (n_systematics,)
+    """
+    # σxup−nominal, σxdown−nominal, and 0
+    up_and_down = np.stack([up - nominal, down - nominal, np.zeros_like(up)], axis=0)
+    # max(σxup−nominal, σxdown−nominal, 0.) / nominal
+    max_up_and_down = np.max(up_and_down, axis=0) / (nominal + 1e-5)
+    # min(σxup−nominal, σxdown−nominal, 0.) / nominal
+    min_up_and_down = np.min(up_and_down, axis=0) / (nominal + 1e-5)
+    # integrate over all bins
+    return (
+        np.sqrt(np.sum(max_up_and_down**2, axis=-1)),
+        np.sqrt(np.sum(min_up_and_down**2, axis=-1)),
+    )
+
+
+class VariationProjector:
+    """
+    Cache of (variation, bin) projections of the processed histograms,
+    shared by the results, uncertainty tables and plots
+
+    Parameters:
+    -----------
+        processed_histograms:
+            processed histograms dictionary ({process: {histogram: hist.Hist}}) or HistogramStore
+    """
+
+    def __init__(self, processed_histograms):
+        self.processed_histograms = processed_histograms
+        self._cache = {}
+
+    def find_histogram(self, process: str, variable: str) -> str:
+        """return the name of the process histogram with a 'variable' axis"""
+        if isinstance(self.processed_histograms, HistogramStore):
+            return self.processed_histograms.find_histogram(process, variable)
+        histogram_dict = self.processed_histograms[process]
+        if variable in histogram_dict:
+            return variable
+        for key in histogram_dict:
+            if variable in histogram_dict[key].axes.name:
+                return key
+        raise ValueError(f"'{variable}' axis not found in workflow's output histogram")
+
+    def get(
+        self,
+        process: str,
+        variable: str,
+        category: str = None,
+        histogram_name: str = None,
+    ) -> VariationProjection:
+        """
+        return the (cached) projection of a process histogram onto 'variable'
+
+        Parameters:
+        -----------
+            process:
+                process name
+            variable:
+                variable to project on
+            category:
+                category to select. If None, categories are summed
+            histogram_name:
+                histogram with the 'variable' axis. If None, it is looked up
+        """
+        if histogram_name is None:
+            histogram_name = self.find_histogram(process, variable)
+        key = (process, histogram_name, variable, category)
+        if key not in self._cache:
+            if isinstance(self.processed_histograms, HistogramStore):
+                # read only the requested category from the store
+                histogram = self.processed_histograms.get(
+                    process, histogram_name, category=category
+                )
+            else:
+                histogram = self.processed_histograms[process][histogram_name]
+            self._cache[key] = project_variations(histogram, variable, category)
+        return self._cache[key]
+
+    def get_total(
+        self,
+        processes: list,
+        variable: str,
+        category: str = None,
+        histogram_name: str = None,
+    ) -> VariationProjection:
+        """return the sum of the processes projections onto 'variable'"""
+        return sum_projections(
+            [
+                self.get(process, variable, category, histogram_name)
+                for process in processes
+            ]
+        )
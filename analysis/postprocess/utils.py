@@ -5,7 +5,7 @@ import pickle
 import logging
 import numpy as np
 import pandas as pd
-from coffea.processor import accumulate
+from analysis.postprocess.systematics import VariationProjector, get_impacts
 
 
 def setup_logger(output_dir):
@@ -194,64 +194,41 @@ def get_variations_keys(processed_histograms: dict):
     return variations
 
 
-def uncertainty_table(processed_histograms, workflow):
-    to_accumulate = []
-    for process in processed_histograms:
-        if process != "Data":
-            to_accumulate.append(processed_histograms[process])
-    helper_histo = accumulate(to_accumulate)
+def uncertainty_table(processed_histograms, workflow, projector=None):
+    if projector is None:
+        projector = VariationProjector(processed_histograms)
     if workflow in ["2b1e", "1b1e1mu", "1b1e"]:
         var = "electron_met_mass"
     elif workflow in ["2b1mu", "1b1mu1e", "1b1mu"]:
         var = "muon_met_mass"
-    helper_histo = helper_histo["mass"].project(var, "variation")
-
-    # get histogram per variation
-    variation_hists = {}
-    for variation in helper_histo.axes["variation"]:
-        if variation == "nominal":
-            nominal = helper_histo[{"variation": variation}]
-        else:
-            variation_hists[variation] = helper_histo[{"variation": variation}]
-
-    # get variations names
-    variations_keys = []
-    for variation in variation_hists:
-        if variation == "nominal":
-            continue
-        # get variation key
-        variation_key = variation.replace("Up", "").replace("Down", "")
-        if variation_key not in variations_keys:
-            variations_keys.append(variation_key)
-
-    variation_impact = {}
-    nom = nominal.values()
-    for variation in variations_keys:
-        # up/down yields by bin
-        varup = variation_hists[f"{variation}Up"].values()
-        vardown = variation_hists[f"{variation}Down"].values()
-        # concatenate σxup−nominal, σxdown−nominal, and 0
-        up_and_down = np.stack([varup - nom, vardown - nom, np.zeros_like(nom)], axis=0)
-        # max(σxup−nominal, σxdown−nominal, 0.) / nominal
-        max_up_and_down = np.max(up_and_down, axis=0) / (nom + 1e-5)
-        # min(σxup−nominal,σ xdown−nominal,0.) / nominal
-        min_up_and_down = np.min(up_and_down, axis=0) / (nom + 1e-5)
-        # integate over all bins
-        variation_impact[variation] = [
-            np.sqrt(np.sum(max_up_and_down**2)),
-            np.sqrt(np.sum(min_up_and_down**2)),
-        ]
-
+    # (variation, bin) projection of the total MC. A process without some variation contributes
+    # its nominal to it (see sum_projections)
+    processes = [process for process in processed_histograms if process != "Data"]
+    projection = projector.get_total(processes, var, histogram_name="mass")
+
+    # up/down impacts of all variations at once
+    variations_keys = projection.get_systematics()
+    impact_up, impact_down = get_impacts(
+        projection.nominal_values, *projection.get_up_down(variations_keys)
+    )
+    variation_impact = {
+        variation: [up, down]
+        for variation, up, down in zip(variations_keys, impact_up, impact_down)
+    }
     syst_df = pd.DataFrame(variation_impact).T * 100
     syst_df = syst_df.rename({0: "Up", 1: "Down"}, axis=1)
     return syst_df
 
 
-def build_systematic_summary(processed_histograms, workflow="1b1mu"):
+def build_systematic_summary(
+    processed_histograms, workflow="1b1mu", projector=None
+):
     """Compute systematic uncertainties for all processes and build a summary table"""
+    if projector is None:
+        projector = VariationProjector(processed_histograms)
     summary_dict = {}
 
-    for process_name, process_hist in processed_histograms.items():
+    for process_name in processed_histograms:
         if process_name == "Data":
             continue
 
@@ -262,55 +239,19 @@ def build_systematic_summary(processed_histograms, workflow="1b1mu"):
         else:
             raise ValueError(f"Unknown workflow: {workflow}")
 
-        # Project the histogram onto the transverse mass variable and variation axis
-        projected_hist = process_hist["mass"].project(mass_variable, "variation")
-
-        # Separate nominal and systematic variations
-        variation_histograms = {}
-        for variation_label in projected_hist.axes["variation"]:
-            if variation_label == "nominal":
-                nominal_hist = projected_hist[{"variation": variation_label}]
-            else:
-                variation_histograms[variation_label] = projected_hist[
-                    {"variation": variation_label}
-                ]
-
-        # Collect systematic names (without Up/Down)
-        systematic_names = []
-        for variation_label in variation_histograms:
-            sys_name = variation_label.replace("Up", "").replace("Down", "")
-            if sys_name not in systematic_names:
-                systematic_names.append(sys_name)
-
-        # Compute relative Up/Down uncertainties
-        nominal_values = nominal_hist.values()
-        systematic_scales = {}
-        for sys_name in systematic_names:
-            values_up = variation_histograms[f"{sys_name}Up"].values()
-            values_down = variation_histograms[f"{sys_name}Down"].values()
-
-            # Compute deviations relative to nominal
-            diffs = np.stack(
-                [
-                    values_up - nominal_values,
-                    values_down - nominal_values,
-                    np.zeros_like(nominal_values),
-                ],
-                axis=0,
-            )
-
-            max_dev = np.max(diffs, axis=0) / (nominal_values + 1e-5)
-            min_dev = np.min(diffs, axis=0) / (nominal_values + 1e-5)
-
-            # Quadrature sum across bins
-            unc_up = np.sqrt(np.sum(max_dev**2))
-            unc_down = np.sqrt(np.sum(min_dev**2))
+        # (variation, bin) projection onto the transverse mass variable
+        projection = projector.get(process_name, mass_variable, histogram_name="mass")
 
-            # Scale factor = 1 + max(%)/100
-            scale_factor = 1 + max(unc_up, unc_down)
-            systematic_scales[sys_name] = scale_factor
-
-        summary_dict[process_name] = pd.Series(systematic_scales)
+        # relative Up/Down uncertainties (quadrature sum across bins)
+        systematic_names = projection.get_systematics()
+        unc_up, unc_down = get_impacts(
+            projection.nominal_values, *projection.get_up_down(systematic_names)
+        )
+        # Scale factor = 1 + max(%)/100
+        scale_factors = 1 + np.maximum(unc_up, unc_down)
+        summary_dict[process_name] = pd.Series(
+            dict(zip(systematic_names, scale_factors))
+        )
 
     # Build final DataFrame with systematics as rows, processes as columns
     summary_table = pd.DataFrame(summary_dict).fillna(1.0)
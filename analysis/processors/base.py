@@ -1,11 +1,14 @@
 import copy
+import time
 import numpy as np
 import awkward as ak
 from coffea import processor
 from coffea.analysis_tools import PackedSelection, Weights
 from analysis.workflows.config import WorkflowConfigBuilder
-from analysis.histograms import HistBuilder, fill_histograms
-from analysis.corrections.jetvetomaps import apply_jetvetomaps
+from analysis.histograms import HistBuilder, fill_histograms, accumulate_outputs
+from analysis.working_points import working_points
+from analysis.processors.perf import StageProfiler
+from analysis.corrections.jetvetomaps import apply_jetvetomaps, add_jetvetomap_mask
 from analysis.corrections import (
     object_corrector_manager,
     weight_manager,
@@ -18,12 +21,14 @@ from analysis.selections import (
     get_metfilters_mask,
     get_stitching_mask,
     get_hemcleaning_mask,
+    get_jetvetomap_event_mask,
 )
 
 
 def update(events, collections):
     """Return a shallow copy of events array with some collections swapped out"""
-    out = events
+    # always a copy: shifts modify their events (e.g. jet veto maps), not the chunk ones
+    out = ak.Array(events.layout, behavior=events.behavior)
     for name, value in collections.items():
         out = ak.with_field(out, value, name)
     return out
@@ -34,8 +39,14 @@ class BaseProcessor(processor.ProcessorABC):
         self,
         workflow: str,
         year: str = "2017",
+        profile: bool = False,
+        profile_memory: bool = True,
     ):
         self.year = year
+        # record per-stage performance into output["metadata"]["perf"]
+        self.profile = profile
+        # trace the stages memory allocations (slows down the processing)
+        self.profile_memory = profile_memory
         self.workflow = workflow
         self.year_key = year[:4]
         self.run = "2" if year.startswith("201") else "3"
@@ -80,14 +91,23 @@ class BaseProcessor(processor.ProcessorABC):
                     output["metadata"][category]["cutflow"][cut_name] = 0
 
     def process(self, events):
-        # correct objects
-        object_corrector_manager(
-            events=events,
-            year=self.year,
-            run=self.run,
-            workflow_config=self.workflow_config,
-            dataset=events.metadata["dataset"],
+        start_time = time.perf_counter()
+        profiler = StageProfiler(
+            enabled=self.profile, trace_memory=self.profile_memory
         )
+        if "jets_veto" in self.workflow_config.corrections_config["objects"]:
+            # compute jet veto maps decision once per chunk (propagated to jet shifts)
+            with profiler.stage("jet_veto_mask", events=events):
+                add_jetvetomap_mask(events, self.year)
+        # correct objects
+        with profiler.stage("object_corrections", events=events):
+            object_corrector_manager(
+                events=events,
+                year=self.year,
+                run=self.run,
+                workflow_config=self.workflow_config,
+                dataset=events.metadata["dataset"],
+            )
         # check if sample is MC
         self.is_mc = hasattr(events, "genWeight")
         if not self.is_mc:
@@ -96,7 +116,8 @@ class BaseProcessor(processor.ProcessorABC):
             events["Electron", "genPartFlav"] = ak.zeros_like(events.Electron.pt)
 
         if not self.is_mc:
-            return self.process_shift(events, shift_name="nominal")
+            output = self.process_shift(events, "nominal", profiler)
+            return self.finalize_chunk(events, output, profiler, start_time)
 
         # define object-level shifts
         shifts = [({"Jet": events.Jet, "MET": events.MET, "Muon": events.Muon, "Tau": events.Tau}, "nominal")]
@@ -116,12 +137,27 @@ class BaseProcessor(processor.ProcessorABC):
                         ({"Jet": events.Jet, "MET": events.MET.tau_energy.down, "Muon": events.Muon, "Tau": events.Tau.tau_energy.down}, f"CMS_t_energy_{self.year_key}Down"),
                     ]
                 )
-        return processor.accumulate(
-            self.process_shift(update(events, collections), name)
+        shift_outputs = [
+            self.process_shift(update(events, collections), name, profiler)
             for collections, name in shifts
-        )
+        ]
+        # histograms of all shifts are aligned once and merged in a preallocated output
+        with profiler.stage("merge_shifts", events=events):
+            output = accumulate_outputs(shift_outputs)
+        return self.finalize_chunk(events, output, profiler, start_time)
 
-    def process_shift(self, events, shift_name):
+    def finalize_chunk(self, events, output, profiler, start_time):
+        # release working point masks cached for this chunk
+        working_points.clear()
+        if self.profile:
+            output["metadata"]["perf"] = profiler.get_output(
+                events, time.perf_counter() - start_time
+            )
+        return output
+
+    def process_shift(self, events, shift_name, profiler=None):
+        if profiler is None:
+            profiler = StageProfiler(enabled=False)
         year = self.year
         is_mc = self.is_mc
         # get dataset name
@@ -142,13 +178,15 @@ class BaseProcessor(processor.ProcessorABC):
         # object selection
         # ----------------------------------------------------------------------------------
         if "jets_veto" in self.workflow_config.corrections_config["objects"]:
-            # apply jet veto maps and update missing energy
-            apply_jetvetomaps(events, year)
+            # remove jets vetoed by the jet veto maps and update missing energy
+            with profiler.stage("jet_veto_maps", shift_name, events):
+                apply_jetvetomaps(events, year)
 
-        object_selector = ObjectSelector(
-            self.workflow_config.object_selection, year, self.run
-        )
-        objects = object_selector.select_objects(events)
+        with profiler.stage("object_selection", shift_name, events):
+            object_selector = ObjectSelector(
+                self.workflow_config.object_selection, year, self.run
+            )
+            objects = object_selector.select_objects(events)
         # ----------------------------------------------------------------------------------
         # event selection
         # ----------------------------------------------------------------------------------
@@ -159,18 +197,21 @@ class BaseProcessor(processor.ProcessorABC):
         if "hlt_paths" in event_selection:
             hlt_paths = event_selection["hlt_paths"]
 
-        for selection, mask in event_selection["selections"].items():
-            selection_manager.add(selection, eval(mask))
+        with profiler.stage("event_selection", shift_name, events):
+            for selection, mask in event_selection["selections"].items():
+                selection_manager.add(selection, eval(mask))
 
         # add cutflow to metadata
-        self.add_cutflow(
-            events, output, objects, selection_manager, weight_manager, dataset
-        )
+        with profiler.stage("cutflow", shift_name, events):
+            self.add_cutflow(
+                events, output, objects, selection_manager, weight_manager, dataset
+            )
 
         # -----------------------------------------------------------------------------------
         # Histogram filling
         # -----------------------------------------------------------------------------------
-        histograms = copy.deepcopy(self.histograms)
+        with profiler.stage("histogram_copy", shift_name):
+            histograms = copy.deepcopy(self.histograms)
         for category, category_cuts in event_selection["categories"].items():
             # get selection mask by category
             category_mask = selection_manager.all(*category_cuts)
@@ -182,16 +223,17 @@ class BaseProcessor(processor.ProcessorABC):
                 for obj in objects:
                     pruned_ev[f"selected_{obj}"] = objects[obj][category_mask]
                 # get weights container
-                weights_container = weight_manager(
-                    pruned_ev=pruned_ev,
-                    year=year,
-                    workflow=self.workflow,
-                    category=category,
-                    run=self.run,
-                    workflow_config=self.workflow_config,
-                    variation=shift_name,
-                    dataset=dataset,
-                )
+                with profiler.stage("weights", shift_name, pruned_ev):
+                    weights_container = weight_manager(
+                        pruned_ev=pruned_ev,
+                        year=year,
+                        workflow=self.workflow,
+                        category=category,
+                        run=self.run,
+                        workflow_config=self.workflow_config,
+                        variation=shift_name,
+                        dataset=dataset,
+                    )
                 if shift_name == "nominal":
                     # save number of events after selection to metadata
                     weighted_final_nevents = ak.sum(weights_container.weight())
@@ -200,18 +242,20 @@ class BaseProcessor(processor.ProcessorABC):
                     )
                 # get analysis variables and fill histograms
                 variables_map = {}
-                for variable, axis in self.histogram_config.axes.items():
-                    variables_map[variable] = eval(axis.expression)[category_mask]
-                fill_histograms(
-                    histogram_config=self.histogram_config,
-                    weights_container=weights_container,
-                    variables_map=variables_map,
-                    histograms=histograms,
-                    shift_name=shift_name,
-                    category=category,
-                    is_mc=is_mc,
-                    flow=self.histogram_config.flow,
-                )
+                with profiler.stage("variables", shift_name, events):
+                    for variable, axis in self.histogram_config.axes.items():
+                        variables_map[variable] = eval(axis.expression)[category_mask]
+                with profiler.stage("fill_histograms", shift_name, pruned_ev):
+                    fill_histograms(
+                        histogram_config=self.histogram_config,
+                        weights_container=weights_container,
+                        variables_map=variables_map,
+                        histograms=histograms,
+                        shift_name=shift_name,
+                        category=category,
+                        is_mc=is_mc,
+                        flow=self.histogram_config.flow,
+                    )
         # define output dictionary accumulator
         output["histograms"] = histograms
         return output
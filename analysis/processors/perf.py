@@ -0,0 +1,96 @@
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# context returned by disabled profilers
+NULL_STAGE = nullcontext()
+# shift name of the stages run once per chunk (before the object-level shifts)
+CHUNK_SHIFT = "chunk"
+
+
+class StageProfiler:
+    """
+    Opt-in profiler of the processor stages
+
+    Each stage records, per shift, the number of calls, the wall time, the number of input events
+    and the (approximate) peak memory allocated while it runs, as traced by tracemalloc. Records are
+    nested dictionaries of numbers, so they merge as any other coffea accumulator
+
+    Parameters:
+    -----------
+        enabled:
+            if False, stages are not recorded and 'stage' returns a no-op context
+        trace_memory:
+            if True, allocations are traced with tracemalloc (it slows down the processing)
+    """
+
+    def __init__(self, enabled: bool = False, trace_memory: bool = True):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.stages = {}
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stage(self, name: str, shift: str = CHUNK_SHIFT, events=None):
+        """
+        return a context recording the stage 'name' of a shift
+
+        Parameters:
+        -----------
+            name:
+                stage name
+            shift:
+                shift name
+            events:
+                input events (used to count them)
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return self._record(name, shift, events)
+
+    @contextmanager
+    def _record(self, name: str, shift: str, events):
+        if self.trace_memory:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            record = self.stages.setdefault(name, {}).setdefault(
+                shift, {"calls": 0, "time": 0.0, "events": 0, "peak_alloc_bytes": 0}
+            )
+            record["calls"] += 1
+            record["time"] += elapsed
+            if events is not None:
+                record["events"] += len(events)
+            if self.trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                record["peak_alloc_bytes"] += max(peak_memory - start_memory, 0)
+
+    def get_output(self, events, elapsed: float) -> dict:
+        """
+        return the stage records and the chunk record to be added to the output metadata
+
+        Parameters:
+        -----------
+            events:
+                events of the chunk
+            elapsed:
+                wall time spent processing the chunk
+        """
+        metadata = events.metadata
+        return {
+            "stages": self.stages,
+            "chunks": [
+                {
+                    "dataset": metadata["dataset"],
+                    "filename": metadata.get("filename", ""),
+                    "entrystart": int(metadata.get("entrystart", 0)),
+                    "entrystop": int(metadata.get("entrystop", len(events))),
+                    "events": len(events),
+                    "time": elapsed,
+                }
+            ],
+        }
@@ -1,9 +1,33 @@
-from analysis.selections.utils import delta_r_mask, select_dileptons, select_dileptons_qcd
-from analysis.selections.object_selections import ObjectSelector
-import analysis.selections.event_selections as event_selections
-get_lumi_mask = event_selections.get_lumi_mask
-get_trigger_mask = event_selections.get_trigger_mask
-get_trigger_match_mask = event_selections.get_trigger_match_mask
-get_metfilters_mask = event_selections.get_metfilters_mask
-get_stitching_mask = event_selections.get_stitching_mask
-get_hemcleaning_mask = event_selections.get_hemcleaning_mask
\ No newline at end of file
+import importlib
+
+# the selections are imported on first use (PEP 562), so that importing a submodule
+# (e.g. analysis.selections.trigger) does not pull in vector and the coffea candidate methods
+_LAZY_ATTRIBUTES = {
+    "delta_r_mask": "analysis.selections.utils",
+    "select_dileptons": "analysis.selections.utils",
+    "select_dileptons_qcd": "analysis.selections.utils",
+    "ObjectSelector": "analysis.selections.object_selections",
+    "get_lumi_mask": "analysis.selections.event_selections",
+    "get_trigger_mask": "analysis.selections.event_selections",
+    "get_trigger_match_mask": "analysis.selections.event_selections",
+    "get_metfilters_mask": "analysis.selections.event_selections",
+    "get_stitching_mask": "analysis.selections.event_selections",
+    "get_hemcleaning_mask": "analysis.selections.event_selections",
+    "get_jetvetomap_event_mask": "analysis.selections.event_selections",
+}
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name == "event_selections":
+        return importlib.import_module("analysis.selections.event_selections")
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    # cache it, so __getattr__ is only called once per attribute
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -4,6 +4,7 @@ import awkward as ak
 import importlib.resources
 from coffea.lumi_tools import LumiMask
 from coffea.analysis_tools import PackedSelection
+from analysis.working_points import working_points
 from analysis.selections.trigger import trigger_mask, trigger_match_mask
 
 
@@ -92,3 +93,16 @@ def get_hemcleaning_mask(events, year):
 
         return ~hem_cleaning
     return np.ones(len(events), dtype=bool)
+
+
+def get_jetvetomap_event_mask(events, year):
+    # jet veto maps event selection
+    # https://cms-jerc.web.cern.ch/Recommendations/#jet-veto-maps
+    # veto events with (pT > 15 GeV, tight ID, EM fraction < 0.9) jets in the vetoed regions.
+    # Use it instead of the 'jets_veto' object correction, which removes jets in the vetoed regions
+    veto_jets = (
+        (events.Jet.pt > 15)
+        & working_points.jets_id(events, year, "tight")
+        & ((events.Jet.chEmEF + events.Jet.neEmEF) < 0.9)
+    )
+    return ~ak.any(veto_jets & ~working_points.jets_vetomap(events, year), axis=1)
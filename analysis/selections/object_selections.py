@@ -2,7 +2,7 @@ import vector
 import numpy as np
 import awkward as ak
 from analysis.working_points import working_points
-from analysis.selections import delta_r_mask, select_dileptons, select_dileptons_qcd
+from analysis.selections.utils import delta_r_mask, select_dileptons, select_dileptons_qcd
 
 
 class ObjectSelector:
@@ -0,0 +1,513 @@
+import re
+import json
+import time
+import sqlite3
+import resource
+from pathlib import Path
+from datetime import datetime
+from collections import Counter
+from analysis.filesets.xrootd_sites import xroot_to_site
+from analysis.utils.output_merger import get_merged_jobs
+
+
+LEDGER_NAME = "jobs.db"
+# job statuses that can be resubmitted: failed or held jobs, and jobs whose state is unknown
+RESUBMIT_STATUSES = ["prepared", "failed", "held"]
+FAILURE_CLASSES = [
+    "memory",
+    "xrootd",
+    "proxy",
+    "held",
+    "aborted",
+    "exit_code",
+    "missing_output",
+]
+
+XROOTD_REGEX = r"root://[a-zA-Z0-9\-.]+(?:[:]\d+)?"
+# header of a condor user log event, e.g. '005 (1234.002.000) 2024-05-01 10:00:00 Job terminated.'
+EVENT_REGEX = re.compile(r"^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+ \S+) (.*)$")
+USAGE_REGEX = re.compile(
+    r"Usr (\d+) (\d+):(\d+):(\d+), Sys (\d+) (\d+):(\d+):(\d+)\s+-\s+Run Remote Usage"
+)
+MEMORY_REGEX = re.compile(r"^\s*Memory \(MB\)\s*:\s*(\d+)")
+MEMORY_UPDATE_REGEX = re.compile(r"^\s*(\d+)\s+-\s+MemoryUsage of job \(MB\)")
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    dataset TEXT NOT NULL,
+    jobnum INTEGER NOT NULL,
+    jobname TEXT,
+    job_dir TEXT,
+    log_dir TEXT,
+    input_site TEXT,
+    status TEXT,
+    attempts INTEGER DEFAULT 0,
+    cluster_id INTEGER,
+    proc_id INTEGER,
+    submit_time TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    exit_code INTEGER,
+    wall_time REAL,
+    cpu_time REAL,
+    cpu_efficiency REAL,
+    peak_memory_mb REAL,
+    events INTEGER,
+    failure_class TEXT,
+    xrootd_errors TEXT,
+    bytes_read INTEGER,
+    open_latency REAL,
+    PRIMARY KEY (dataset, jobnum)
+)
+"""
+# columns added after the first ledger version (added to existing ledgers when opened)
+ADDED_COLUMNS = {"bytes_read": "INTEGER", "open_latency": "REAL"}
+LOG_FILES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_files (path TEXT PRIMARY KEY, size INTEGER)
+"""
+
+
+def get_input_site(root_files: list) -> str:
+    """return the site (or xrootd endpoint if unknown) serving most of the root files"""
+    endpoints = Counter(
+        match.group(0)
+        for root_file in root_files
+        if (match := re.match(XROOTD_REGEX, root_file))
+    )
+    if not endpoints:
+        return None
+    endpoint = endpoints.most_common(1)[0][0]
+    return xroot_to_site.get(endpoint, endpoint)
+
+
+def parse_event_time(timestamp: str) -> datetime:
+    """parse the timestamp of a condor user log event ('YYYY-MM-DD HH:MM:SS' or 'MM/DD HH:MM:SS')"""
+    try:
+        return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return datetime.strptime(
+            f"{datetime.now().year}/{timestamp}", "%Y/%m/%d %H:%M:%S"
+        )
+
+
+def parse_user_log(path: str) -> dict:
+    """
+    parse a condor user log
+
+    Parameters:
+    -----------
+        path:
+            condor user log (.log) file
+
+    Returns:
+    --------
+        dictionary {(cluster_id, proc_id): job state}. The job state holds the submit, start and end
+        times, the exit code (or signal), the remote CPU time, the peak memory and the hold reason
+    """
+    states = {}
+    event = None
+    with open(path, "r") as f:
+        for line in f:
+            header = EVENT_REGEX.match(line)
+            if header:
+                code, cluster_id, proc_id, timestamp, message = header.groups()
+                event = code
+                state = states.setdefault((int(cluster_id), int(proc_id)), {})
+                event_time = parse_event_time(timestamp)
+                if code == "000":
+                    state.update({"status": "submitted", "submit_time": event_time})
+                elif code == "001":
+                    state.update({"status": "running", "start_time": event_time})
+                elif code == "004":
+                    # evicted jobs go back to the queue
+                    state.update({"status": "submitted", "start_time": None})
+                elif code == "005":
+                    state.update({"status": "terminated", "end_time": event_time})
+                elif code == "009":
+                    state.update({"status": "aborted", "end_time": event_time})
+                elif code == "012":
+                    state.update({"status": "held", "hold_reason": ""})
+                elif code == "013":
+                    state.update({"status": "submitted"})
+                continue
+            if event is None or line.startswith("..."):
+                continue
+            if event == "005":
+                if "Normal termination (return value" in line:
+                    state["exit_code"] = int(re.search(r"return value (\d+)", line)[1])
+                elif "Abnormal termination (signal" in line:
+                    state["signal"] = int(re.search(r"signal (\d+)", line)[1])
+                usage = USAGE_REGEX.search(line)
+                if usage:
+                    d1, h1, m1, s1, d2, h2, m2, s2 = map(int, usage.groups())
+                    state["cpu_time"] = (
+                        (d1 + d2) * 86400 + (h1 + h2) * 3600 + (m1 + m2) * 60 + s1 + s2
+                    )
+                memory = MEMORY_REGEX.match(line)
+                if memory:
+                    state["peak_memory_mb"] = max(
+                        state.get("peak_memory_mb", 0), float(memory[1])
+                    )
+            elif event == "006":
+                memory = MEMORY_UPDATE_REGEX.match(line)
+                if memory:
+                    state["peak_memory_mb"] = max(
+                        state.get("peak_memory_mb", 0), float(memory[1])
+                    )
+            elif event == "012":
+                state["hold_reason"] += line.strip() + " "
+    return states
+
+
+def classify_failure(state: dict, err_content: str) -> str:
+    """
+    return the failure class of a job from its condor user log state and error (.err) content,
+    or None if the job did not fail
+    """
+    if state["status"] == "held":
+        if "memory" in state.get("hold_reason", "").lower():
+            return "memory"
+        return "held"
+    if state["status"] == "aborted":
+        return "aborted"
+    if state["status"] != "terminated":
+        return None
+    if state.get("signal") == 9 or "MemoryError" in err_content:
+        return "memory"
+    if state.get("exit_code", 0) == 0 and "signal" not in state:
+        return None
+    if re.search(XROOTD_REGEX, err_content) and (
+        "OSError" in err_content or "XRootD" in err_content
+    ):
+        return "xrootd"
+    if "proxy" in err_content.lower() or "voms" in err_content.lower():
+        return "proxy"
+    return "exit_code"
+
+
+def write_job_summary(
+    path: str,
+    metrics: dict,
+    wall_time: float,
+    root_files: list,
+    checksums: dict = None,
+    open_latency: float = None,
+) -> None:
+    """
+    write the summary of a finished job (read by the job ledger)
+
+    Parameters:
+    -----------
+        path:
+            summary (.json) path
+        metrics:
+            coffea executor metrics (savemetrics=True)
+        wall_time:
+            job wall time in seconds
+        root_files:
+            input root files of the job
+        checksums:
+            adler32 checksums of the uploaded outputs {destination: checksum}
+        open_latency:
+            seconds to open an input file of the job
+    """
+    usage = [
+        resource.getrusage(resource.RUSAGE_SELF),
+        resource.getrusage(resource.RUSAGE_CHILDREN),
+    ]
+    summary = {
+        "events": int(metrics.get("entries", 0)),
+        "wall_time": wall_time,
+        "cpu_time": sum(u.ru_utime + u.ru_stime for u in usage),
+        # ru_maxrss is given in KB
+        "peak_memory_mb": max(u.ru_maxrss for u in usage) / 1024,
+        "input_site": get_input_site(root_files),
+        "bytes_read": metrics.get("bytesread"),
+        "open_latency": open_latency,
+        "time": time.time(),
+    }
+    if checksums:
+        summary["checksums"] = checksums
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=4)
+
+
+class JobLedger:
+    """
+    SQLite ledger of the condor jobs of a campaign (workflow, label and year)
+
+    Jobs are registered when their condor files are built and updated from the condor
+    user logs and from the summaries emitted by the jobs. It holds the status, attempts,
+    wall time, CPU efficiency, peak memory, processed events and input site of each job,
+    and the failure class of failed jobs
+
+    Parameters:
+    -----------
+        path:
+            ledger (.db) path
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute(JOBS_SCHEMA)
+            self.connection.execute(LOG_FILES_SCHEMA)
+            columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+            for column, kind in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def register_jobs(self, dataset: str, jobname: str, job_dir: str, log_dir: str, partitions: dict) -> None:
+        """
+        register (or reset) the jobs of a dataset
+
+        Parameters:
+        -----------
+            dataset:
+                dataset name
+            jobname:
+                condor job name of the dataset
+            job_dir:
+                job directory of the dataset
+            log_dir:
+                log directory of the dataset
+            partitions:
+                dataset partitions ({jobnum: {dataset_key: root_files}})
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM jobs WHERE dataset = ?", (dataset,))
+            self.connection.executemany(
+                """
+                INSERT INTO jobs (dataset, jobnum, jobname, job_dir, log_dir, input_site, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'prepared')
+                """,
+                [
+                    (
+                        dataset,
+                        int(jobnum),
+                        jobname,
+                        str(job_dir),
+                        str(log_dir),
+                        get_input_site(
+                            [f for files in partition.values() for f in files]
+                        ),
+                    )
+                    for jobnum, partition in partitions.items()
+                ],
+            )
+
+    def has_dataset(self, dataset: str) -> bool:
+        query = "SELECT 1 FROM jobs WHERE dataset = ? LIMIT 1"
+        return self.connection.execute(query, (dataset,)).fetchone() is not None
+
+    def mark_submitted(self, jobs: list, cluster_id: int) -> None:
+        """
+        record the submission of jobs to a condor cluster
+
+        Parameters:
+        -----------
+            jobs:
+                (dataset, jobnum) pairs in queue order (the i-th job has ProcId i)
+            cluster_id:
+                condor cluster id. If None (unknown), the jobs can not be matched to the user logs
+        """
+        with self.connection:
+            self.connection.executemany(
+                """
+                UPDATE jobs SET status = 'submitted', attempts = attempts + 1,
+                cluster_id = ?, proc_id = ?, submit_time = NULL, start_time = NULL,
+                end_time = NULL, exit_code = NULL, failure_class = NULL, xrootd_errors = NULL,
+                bytes_read = NULL, open_latency = NULL
+                WHERE dataset = ? AND jobnum = ?
+                """,
+                [
+                    (cluster_id, proc_id, dataset, int(jobnum))
+                    for proc_id, (dataset, jobnum) in enumerate(jobs)
+                ],
+            )
+
+    def update_from_logs(self, log_dir: Path) -> None:
+        """update the jobs from the condor user logs that changed since the last update"""
+        for log_file in Path(log_dir).glob("*/*.log"):
+            size = log_file.stat().st_size
+            row = self.connection.execute(
+                "SELECT size FROM log_files WHERE path = ?", (str(log_file),)
+            ).fetchone()
+            if row is not None and row["size"] == size:
+                continue
+            for (cluster_id, proc_id), state in parse_user_log(log_file).items():
+                self.update_job_state(cluster_id, proc_id, state)
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO log_files (path, size) VALUES (?, ?)",
+                    (str(log_file), size),
+                )
+
+    def update_job_state(self, cluster_id: int, proc_id: int, state: dict) -> None:
+        """update a job from its condor user log state"""
+        job = self.connection.execute(
+            "SELECT * FROM jobs WHERE cluster_id = ? AND proc_id = ?",
+            (cluster_id, proc_id),
+        ).fetchone()
+        if job is None or job["status"] == "done" or "status" not in state:
+            return
+        err_content = ""
+        failure_class = None
+        status = state["status"]
+        if status in ["terminated", "held", "aborted"]:
+            for err_file in Path(job["log_dir"]).glob(f"*.{cluster_id}.{proc_id}.err"):
+                err_content += err_file.read_text(errors="ignore")
+            failure_class = classify_failure(state, err_content)
+            if failure_class is not None and status != "held":
+                status = "failed"
+        start_time, end_time = state.get("start_time"), state.get("end_time")
+        wall_time = (
+            (end_time - start_time).total_seconds() if start_time and end_time else None
+        )
+        cpu_time = state.get("cpu_time")
+        submit_time = state.get("submit_time")
+        with self.connection:
+            self.connection.execute(
+                """
+                UPDATE jobs SET status = ?, submit_time = ?, start_time = ?, end_time = ?,
+                exit_code = ?, wall_time = ?, cpu_time = ?, cpu_efficiency = ?,
+                peak_memory_mb = ?, failure_class = ?, xrootd_errors = ?
+                WHERE dataset = ? AND jobnum = ?
+                """,
+                (
+                    status,
+                    str(submit_time) if submit_time else job["submit_time"],
+                    str(start_time) if start_time else None,
+                    str(end_time) if end_time else None,
+                    state.get("exit_code", state.get("signal")),
+                    wall_time,
+                    cpu_time,
+                    cpu_time / wall_time if cpu_time is not None and wall_time else None,
+                    state.get("peak_memory_mb"),
+                    failure_class,
+                    ",".join(sorted(set(re.findall(XROOTD_REGEX, err_content)))) or None,
+                    job["dataset"],
+                    job["jobnum"],
+                ),
+            )
+
+    def update_from_outputs(self, output_dir: Path, output_format: str) -> None:
+        """
+        mark as done the unfinished jobs with a job summary (or, for jobs submitted without
+        summaries, with an output file). Jobs whose outputs were merged are read from the merged
+        outputs manifests. Terminated jobs without output are failed ('missing_output')
+        """
+        jobs = self.connection.execute("SELECT * FROM jobs WHERE status != 'done'")
+        merged_jobs = {}
+        for job in jobs.fetchall():
+            output_path = Path(output_dir) / job["dataset"] / f"{job['dataset']}_{job['jobnum']}"
+            summary_file = output_path.with_name(output_path.name + ".summary.json")
+            output_file = output_path.with_name(f"{output_path.name}.{output_format}")
+            if job["dataset"] not in merged_jobs:
+                merged_jobs[job["dataset"]] = get_merged_jobs(output_path.parent, job["dataset"])
+            if job["jobnum"] in merged_jobs[job["dataset"]]:
+                self.mark_done(job, merged_jobs[job["dataset"]][job["jobnum"]])
+            elif summary_file.exists():
+                with open(summary_file, "r") as f:
+                    summary = json.load(f)
+                self.mark_done(job, summary)
+            elif output_file.exists():
+                self.mark_done(job, {})
+            elif job["status"] == "terminated":
+                with self.connection:
+                    self.connection.execute(
+                        """
+                        UPDATE jobs SET status = 'failed', failure_class = 'missing_output'
+                        WHERE dataset = ? AND jobnum = ?
+                        """,
+                        (job["dataset"], job["jobnum"]),
+                    )
+
+    def mark_done(self, job: sqlite3.Row, summary: dict) -> None:
+        """mark a job as done, completing its metrics with the job summary"""
+        wall_time = job["wall_time"] or summary.get("wall_time")
+        cpu_time = job["cpu_time"] or summary.get("cpu_time")
+        peak_memory = max(
+            job["peak_memory_mb"] or 0, summary.get("peak_memory_mb") or 0
+        )
+        with self.connection:
+            self.connection.execute(
+                """
+                UPDATE jobs SET status = 'done', failure_class = NULL, wall_time = ?,
+                cpu_time = ?, cpu_efficiency = ?, peak_memory_mb = ?, events = ?,
+                input_site = ?, bytes_read = ?, open_latency = ?
+                WHERE dataset = ? AND jobnum = ?
+                """,
+                (
+                    wall_time,
+                    cpu_time,
+                    cpu_time / wall_time if cpu_time is not None and wall_time else None,
+                    peak_memory or None,
+                    summary.get("events"),
+                    summary.get("input_site") or job["input_site"],
+                    summary.get("bytes_read"),
+                    summary.get("open_latency"),
+                    job["dataset"],
+                    job["jobnum"],
+                ),
+            )
+
+    def get_jobs(self, statuses: list = None, failure_classes: list = None) -> list:
+        """
+        return the jobs, optionally restricted to some statuses and failure classes
+
+        Parameters:
+        -----------
+            statuses:
+                job statuses to select. If None, all statuses are selected
+            failure_classes:
+                failure classes to select. If None, all jobs are selected
+        """
+        query = "SELECT * FROM jobs"
+        conditions, params = [], []
+        for column, values in [("status", statuses), ("failure_class", failure_classes)]:
+            if values is not None:
+                conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+                params += list(values)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY dataset, jobnum"
+        return self.connection.execute(query, params).fetchall()
+
+    def get_status_counts(self) -> dict:
+        query = "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+        return {row["status"]: row["n"] for row in self.connection.execute(query)}
+
+    def get_failure_counts(self) -> dict:
+        query = """
+        SELECT failure_class, COUNT(*) AS n FROM jobs
+        WHERE failure_class IS NOT NULL GROUP BY failure_class
+        """
+        return {row["failure_class"]: row["n"] for row in self.connection.execute(query)}
+
+    def get_site_summary(self) -> list:
+        """return the number of jobs, failures and mean metrics of the jobs of each input site"""
+        query = """
+        SELECT input_site, COUNT(*) AS jobs,
+        SUM(status = 'done') AS done, SUM(status IN ('failed', 'held')) AS failed,
+        AVG(wall_time) AS wall_time, AVG(cpu_efficiency) AS cpu_efficiency,
+        MAX(peak_memory_mb) AS peak_memory_mb, SUM(events) AS events
+        FROM jobs GROUP BY input_site ORDER BY jobs DESC
+        """
+        return self.connection.execute(query).fetchall()
+
+    def get_xrootd_errors(self) -> set:
+        """return the xrootd endpoints found in the error logs of the failed jobs"""
+        query = """
+        SELECT xrootd_errors FROM jobs
+        WHERE failure_class = 'xrootd' AND xrootd_errors IS NOT NULL
+        """
+        errors = set()
+        for row in self.connection.execute(query):
+            errors.update(e for e in row["xrootd_errors"].split(",") if e)
+        return errors
@@ -0,0 +1,280 @@
+"""
+Hierarchical merging of the job outputs of a dataset
+
+Job outputs ('{dataset}_{jobnum}.coffea') are merged into '{dataset}_merged{level}-{first job}.coffea'
+files as the jobs finish: whenever 'fan_in' files of the same level are available, they are merged
+into one file of the next level, so no merge reads more than 'fan_in' files and a campaign keeps at
+most 'fan_in - 1' files per level and dataset. Each merged file has a '.jobs.json' manifest with the
+job summaries of the jobs it contains (read by the job ledger) and the files it was merged from
+
+Usage:
+    python3 analysis/utils/output_merger.py --output_dir outputs/<workflow>/<year> --fan_in 16 --final
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from contextlib import contextmanager
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+from coffea.util import load, save
+from analysis.histograms import accumulate_outputs
+
+MANIFEST_SUFFIX = ".jobs.json"
+LOCK_NAME = ".merge.lock"
+# seconds after which the merge lock of a (killed) job is considered stale
+STALE_LOCK = 3600
+JOB_REGEX = re.compile(r"^(?P<dataset>.+)_(?P<jobnum>\d+)$")
+MERGED_REGEX = re.compile(r"^(?P<dataset>.+)_merged(?P<level>\d+)-(?P<first>\d+)$")
+
+
+def get_output_dataset(name: str) -> str:
+    """return the dataset of an output file name (job or merged output, without extension)"""
+    match = MERGED_REGEX.match(name) or JOB_REGEX.match(name)
+    return match.group("dataset") if match else name
+
+
+def read_json(path: Path) -> dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_json(content: dict, path: Path) -> None:
+    partial = path.with_name(path.name + ".part")
+    with open(partial, "w") as f:
+        json.dump(content, f, indent=4)
+    os.replace(partial, path)
+
+
+def get_manifests(output_dir: Path, dataset: str) -> dict:
+    """return the manifests {merged output stem: manifest} of the merged outputs of a dataset"""
+    manifests = {}
+    for path in Path(output_dir).glob(f"{dataset}_merged*{MANIFEST_SUFFIX}"):
+        stem = path.name[: -len(MANIFEST_SUFFIX)]
+        if MERGED_REGEX.match(stem) and get_output_dataset(stem) == dataset:
+            manifests[stem] = read_json(path)
+    return manifests
+
+
+def get_merged_jobs(output_dir: Path, dataset: str) -> dict:
+    """return the summaries {jobnum: summary} of the jobs of a dataset contained in merged outputs"""
+    return {
+        int(jobnum): summary
+        for manifest in get_manifests(output_dir, dataset).values()
+        for jobnum, summary in manifest["jobs"].items()
+    }
+
+
+def drop_merged_inputs(output_files: list) -> list:
+    """
+    drop the output files already contained in a merged output (inputs of a merge that is
+    being completed, or outputs of jobs run again), so they are not counted twice
+    """
+    merged_inputs = set()
+    for output_dir in {Path(f).parent for f in output_files}:
+        for path in output_dir.glob(f"*_merged*{MANIFEST_SUFFIX}"):
+            stem = path.name[: -len(MANIFEST_SUFFIX)]
+            if not path.with_name(f"{stem}.coffea").exists():
+                continue
+            manifest = read_json(path)
+            merged_inputs.update(str(output_dir / name) for name in manifest["inputs"])
+            dataset = get_output_dataset(stem)
+            merged_inputs.update(
+                str(output_dir / f"{dataset}_{jobnum}.coffea") for jobnum in manifest["jobs"]
+            )
+    return [f for f in output_files if str(Path(f)) not in merged_inputs]
+
+
+@contextmanager
+def merge_lock(output_dir: Path, stale_after: float = STALE_LOCK):
+    """
+    hold the merge lock of an output directory (a directory, created atomically also on /eos).
+    Yields False if another job holds it
+    """
+    lock = Path(output_dir) / LOCK_NAME
+    try:
+        os.mkdir(lock)
+    except FileExistsError:
+        try:
+            stale = time.time() - lock.stat().st_mtime > stale_after
+            if stale:
+                os.rmdir(lock)
+            os.mkdir(lock)
+        except (FileNotFoundError, FileExistsError):
+            stale = False
+        if not stale:
+            yield False
+            return
+    try:
+        yield True
+    finally:
+        os.rmdir(lock)
+
+
+def remove_output(path: Path) -> None:
+    """remove an output file with its job summary or manifest"""
+    stem = path.name[: -len(".coffea")]
+    for sidecar in [path, path.with_name(f"{stem}.summary.json"), path.with_name(stem + MANIFEST_SUFFIX)]:
+        if sidecar.exists():
+            os.remove(sidecar)
+
+
+def recover(output_dir: Path, dataset: str) -> None:
+    """complete the merges of a dataset interrupted by a killed job"""
+    for stem, manifest in get_manifests(output_dir, dataset).items():
+        merged = output_dir / f"{stem}.coffea"
+        partial = output_dir / f"{stem}.coffea.part"
+        if not merged.exists():
+            if not partial.exists():
+                # the merged output was never written: its inputs are still complete
+                os.remove(output_dir / (stem + MANIFEST_SUFFIX))
+                continue
+            # the manifest is written once the merged output is fully saved
+            os.replace(partial, merged)
+        for name in manifest["inputs"]:
+            remove_output(output_dir / name)
+    for partial in output_dir.glob(f"{dataset}_merged*.coffea.part"):
+        if not (output_dir / partial.name[: -len(".part")]).exists():
+            os.remove(partial)
+
+
+def get_level_outputs(output_dir: Path, dataset: str) -> dict:
+    """
+    return the outputs of a dataset that can be merged, by level ({level: [(first job, path)]}).
+    Job outputs (level 0) are merged once their job summary is written. Outputs of jobs already
+    contained in a merged output (jobs run again, e.g. restarted or resubmitted) are deleted
+    """
+    merged_jobs = get_merged_jobs(output_dir, dataset)
+    levels = {}
+    for path in output_dir.glob(f"{dataset}_*.coffea"):
+        stem = path.name[: -len(".coffea")]
+        if get_output_dataset(stem) != dataset:
+            continue
+        match = MERGED_REGEX.match(stem)
+        if match is not None:
+            if not path.with_name(stem + MANIFEST_SUFFIX).exists():
+                continue
+            level, first = int(match.group("level")), int(match.group("first"))
+        else:
+            if not path.with_name(f"{stem}.summary.json").exists():
+                continue
+            level, first = 0, int(JOB_REGEX.match(stem).group("jobnum"))
+            if first in merged_jobs:
+                remove_output(path)
+                continue
+        levels.setdefault(level, []).append((first, path))
+    return {level: sorted(outputs) for level, outputs in levels.items()}
+
+
+def merge_group(output_dir: Path, dataset: str, level: int, group: list) -> Path:
+    """
+    merge a group of outputs of a dataset into an output of the given level
+
+    Parameters:
+    -----------
+        output_dir:
+            output directory of the dataset
+        dataset:
+            dataset name
+        level:
+            level of the merged output
+        group:
+            (first job, path) of the outputs to merge
+
+    Returns:
+    --------
+        merged output path
+    """
+    jobs, output = {}, None
+    for _, path in group:
+        stem = path.name[: -len(".coffea")]
+        match = JOB_REGEX.match(stem)
+        if MERGED_REGEX.match(stem) is None and match is not None:
+            group_jobs = {match.group("jobnum"): read_json(path.with_name(f"{stem}.summary.json"))}
+        else:
+            group_jobs = read_json(path.with_name(stem + MANIFEST_SUFFIX))["jobs"]
+        duplicated = set(jobs) & set(group_jobs)
+        if duplicated:
+            raise ValueError(
+                f"Jobs {sorted(duplicated, key=int)} of {dataset} are in several outputs to merge"
+            )
+        jobs.update(group_jobs)
+        # outputs are loaded one at a time and merged in-place
+        output = accumulate_outputs([load(path)], accum=output)
+    stem = f"{dataset}_merged{level}-{group[0][0]}"
+    merged = output_dir / f"{stem}.coffea"
+    partial = output_dir / f"{stem}.coffea.part"
+    save(output, partial)
+    write_json(
+        {"jobs": jobs, "inputs": [path.name for _, path in group]},
+        output_dir / (stem + MANIFEST_SUFFIX),
+    )
+    os.replace(partial, merged)
+    for _, path in group:
+        remove_output(path)
+    return merged
+
+
+def merge_job_outputs(output_dir: str, dataset: str, fan_in: int, final: bool = False) -> list:
+    """
+    merge the finished job outputs of a dataset with a bounded fan-in tree
+
+    Parameters:
+    -----------
+        output_dir:
+            output directory of the dataset
+        dataset:
+            dataset name
+        fan_in:
+            number of outputs merged into each merged output
+        final:
+            if True, the remaining outputs of all levels are also merged (into a single output if
+            there are at most 'fan_in' of them)
+
+    Returns:
+    --------
+        paths of the new merged outputs (empty if another job is merging the outputs)
+    """
+    if fan_in < 2:
+        raise ValueError("Please specify a merge fan-in of at least 2")
+    output_dir = Path(output_dir)
+    merged = []
+    with merge_lock(output_dir) as acquired:
+        if not acquired:
+            return merged
+        recover(output_dir, dataset)
+        while True:
+            levels = get_level_outputs(output_dir, dataset)
+            level = next((lv for lv in sorted(levels) if len(levels[lv]) >= fan_in), None)
+            if level is not None:
+                merged.append(merge_group(output_dir, dataset, level + 1, levels[level][:fan_in]))
+                continue
+            outputs = sorted(o for lv in sorted(levels) for o in levels[lv])
+            if not final or len(outputs) < 2:
+                break
+            # leftovers of all levels, merged with the same fan-in
+            merged.append(merge_group(output_dir, dataset, max(levels) + 1, outputs[:fan_in]))
+    return merged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--output_dir", type=str, required=True, help="outputs directory (with one directory per dataset)")
+    parser.add_argument("--datasets", nargs="*", type=str, help="(Optional) datasets to merge. If omitted, all datasets are merged")
+    parser.add_argument("--fan_in", type=int, default=16, help="number of outputs merged into each merged output")
+    parser.add_argument("--final", action="store_true", help="also merge the remaining outputs of all levels")
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    datasets = args.datasets or sorted(p.name for p in output_dir.iterdir() if p.is_dir())
+    for dataset in datasets:
+        if not (output_dir / dataset).is_dir():
+            continue
+        merged = merge_job_outputs(output_dir / dataset, dataset, args.fan_in, args.final)
+        remaining = len(list((output_dir / dataset).glob(f"{dataset}_*.coffea")))
+        print(f"{dataset}: {len(merged)} merges, {remaining} output files")
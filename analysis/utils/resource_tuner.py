@@ -0,0 +1,314 @@
+"""
+Per-dataset tuning of the condor memory request, executor workers and chunk size
+
+The memory footprint of each dataset is measured from the telemetry of a previous campaign (peak
+RSS, events and wall time of its done jobs, read from a job ledger) or from a short calibration run
+on the first file of the dataset. A job peak memory is modelled as
+
+    JOB_BASE_MB + workers * (WORKER_BASE_MB + chunksize * MB per event)
+
+so the MB per event of each dataset can be fitted from jobs run with any workers and chunk size
+(the base memories are scaled down for datasets measured below them).
+The chunk size is chosen to keep each chunk around TARGET_CHUNK_MB, the workers to keep the job
+within MAX_MEMORY_MB, and the memory request to cover the predicted peak with a safety margin.
+The chosen values are saved in the campaign 'resources.json', applied to the arguments.json and
+.sub files of each dataset by 'runner.py --tune' (or 'submit_condor.py --tune')
+
+Usage:
+    python3 analysis/utils/resource_tuner.py -w ztomumu -y 2017 --dry_run
+    python3 analysis/utils/resource_tuner.py -w ztomumu -y 2017 --calibrate --datasets DYJetsToLL_inclusive_50
+"""
+
+import io
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+import warnings
+import resource
+import contextlib
+import multiprocessing
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+# executor settings of jobs submitted without tuning (see submit.py)
+DEFAULT_WORKERS = 4
+DEFAULT_CHUNKSIZE = 100_000
+# memory of the job process (interpreter, coffea and correction payloads) and of each worker process
+JOB_BASE_MB = 600
+WORKER_BASE_MB = 300
+# memory targeted per chunk, and chunk size bounds
+TARGET_CHUNK_MB = 400
+MIN_CHUNKSIZE = 10_000
+MAX_CHUNKSIZE = 200_000
+# bounds of the memory request, safety margin over the predicted peak and request granularity
+MIN_MEMORY_MB = 1000
+MAX_MEMORY_MB = 8000
+MEMORY_MARGIN = 1.2
+MEMORY_STEP_MB = 250
+# jobs failed by memory only give a lower bound of their peak memory
+MEMORY_FAILURE_FACTOR = 1.5
+# quantile of the job peak memories (and events) used to size the jobs of a dataset
+QUANTILE = 0.95
+
+
+def get_resources_path(campaign_dir: Path) -> Path:
+    return Path(campaign_dir) / "resources.json"
+
+
+def read_ledger_footprints(ledger_path: str) -> dict:
+    """
+    return the measured footprint of each dataset of a job ledger
+
+    The workers and chunk size of the jobs are read from the arguments.json of each dataset
+    (defaults if missing). Jobs failed by memory count with MEMORY_FAILURE_FACTOR times their peak
+
+    Returns:
+    --------
+        dictionary {dataset: footprint} with the peak memory and events quantiles, the events per
+        second (median), the number of jobs and the workers and chunk size of the jobs
+    """
+    connection = sqlite3.connect(f"file:{ledger_path}?mode=ro", uri=True)
+    connection.row_factory = sqlite3.Row
+    jobs = pd.DataFrame(
+        [
+            dict(row)
+            for row in connection.execute(
+                """
+                SELECT dataset, job_dir, status, failure_class, peak_memory_mb, events, wall_time
+                FROM jobs WHERE peak_memory_mb IS NOT NULL
+                AND (status = 'done' OR failure_class = 'memory')
+                """
+            )
+        ],
+        columns=["dataset", "job_dir", "status", "failure_class", "peak_memory_mb", "events", "wall_time"],
+    )
+    connection.close()
+    footprints = {}
+    for dataset, dataset_jobs in jobs.groupby("dataset"):
+        arguments_path = Path(dataset_jobs["job_dir"].iloc[0]) / "arguments.json"
+        arguments = json.loads(arguments_path.read_text()) if arguments_path.exists() else {}
+        peak_memory = dataset_jobs["peak_memory_mb"].where(
+            dataset_jobs["failure_class"] != "memory",
+            dataset_jobs["peak_memory_mb"] * MEMORY_FAILURE_FACTOR,
+        )
+        done = dataset_jobs[(dataset_jobs["status"] == "done") & (dataset_jobs["wall_time"] > 0)]
+        footprints[dataset] = {
+            "source": "ledger",
+            "jobs": len(dataset_jobs),
+            "memory_failures": int((dataset_jobs["failure_class"] == "memory").sum()),
+            "peak_memory_mb": float(peak_memory.quantile(QUANTILE)),
+            "events": float(done["events"].quantile(QUANTILE)) if len(done) else None,
+            "events_per_s": (
+                float((done["events"] / done["wall_time"]).median()) if len(done) else None
+            ),
+            "workers": int(arguments.get("workers", DEFAULT_WORKERS)),
+            "chunksize": int(arguments.get("chunksize", DEFAULT_CHUNKSIZE)),
+        }
+    return footprints
+
+
+def run_calibration(workflow: str, year: str, dataset: str, files: list, chunksize: int, maxchunks: int) -> dict:
+    """process a few chunks of a dataset with a single worker (meant to run in a fresh process)"""
+    warnings.filterwarnings("ignore")
+    from coffea import processor
+    from coffea.nanoevents import NanoAODSchema
+    from analysis.processors.base import BaseProcessor
+
+    # corrections report (a lot) to stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        _, metrics = processor.run_uproot_job(
+            {dataset: files},
+            treename="Events",
+            processor_instance=BaseProcessor(workflow=workflow, year=year),
+            executor=processor.iterative_executor,
+            executor_args={"schema": NanoAODSchema, "savemetrics": True},
+            chunksize=chunksize,
+            maxchunks=maxchunks,
+        )
+        elapsed = time.perf_counter() - start_time
+    return {
+        "source": "calibration",
+        "jobs": 0,
+        "memory_failures": 0,
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "events": None,
+        "events_per_s": metrics["entries"] / elapsed,
+        # the iterative executor processes the chunks in the job process itself
+        "workers": 0,
+        "chunksize": chunksize,
+    }
+
+
+def calibrate(workflow: str, year: str, dataset: str, files: list, chunksize: int = 20_000, maxchunks: int = 2) -> dict:
+    """
+    measure the footprint of a dataset with a short calibration run on its first file,
+    in a new (spawned) process so its peak RSS is not polluted by previous runs
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(
+            run_calibration, workflow, year, dataset, files[:1], chunksize, maxchunks
+        ).result()
+
+
+def fit_footprint(footprint: dict) -> tuple:
+    """
+    fit the memory model (see the module docstring) to a measured footprint
+
+    Returns:
+    --------
+        scale of the base memories (below 1 if the measured peak is below the modelled base
+        memory of the job) and MB per event of a chunk
+    """
+    workers = footprint["workers"]
+    base = JOB_BASE_MB + workers * WORKER_BASE_MB
+    base_scale = min(footprint["peak_memory_mb"] / base, 1.0)
+    mb_per_event = max(footprint["peak_memory_mb"] - base, 0) / (
+        max(workers, 1) * footprint["chunksize"]
+    )
+    return base_scale, mb_per_event
+
+
+def predict_memory(base_scale: float, mb_per_event: float, workers: int, chunksize: int) -> float:
+    return base_scale * (JOB_BASE_MB + workers * WORKER_BASE_MB) + workers * chunksize * mb_per_event
+
+
+def round_to(value: float, step: int) -> int:
+    return int(math.ceil(value / step) * step)
+
+
+def tune_dataset(footprint: dict, max_workers: int = DEFAULT_WORKERS) -> dict:
+    """
+    choose the memory request, workers and chunk size of the jobs of a dataset
+
+    Parameters:
+    -----------
+        footprint:
+            measured footprint of the dataset (see read_ledger_footprints)
+        max_workers:
+            maximum number of executor workers
+
+    Returns:
+    --------
+        dictionary with the chosen 'memory' (MB, as condor request), 'workers' and 'chunksize',
+        and the predicted peak memory and wall time of a job
+    """
+    base_scale, mb_per_event = fit_footprint(footprint)
+    # chunks around TARGET_CHUNK_MB
+    chunksize = MAX_CHUNKSIZE
+    if mb_per_event > 0:
+        chunksize = TARGET_CHUNK_MB / mb_per_event
+    # small jobs are split in enough chunks to keep all workers busy
+    if footprint["events"]:
+        chunksize = min(chunksize, footprint["events"] / max_workers)
+    chunksize = min(max(round_to(chunksize, 10_000), MIN_CHUNKSIZE), MAX_CHUNKSIZE)
+    # as many workers as fit in the maximum memory (with the safety margin)
+    workers = max_workers
+    while workers > 1 and predict_memory(base_scale, mb_per_event, workers, chunksize) * MEMORY_MARGIN > MAX_MEMORY_MB:
+        workers -= 1
+    peak_memory = predict_memory(base_scale, mb_per_event, workers, chunksize)
+    memory = round_to(peak_memory * MEMORY_MARGIN, MEMORY_STEP_MB)
+    memory = min(max(memory, MIN_MEMORY_MB), MAX_MEMORY_MB)
+    wall_time = None
+    if footprint["events"] and footprint["events_per_s"]:
+        # the measured throughput scales with the number of workers of the measured jobs
+        events_per_s = footprint["events_per_s"] * workers / max(footprint["workers"], 1)
+        wall_time = footprint["events"] / events_per_s
+    return {
+        "memory": str(memory),
+        "workers": workers,
+        "chunksize": chunksize,
+        "predicted_peak_memory_mb": round(peak_memory),
+        "predicted_wall_time": round(wall_time) if wall_time else None,
+    }
+
+
+def get_report(footprints: dict, resources: dict) -> pd.DataFrame:
+    """measured footprints and chosen resources of each dataset"""
+    return pd.DataFrame(
+        {
+            dataset: {
+                "source": footprint["source"],
+                "jobs": footprint["jobs"],
+                "OOM": footprint["memory_failures"],
+                "peak [MB]": footprint["peak_memory_mb"],
+                "events/s": footprint["events_per_s"],
+                "measured workers x chunk": f"{footprint['workers']} x {footprint['chunksize']}",
+                "memory [MB]": resources[dataset]["memory"],
+                "workers": resources[dataset]["workers"],
+                "chunksize": resources[dataset]["chunksize"],
+                "pred. peak [MB]": resources[dataset]["predicted_peak_memory_mb"],
+                "pred. wall time [s]": resources[dataset]["predicted_wall_time"],
+            }
+            for dataset, footprint in footprints.items()
+        }
+    ).T
+
+
+def load_resources(campaign_dir: Path) -> dict:
+    """return the tuned resources {dataset: resources} of a campaign (empty if not tuned)"""
+    path = get_resources_path(campaign_dir)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-w", "--workflow", type=str, required=True, help="workflow of the campaign to tune")
+    parser.add_argument(
+        "-y",
+        "--year",
+        type=str,
+        required=True,
+        choices=["2016preVFP", "2016postVFP", "2017", "2018", "2022preEE", "2022postEE", "2023preBPix", "2023postBPix"],
+        help="dataset year",
+    )
+    parser.add_argument("-l", "--label", type=str, default="", help="label of the campaign")
+    parser.add_argument("--datasets", nargs="*", type=str, help="(Optional) datasets to tune. If omitted, all datasets of the reference ledger (or of the workflow, with --calibrate)")
+    parser.add_argument("--reference", type=str, help="job ledger of the reference campaign (default: the ledger of the campaign itself)")
+    parser.add_argument("--calibrate", action="store_true", help="measure the footprints with a short calibration run instead of a job ledger")
+    parser.add_argument("--max_workers", type=int, default=DEFAULT_WORKERS, help="maximum number of executor workers")
+    parser.add_argument("--dry_run", action="store_true", help="only report the chosen values (resources.json is not written)")
+    args = parser.parse_args()
+
+    from analysis.utils.job_ledger import LEDGER_NAME
+    from analysis.filesets.utils import get_datasets_to_run_over
+
+    campaign_dir = Path.cwd() / "condor" / args.workflow
+    if args.label:
+        campaign_dir = campaign_dir / args.label
+    campaign_dir = campaign_dir / args.year
+
+    if args.calibrate:
+        datasets = args.datasets or get_datasets_to_run_over(args.workflow, args.year)
+        fileset_path = Path.cwd() / "analysis" / "filesets" / f"fileset_{args.year}_NANO_lxplus.json"
+        fileset = json.loads(fileset_path.read_text())
+        footprints = {}
+        for dataset in datasets:
+            print(f"Calibrating {dataset}")
+            footprints[dataset] = calibrate(args.workflow, args.year, dataset, fileset[dataset])
+    else:
+        ledger_path = Path(args.reference or campaign_dir / LEDGER_NAME)
+        if not ledger_path.exists():
+            raise ValueError(f"Please specify a reference job ledger (--reference) or use --calibrate: {ledger_path} does not exist")
+        footprints = read_ledger_footprints(ledger_path)
+        if args.datasets:
+            footprints = {d: f for d, f in footprints.items() if d in args.datasets}
+
+    resources = {dataset: tune_dataset(f, args.max_workers) for dataset, f in footprints.items()}
+    with pd.option_context("display.width", 250, "display.max_columns", 20):
+        print(get_report(footprints, resources).to_string(float_format="{:.1f}".format))
+    if not args.dry_run:
+        # keep the resources of the datasets that were not tuned now
+        tuned = {**load_resources(campaign_dir), **resources}
+        campaign_dir.mkdir(parents=True, exist_ok=True)
+        get_resources_path(campaign_dir).write_text(json.dumps(tuned, indent=4))
+        print(f"\nResources saved to {get_resources_path(campaign_dir)}")
@@ -1,28 +1,234 @@
+import hist
 import pickle
+import argparse
+import numpy as np
+from pathlib import Path
+from coffea.util import load
 from analysis.workflows.config import WorkflowConfigBuilder
 
+# axes whose bins are written as separate shapes
+SPLIT_AXES = ["category", "variation"]
 
-def write_root(out, save_path, args):
+
+def get_split_bins(histogram: hist.Hist, categories: list) -> dict:
+    """
+    return the category and variation bins of a histogram with their (flow) view index.
+    A histogram without a category (variation) axis has a single category ('nominal' variation)
+    """
+    default_bins = {"category": categories[:1], "variation": ["nominal"]}
+    split_bins = {}
+    for axis_name in SPLIT_AXES:
+        if axis_name in histogram.axes.name:
+            axis = histogram.axes[axis_name]
+            split_bins[axis_name] = [(b, axis.index(b)) for b in axis]
+        else:
+            split_bins[axis_name] = [(b, 0) for b in default_bins[axis_name]]
+    return split_bins
+
+
+def project_dense(histogram: hist.Hist, variable: str):
+    """
+    project the (flow) storage of a histogram onto 'variable' for all categories and variations at once
+
+    Returns:
+    --------
+        values and variances with shape (n_categories, n_variations, n_bins + 2),
+        including underflow and overflow bins. Variances are None if unknown
+    """
+    axes_names = list(histogram.axes.name)
+    view = np.asarray(histogram.view(flow=True))
+    if view.dtype.names:
+        arrays = [view["value"], view["variance"]]
+    else:
+        arrays = [view, histogram.variances(flow=True)]
+    # sum over the other variables (including their flow bins)
+    sum_axes = tuple(
+        i
+        for i, name in enumerate(axes_names)
+        if name not in SPLIT_AXES and name != variable
+    )
+    kept_names = [name for i, name in enumerate(axes_names) if i not in sum_axes]
+    missing_names = [name for name in SPLIT_AXES if name not in kept_names]
+    # add empty underflow/overflow bins if the variable axis has none
+    axis = histogram.axes[variable]
+    pad = (int(not axis.traits.underflow), int(not axis.traits.overflow))
+    projections = []
+    for array in arrays:
+        if array is None:
+            projections.append(None)
+            continue
+        array = np.sum(array, axis=sum_axes)
+        # (missing split axes..., kept axes...) -> (category, variation, variable)
+        array = array.reshape((1,) * len(missing_names) + array.shape)
+        names = missing_names + kept_names
+        array = np.moveaxis(
+            array, [names.index(name) for name in SPLIT_AXES + [variable]], [0, 1, 2]
+        )
+        projections.append(np.pad(array, [(0, 0), (0, 0), pad]))
+    return projections[0], projections[1]
+
+
+def to_th1(values: np.ndarray, variances: np.ndarray, axis):
+    """
+    build an uproot TH1D from (flow) bin contents and variances,
+    with the same statistics uproot computes when writing a 1D hist.Hist
+    """
+    from uproot.writing.identify import to_TH1x, to_TAxis
+
+    edges = axis.edges
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    in_range = values[1:-1]
+    if isinstance(axis, hist.axis.Regular) and axis.transform is None:
+        fXbins = np.array([], dtype=">f8")
+    else:
+        fXbins = edges
+    return to_TH1x(
+        fName=None,
+        fTitle="",
+        data=values.astype(">f8"),
+        fEntries=values.sum(),
+        fTsumw=in_range.sum(),
+        fTsumw2=in_range.sum(),
+        fTsumwx=(in_range * centers).sum(),
+        fTsumwx2=(in_range * centers**2).sum(),
+        fSumw2=None if variances is None else variances.astype(">f8"),
+        fXaxis=to_TAxis(
+            fName=axis.name,
+            fTitle=axis.label,
+            fNbins=len(axis),
+            fXmin=edges[0],
+            fXmax=edges[-1],
+            fXbins=fXbins,
+        ),
+    )
+
+
+def get_shapes(histograms: dict, categories: list) -> dict:
+    """
+    build every (category, variable, variation) 1D shape of the histograms,
+    slicing them from one dense projection per histogram and variable
+
+    Parameters:
+    -----------
+        histograms:
+            histograms dictionary ({histogram_name: hist.Hist})
+        categories:
+            workflow categories, used for histograms without a category axis
+
+    Returns:
+    --------
+        dictionary {(category, variable, variation): TH1D}
+    """
+    shapes = {}
+    for histogram in histograms.values():
+        split_bins = get_split_bins(histogram, categories)
+        variables = [name for name in histogram.axes.name if name not in SPLIT_AXES]
+        for variable in variables:
+            values, variances = project_dense(histogram, variable)
+            for category, i in split_bins["category"]:
+                for variation, j in split_bins["variation"]:
+                    shapes[(category, variable, variation)] = to_th1(
+                        values[i, j],
+                        None if variances is None else variances[i, j],
+                        histogram.axes[variable],
+                    )
+    return shapes
+
+
+def write_shapes(path: str, shapes: dict) -> None:
+    """write {name: TH1} shapes to a ROOT file in a single uproot update"""
     import uproot
+
+    with uproot.recreate(path) as f:
+        f.update(shapes)
+
+
+def write_root(out, save_path, args):
     # save metadata
     with open(f"{save_path}.pkl", "wb") as handle:
         pickle.dump(out["metadata"], handle, protocol=pickle.HIGHEST_PROTOCOL)
     # save 1D histograms
-    config_builder = WorkflowConfigBuilder(workflow=args.workflow, year=args.year)
+    config_builder = WorkflowConfigBuilder(workflow=args.workflow)
     workflow_config = config_builder.build_workflow_config()
-    categories = workflow_config.event_selection["categories"]
-    with uproot.recreate(f"{save_path}.root") as f:
-        for category in categories:
-            for histogram in out["histograms"].values():
-                category_histogram = histogram[{"category": category}]
-                variables = [
-                    v for v in category_histogram.axes.name if v != "variation"
-                ]
-                for variable in variables:
-                    for syst_var in category_histogram.axes["variation"]:
-                        variation_histogram = category_histogram[
-                            {"variation": syst_var}
-                        ]
-                        f[f"{category}_{variable}_{syst_var}"] = (
-                            variation_histogram.project(variable)
-                        )
\ No newline at end of file
+    categories = list(workflow_config.event_selection["categories"])
+    shapes = get_shapes(out["histograms"], categories)
+    write_shapes(
+        f"{save_path}.root",
+        {
+            f"{category}_{variable}_{variation}": shape
+            for (category, variable, variation), shape in shapes.items()
+        },
+    )
+
+
+def write_combine_shapes(
+    processed_histograms: dict, categories: list, output_dir: str
+) -> list:
+    """
+    write processed histograms ({process: {histogram: hist.Hist}}) as combine shape files,
+    one file per category with a '{variable}' directory holding the '{process}' (nominal)
+    and '{process}_{variation}' shapes. The 'Data' process is written as 'data_obs'
+
+    Parameters:
+    -----------
+        processed_histograms:
+            processed histograms dictionary
+        categories:
+            workflow categories, used for histograms without a category axis
+        output_dir:
+            directory of the shape files
+
+    Returns:
+    --------
+        paths of the shape files
+    """
+    category_shapes = {}
+    for process, histograms in processed_histograms.items():
+        process_name = "data_obs" if process == "Data" else process
+        for (category, variable, variation), shape in get_shapes(
+            histograms, categories
+        ).items():
+            name = (
+                process_name
+                if variation == "nominal"
+                else f"{process_name}_{variation}"
+            )
+            category_shapes.setdefault(category, {})[f"{variable}/{name}"] = shape
+    paths = []
+    for category, shapes in category_shapes.items():
+        path = Path(output_dir) / f"{category}_shapes.root"
+        write_shapes(str(path), shapes)
+        paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert processed histograms (.coffea) into combine shape files"
+    )
+    parser.add_argument(
+        "--input_files",
+        nargs="+",
+        required=True,
+        help="processed histograms .coffea files to convert",
+    )
+    parser.add_argument(
+        "-w",
+        "--workflow",
+        dest="workflow",
+        type=str,
+        required=True,
+        choices=[
+            f.stem for f in (Path.cwd() / "analysis" / "workflows").glob("*.yaml")
+        ],
+        help="workflow of the processed histograms",
+    )
+    args = parser.parse_args()
+    workflow_config = WorkflowConfigBuilder(workflow=args.workflow).build_workflow_config()
+    categories = list(workflow_config.event_selection["categories"])
+    for input_file in args.input_files:
+        input_file = Path(input_file)
+        output_dir = input_file.parent / f"{input_file.stem}_shapes"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for path in write_combine_shapes(load(input_file), categories, output_dir):
+            print(f"{input_file} -> {path}")
@@ -0,0 +1,65 @@
+from coffea import processor
+from coffea.nanoevents import NanoAODSchema
+
+
+def sample_chunks(chunks: list, fraction: float) -> list:
+    """
+    select an evenly spread, deterministic subset of the chunks of each dataset
+
+    Chunks are ordered by file and entry, and 'fraction' of them (at least one per dataset) are
+    taken at regular intervals, so the subset spans all the files (and runs) of the dataset
+
+    Parameters:
+    -----------
+        chunks:
+            coffea work items of the datasets
+        fraction:
+            fraction of the chunks of each dataset to select
+
+    Returns:
+    --------
+        selected work items
+    """
+    datasets = {}
+    for chunk in sorted(chunks, key=lambda c: (c.dataset, c.filename, c.entrystart)):
+        datasets.setdefault(chunk.dataset, []).append(chunk)
+    sampled = []
+    for dataset_chunks in datasets.values():
+        n_chunks = len(dataset_chunks)
+        n_sampled = min(max(round(fraction * n_chunks), 1), n_chunks)
+        sampled += [
+            dataset_chunks[int((i + 0.5) * n_chunks / n_sampled)] for i in range(n_sampled)
+        ]
+    return sampled
+
+
+def sample_fileset(fileset: dict, fraction: float, chunksize: int) -> tuple:
+    """
+    select the chunks of a fileset processed in sampling mode
+
+    Parameters:
+    -----------
+        fileset:
+            fileset {dataset: root files}
+        fraction:
+            fraction of the chunks of each dataset to process
+        chunksize:
+            number of events per chunk
+
+    Returns:
+    --------
+        selected chunks and the sampling metadata: events processed ('events') and in all the
+        chunks ('total_events'). The processed fraction of the generator weight of a dataset is
+        given by its processed 'sumw' over the generator weight sum of its files ('norm', see
+        analysis/filesets/normalisation.py)
+    """
+    runner = processor.Runner(
+        executor=processor.IterativeExecutor(), schema=NanoAODSchema, chunksize=chunksize
+    )
+    chunks = list(runner.preprocess(fileset, "Events"))
+    sampled = sample_chunks(chunks, fraction)
+    metadata = {
+        "events": sum(len(chunk) for chunk in sampled),
+        "total_events": sum(len(chunk) for chunk in chunks),
+    }
+    return sampled, metadata
@@ -0,0 +1,228 @@
+import os
+import time
+import zlib
+import queue
+import shutil
+import uproot
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# redirectors tried (in order) when the replica of a file stalls or fails
+FALLBACK_REDIRECTORS = [
+    "root://cms-xrd-global.cern.ch/",
+    "root://cmsxrootd.fnal.gov/",
+]
+
+
+def get_replicas(url: str) -> list:
+    """return the replicas of an input file: the given url followed by the fallback redirectors"""
+    replicas = [url]
+    if url.startswith("root://") and "/store/" in url:
+        lfn = url[url.index("/store/") :]
+        replicas += [
+            redirector + lfn
+            for redirector in FALLBACK_REDIRECTORS
+            if not url.startswith(redirector)
+        ]
+    return replicas
+
+
+def get_adler32(path: str) -> str:
+    """return the adler32 checksum (as 8 hex digits, as xrootd reports it) of a file"""
+    checksum = 1
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            checksum = zlib.adler32(block, checksum)
+    return f"{checksum:08x}"
+
+
+def copy_file(source: str, destination: str, timeout: float = None, checksum: str = None) -> None:
+    """
+    copy a file with xrdcp (xrootd urls) or shutil (local or fuse-mounted paths)
+
+    Parameters:
+    -----------
+        source:
+            url or path of the file to copy
+        destination:
+            url or path of the copy
+        timeout:
+            seconds after which the copy is considered stalled (subprocess.TimeoutExpired)
+        checksum:
+            expected adler32 checksum of the copy. A mismatch raises an OSError
+    """
+    if source.startswith("root://") or destination.startswith("root://"):
+        cmd = ["xrdcp", "--force", "--nopbar"]
+        if checksum is not None:
+            # xrdcp verifies the checksum of the destination end to end
+            cmd += ["--cksum", f"adler32:{checksum}"]
+        subprocess.run(
+            cmd + [source, destination], check=True, timeout=timeout, capture_output=True
+        )
+        return
+    # copy to a temporary file and rename it, so a partial copy is never seen as the output
+    Path(destination).parent.mkdir(parents=True, exist_ok=True)
+    partial = f"{destination}.part"
+    shutil.copyfile(source, partial)
+    if checksum is not None and get_adler32(partial) != checksum:
+        os.remove(partial)
+        raise OSError(f"Checksum mismatch copying {source} to {destination}")
+    os.replace(partial, destination)
+
+
+def stage_file(url: str, destination: str, timeout: float) -> str:
+    """
+    copy an input file to local scratch, moving to the next replica when a copy stalls or fails
+
+    Returns:
+    --------
+        replica the file was copied from
+    """
+    errors = []
+    for replica in get_replicas(url):
+        try:
+            copy_file(replica, destination, timeout=timeout)
+            return replica
+        except (subprocess.SubprocessError, OSError) as e:
+            logging.warning(f"Could not stage {replica}: {type(e).__name__}")
+            errors.append(f"{replica}: {e}")
+    raise OSError(f"Could not stage {url} from any replica ({'; '.join(errors)})")
+
+
+def get_open_latency(url: str) -> float:
+    """return the seconds to open a root file (None if it can not be opened)"""
+    start_time = time.perf_counter()
+    try:
+        with uproot.open(url):
+            return time.perf_counter() - start_time
+    except Exception:
+        return None
+
+
+class InputPrefetcher:
+    """
+    stage the input files of a job to local scratch in a background thread
+
+    Files are copied in order, at most 'max_prefetch' files ahead of the file being processed,
+    so the xrootd reads overlap with the processing and the scratch usage is bounded. Iterating
+    yields (url, path) pairs: 'path' is the local copy, or the url itself if the file could not
+    be staged (it is then read remotely). The local copy is deleted when the iteration moves on
+
+    Parameters:
+    -----------
+        files:
+            input file urls (in processing order)
+        scratch_dir:
+            local directory where the files are staged
+        max_prefetch:
+            number of files staged ahead of the file being processed
+        timeout:
+            seconds after which the copy of a replica is considered stalled
+    """
+
+    def __init__(self, files: list, scratch_dir: str, max_prefetch: int = 1, timeout: float = 900):
+        self.files = list(files)
+        self.scratch_dir = Path(scratch_dir)
+        self.timeout = timeout
+        self.staged = queue.Queue()
+        # one slot for the file being processed and one per prefetched file
+        self.slots = threading.Semaphore(max_prefetch + 1)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.scratch_dir.mkdir(parents=True, exist_ok=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        # remove copies staged but not processed (e.g. after a processing error)
+        while not self.staged.empty():
+            self.release(*self.staged.get())
+
+    def run(self):
+        for i, url in enumerate(self.files):
+            # wait for a free slot (checking for an early stop)
+            while not self.slots.acquire(timeout=1):
+                if self.stop.is_set():
+                    return
+            if self.stop.is_set():
+                return
+            local_path = str(self.scratch_dir / f"staged_{i}_{Path(url).name}")
+            try:
+                replica = stage_file(url, local_path, self.timeout)
+                if replica != url:
+                    logging.warning(f"{url} staged from replica {replica}")
+                self.staged.put((url, local_path))
+            except OSError as e:
+                logging.warning(f"{e}. Reading it remotely")
+                self.staged.put((url, url))
+
+    def release(self, url: str, path: str) -> None:
+        """delete the local copy of a processed file and free its slot"""
+        if path != url and os.path.exists(path):
+            os.remove(path)
+        self.slots.release()
+
+    def __iter__(self):
+        for _ in self.files:
+            url, path = self.staged.get()
+            try:
+                yield url, path
+            finally:
+                self.release(url, path)
+
+
+class OutputUploader:
+    """
+    upload the outputs of a job concurrently, verifying their adler32 checksums
+
+    Parameters:
+    -----------
+        max_workers:
+            number of concurrent uploads
+        retries:
+            number of attempts per upload
+    """
+
+    def __init__(self, max_workers: int = 2, retries: int = 3):
+        self.retries = retries
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.uploads = []
+
+    def upload_file(self, source: str, destination: str) -> str:
+        checksum = get_adler32(source)
+        for attempt in range(1, self.retries + 1):
+            try:
+                copy_file(source, destination, checksum=checksum)
+                return checksum
+            except (subprocess.SubprocessError, OSError) as e:
+                logging.warning(
+                    f"Upload of {source} to {destination} failed (attempt {attempt}): {e}"
+                )
+        raise OSError(f"Could not upload {source} to {destination}")
+
+    def upload(self, source: str, destination: str) -> None:
+        """start the upload of a file"""
+        self.uploads.append(
+            (source, destination, self.executor.submit(self.upload_file, source, destination))
+        )
+
+    def wait(self) -> dict:
+        """
+        wait for the uploads to finish (raising the error of the first failed one)
+
+        Returns:
+        --------
+            dictionary {destination: adler32 checksum}
+        """
+        checksums = {
+            destination: future.result() for _, destination, future in self.uploads
+        }
+        self.executor.shutdown()
+        return checksums
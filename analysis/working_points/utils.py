@@ -1,37 +1,73 @@
+import os
 import correctionlib
+from functools import lru_cache
 
+# https://cms-analysis-corrections.docs.cern.ch/corrections/BTV/
+BTAGGING_FILES = {
+    "2016preVFP": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run2-2016preVFP-UL-NanoAODv9/2025-08-19/btagging.json.gz",
+    "2016postVFP": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run2-2016postVFP-UL-NanoAODv9/2025-08-19/btagging.json.gz",
+    "2017": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run2-2017-UL-NanoAODv9/2025-08-19/btagging.json.gz",
+    "2018": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run2-2018-UL-NanoAODv9/2025-08-19/btagging.json.gz",
+    "2022preEE": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run3-22CDSep23-Summer22-NanoAODv12/2025-08-20/btagging.json.gz",
+    "2022postEE": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run3-22EFGSep23-Summer22EE-NanoAODv12/2025-08-20/btagging.json.gz",
+    "2023preBPix": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run3-23CSep23-Summer23-NanoAODv12/2025-08-20/btagging.json.gz",
+    "2023postBPix": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run3-23DSep23-Summer23BPix-NanoAODv12/2025-08-20/btagging.json.gz",
+}
 
-def get_btag_mask(jets, year, wp):
+
+def get_btagging_file(year: str) -> str:
+    """
+    return the path to the b-tagging json with the working points of a year. If the POG jsons
+    root is redirected (POG_CORRECTION_PATH environment variable), the POG b-tagging json is used
     """
+    if os.environ.get("POG_CORRECTION_PATH"):
+        # imported here since analysis.corrections imports this module
+        from analysis.corrections.utils import get_pog_json
+
+        return get_pog_json(json_name="btag", year=year)
+    return BTAGGING_FILES[year]
+
+
+def get_btag_tagger(year: str) -> str:
+    """select b-tagging algorithm according to run era"""
+    return "deepJet" if year.startswith("201") else "particleNet"
+
+
+@lru_cache(maxsize=None)
+def get_btag_wp_value(year: str, wp: str) -> float:
+    """
+    return (and cache per process) the b-tagging discriminant threshold of a working point
+
     Parameters:
     -----------
-      jets: Jet collection
       year: {2016preVFP, 2016postVFP, 2017, 2018, 2022preEE, 2022postEE, 2023preBPix, 2023postBPix}
       wp: {loose, medium, tight}
     """
-    # https://cms-analysis-corrections.docs.cern.ch/corrections/BTV/
-    btagging_files = {
-        "2016preVFP": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run2-2016preVFP-UL-NanoAODv9/2025-08-19/btagging.json.gz",
-        "2016postVFP": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run2-2016postVFP-UL-NanoAODv9/2025-08-19/btagging.json.gz",
-        "2017": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run2-2017-UL-NanoAODv9/2025-08-19/btagging.json.gz",
-        "2018": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run2-2018-UL-NanoAODv9/2025-08-19/btagging.json.gz",
-        "2022preEE": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run3-22CDSep23-Summer22-NanoAODv12/2025-08-20/btagging.json.gz",
-        "2022postEE": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run3-22EFGSep23-Summer22EE-NanoAODv12/2025-08-20/btagging.json.gz",
-        "2023preBPix": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run3-23CSep23-Summer23-NanoAODv12/2025-08-20/btagging.json.gz",
-        "2023postBPix": "/cvmfs/cms-griddata.cern.ch/cat/metadata/BTV/Run3-23DSep23-Summer23BPix-NanoAODv12/2025-08-20/btagging.json.gz",
-    }
     # set working points mapping
     wp_map = {"loose": "L", "medium": "M", "tight": "T"}
-    # select tagger according to run era
-    tagger = "deepJet" if year.startswith("201") else "particleNet"
+    if wp not in wp_map:
+        raise ValueError(
+            f"Invalid value {wp} for b-tagging working point. Please specify {list(wp_map.keys())}"
+        )
     tagger_map = {
         "deepJet": "deepJet_wp_values",
         "particleNet": "particleNet_wp_values",
     }
     # load correction set with working points
-    cset = correctionlib.CorrectionSet.from_file(btagging_files[year])
-    btag_wp = cset[tagger_map[tagger]].evaluate(wp_map[wp])
+    cset = correctionlib.CorrectionSet.from_file(get_btagging_file(year))
+    return cset[tagger_map[get_btag_tagger(year)]].evaluate(wp_map[wp])
+
 
+def get_btag_mask(jets, year, wp):
+    """
+    Parameters:
+    -----------
+      jets: Jet collection
+      year: {2016preVFP, 2016postVFP, 2017, 2018, 2022preEE, 2022postEE, 2023preBPix, 2023postBPix}
+      wp: {loose, medium, tight}
+    """
+    btag_wp = get_btag_wp_value(year, wp)
+    tagger = get_btag_tagger(year)
     if tagger == "deepJet":
         pass_btag_wp = jets.btagDeepFlavB > btag_wp
     elif tagger == "particleNet":
@@ -1,180 +1,252 @@
+import functools
 import numpy as np
 import awkward as ak
 from analysis.working_points.utils import get_btag_mask
+from analysis.corrections.jetvetomaps import get_jetvetomap_mask
+
+
+def get_layout_key(layout) -> tuple:
+    """
+    return a key identifying the buffers of an awkward layout: the same for every access to a
+    collection, and different once the collection is replaced (e.g. by a shift or a correction).
+    Virtual arrays are identified by their cache key, so they are not materialized
+    """
+    if isinstance(layout, ak.layout.VirtualArray):
+        return (layout.cache_key,)
+    if isinstance(layout, ak.layout.NumpyArray):
+        return (np.asarray(layout).ctypes.data, len(layout))
+    key = [type(layout).__name__, len(layout)]
+    for name in ["offsets", "starts", "stops", "index", "mask", "tags"]:
+        if hasattr(layout, name):
+            key.append(np.asarray(getattr(layout, name)).ctypes.data)
+    if isinstance(layout, ak.layout.RecordArray):
+        key.append(tuple(layout.keys()))
+    if hasattr(layout, "contents"):
+        contents = layout.contents
+    elif hasattr(layout, "content"):
+        contents = [layout.content]
+    else:
+        contents = []
+    return tuple(key + [get_layout_key(content) for content in contents])
+
+
+def memoize_mask(collection):
+    """
+    Memoise a working point mask of a collection for the events chunk being processed.
+
+    Cache entries are kept for the whole chunk (bound to its events factory, shared by the
+    shifted copies of the events) and keyed by the layout of the collection the mask is built
+    from, so the events of a shift that replaces the collection miss the cache
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, events, *args, **kwargs):
+            cache = self.get_cache(events)
+            objects = events[collection]
+            layout_key = get_layout_key(objects.layout)
+            key = (method.__name__, collection, layout_key, args, tuple(sorted(kwargs.items())))
+            if key not in cache:
+                cache[key] = method(self, events, *args, **kwargs)
+                # keep the collection alive, so its buffers are not reused by another one
+                self._collections.setdefault(layout_key, objects)
+            return cache[key]
+
+        return wrapper
+
+    return decorator
 
 
 class WorkingPoints:
+    # prong to tau decay modes map
+    tau_decay_modes = {
+        "1": [0, 1, 2],
+        "2": [5, 6, 7],
+        "3": [10, 11],
+        "13": [0, 1, 2, 10, 11],
+        "12": [0, 1, 2, 5, 6, 7],
+        "23": [5, 6, 7, 10, 11],
+    }
+    # DeepTau (bitmask) thresholds
+    deeptau_vs_jet = {
+        "vvvloose": 1,
+        "vvloose": 2,
+        "vloose": 4,
+        "loose": 8,
+        "medium": 16,
+        "tight": 32,
+        "vtight": 64,
+        "vvtight": 128,
+    }
+    deeptau_vs_ele = deeptau_vs_jet
+    deeptau_vs_mu = {
+        "vloose": 1,
+        "loose": 2,
+        "medium": 4,
+        "tight": 8,
+    }
+    # relative isolation thresholds
+    rel_iso = {
+        "loose": 0.25,
+        "medium": 0.20,
+        "tight": 0.15,
+    }
+    # cutbased electron ID values https://twiki.cern.ch/twiki/bin/view/CMS/CutBasedElectronIdentificationRun2
+    electron_cutbased = {
+        "fail": 0,
+        "veto": 1,
+        "loose": 2,
+        "medium": 3,
+        "tight": 4,
+    }
+    # jet pileup ID values
+    jet_puid = {
+        "2016preVFP": {"loose": 1, "medium": 3, "tight": 7},
+        "2016postVFP": {"loose": 1, "medium": 3, "tight": 7},
+        "2017": {"loose": 4, "medium": 6, "tight": 7},
+        "2018": {"loose": 4, "medium": 6, "tight": 7},
+    }
+
+    def __init__(self):
+        self.clear()
+
+    def get_cache(self, events) -> dict:
+        """return the masks cache of the current chunk, resetting it if the chunk changed"""
+        chunk = events.behavior.get("__events_factory__")
+        if chunk is None or chunk is not self._cache_chunk:
+            self.clear()
+            self._cache_chunk = chunk
+        return self._cache
+
+    def clear(self) -> None:
+        """drop cached masks (and the references to the chunk and collections they were built from)"""
+        self._cache_chunk = None
+        self._cache = {}
+        self._collections = {}
+
     # -------------------------------------------
     # Muons
     # -------------------------------------------
+    @memoize_mask("Muon")
     def muons_id(self, events, wp):
         wps = {
-            "highpt": events.Muon.highPtId == 2,
+            "highpt": lambda: events.Muon.highPtId == 2,
             # cutbased ID working points
-            "loose": events.Muon.looseId,
-            "medium": events.Muon.mediumId,
-            "tight": events.Muon.tightId,
+            "loose": lambda: events.Muon.looseId,
+            "medium": lambda: events.Muon.mediumId,
+            "tight": lambda: events.Muon.tightId,
         }
         if wp not in wps:
             raise ValueError(
                 f"Invalid value for muon ID working point. Please specify {list(wps.keys())}"
             )
-        return wps[wp]
+        return wps[wp]()
 
+    @memoize_mask("Muon")
     def muons_iso(self, events, wp):
-        wps = {
-            "loose": (
-                events.Muon.pfRelIso04_all < 0.25
-                if hasattr(events.Muon, "pfRelIso04_all")
-                else events.Muon.pfRelIso03_all < 0.25
-            ),
-            "medium": (
-                events.Muon.pfRelIso04_all < 0.20
-                if hasattr(events.Muon, "pfRelIso04_all")
-                else events.Muon.pfRelIso03_all < 0.20
-            ),
-            "tight": (
-                events.Muon.pfRelIso04_all < 0.15
-                if hasattr(events.Muon, "pfRelIso04_all")
-                else events.Muon.pfRelIso03_all < 0.15
-            ),
-        }
-        if wp not in wps:
+        if wp not in self.rel_iso:
             raise ValueError(
-                f"Invalid value {wp} for muon ISO working point. Please specify {list(wps.keys())}"
+                f"Invalid value {wp} for muon ISO working point. Please specify {list(self.rel_iso.keys())}"
             )
-        return wps[wp]
+        rel_iso = (
+            events.Muon.pfRelIso04_all
+            if hasattr(events.Muon, "pfRelIso04_all")
+            else events.Muon.pfRelIso03_all
+        )
+        return rel_iso < self.rel_iso[wp]
 
     # -------------------------------------------
     # Electrons
     # -------------------------------------------
+    @memoize_mask("Electron")
     def electrons_id(self, events, wp):
         wps = {
             # mva ID working points https://twiki.cern.ch/twiki/bin/view/CMS/MultivariateElectronIdentificationRun2
-            "wp80iso": (
+            "wp80iso": lambda: (
                 events.Electron.mvaFall17V2Iso_WP80
                 if hasattr(events.Electron, "mvaFall17V2Iso_WP80")
                 else events.Electron.mvaIso_WP80
             ),
-            "wp90iso": (
+            "wp90iso": lambda: (
                 events.Electron.mvaFall17V2Iso_WP90
                 if hasattr(events.Electron, "mvaFall17V2Iso_WP90")
                 else events.Electron.mvaIso_WP90
             ),
-            # cutbased ID working points https://twiki.cern.ch/twiki/bin/view/CMS/CutBasedElectronIdentificationRun2
-            "fail": events.Electron.cutBased == 0,
-            "veto": events.Electron.cutBased == 1,
-            "loose": events.Electron.cutBased == 2,
-            "medium": events.Electron.cutBased == 3,
-            "tight": events.Electron.cutBased == 4,
         }
+        # cutbased ID working points
+        for name, value in self.electron_cutbased.items():
+            wps[name] = lambda value=value: events.Electron.cutBased == value
         if hasattr(events.Electron, "mvaFall17V2Iso_WPL"):
-            wps["wpLiso"] = events.Electron.mvaFall17V2Iso_WPL
+            wps["wpLiso"] = lambda: events.Electron.mvaFall17V2Iso_WPL
         if wp not in wps:
             raise ValueError(
                 f"Invalid value {wp} for electron ID working point. Please specify {list(wps.keys())}"
             )
-        return wps[wp]
+        return wps[wp]()
 
+    @memoize_mask("Electron")
     def electrons_iso(self, events, wp):
-        wps = {
-            # https://twiki.cern.ch/twiki/bin/view/CMS/SWGuideMuonSelection
-            "loose": (
-                events.Electron.pfRelIso04_all < 0.25
-                if hasattr(events.Electron, "pfRelIso04_all")
-                else events.Electron.pfRelIso03_all < 0.25
-            ),
-            "medium": (
-                events.Electron.pfRelIso04_all < 0.20
-                if hasattr(events.Electron, "pfRelIso04_all")
-                else events.Electron.pfRelIso03_all < 0.20
-            ),
-            "tight": (
-                events.Electron.pfRelIso04_all < 0.15
-                if hasattr(events.Electron, "pfRelIso04_all")
-                else events.Electron.pfRelIso03_all < 0.15
-            ),
-        }
-        if wp not in wps:
+        # https://twiki.cern.ch/twiki/bin/view/CMS/SWGuideMuonSelection
+        if wp not in self.rel_iso:
             raise ValueError(
-                f"Invalid value {wp} for electron ISO working point. Please specify {list(wps.keys())}"
+                f"Invalid value {wp} for electron ISO working point. Please specify {list(self.rel_iso.keys())}"
             )
-        return wps[wp]
+        rel_iso = (
+            events.Electron.pfRelIso04_all
+            if hasattr(events.Electron, "pfRelIso04_all")
+            else events.Electron.pfRelIso03_all
+        )
+        return rel_iso < self.rel_iso[wp]
 
     # -------------------------------------------
     # Taus
     # -------------------------------------------
+    @memoize_mask("Tau")
     def taus_vs_jet(self, events, wp):
-        wps = {
-            "vvvloose": events.Tau.idDeepTau2017v2p1VSjet > 1,
-            "vvloose": events.Tau.idDeepTau2017v2p1VSjet > 2,
-            "vloose": events.Tau.idDeepTau2017v2p1VSjet > 4,
-            "loose": events.Tau.idDeepTau2017v2p1VSjet > 8,
-            "medium": events.Tau.idDeepTau2017v2p1VSjet > 16,
-            "tight": events.Tau.idDeepTau2017v2p1VSjet > 32,
-            "vtight": events.Tau.idDeepTau2017v2p1VSjet > 64,
-            "vvtight": events.Tau.idDeepTau2017v2p1VSjet > 128,
-        }
-        if wp not in wps:
+        if wp not in self.deeptau_vs_jet:
             raise ValueError(
-                f"Invalid value {wp} for DeepTauvsJet working point. Please specify {list(wps.keys())}"
+                f"Invalid value {wp} for DeepTauvsJet working point. Please specify {list(self.deeptau_vs_jet.keys())}"
             )
-        return wps[wp]
+        return events.Tau.idDeepTau2017v2p1VSjet > self.deeptau_vs_jet[wp]
 
+    @memoize_mask("Tau")
     def taus_vs_ele(self, events, wp):
-        wps = {
-            "vvvloose": events.Tau.idDeepTau2017v2p1VSe > 1,
-            "vvloose": events.Tau.idDeepTau2017v2p1VSe > 2,
-            "vloose": events.Tau.idDeepTau2017v2p1VSe > 4,
-            "loose": events.Tau.idDeepTau2017v2p1VSe > 8,
-            "medium": events.Tau.idDeepTau2017v2p1VSe > 16,
-            "tight": events.Tau.idDeepTau2017v2p1VSe > 32,
-            "vtight": events.Tau.idDeepTau2017v2p1VSe > 64,
-            "vvtight": events.Tau.idDeepTau2017v2p1VSe > 128,
-        }
-        if wp not in wps:
+        if wp not in self.deeptau_vs_ele:
             raise ValueError(
-                f"Invalid value {wp} for DeepTauvsElectron working point. Please specify {list(wps.keys())}"
+                f"Invalid value {wp} for DeepTauvsElectron working point. Please specify {list(self.deeptau_vs_ele.keys())}"
             )
-        return wps[wp]
+        return events.Tau.idDeepTau2017v2p1VSe > self.deeptau_vs_ele[wp]
 
+    @memoize_mask("Tau")
     def taus_vs_mu(self, events, wp):
-        wps = {
-            "vloose": events.Tau.idDeepTau2017v2p1VSmu > 1,
-            "loose": events.Tau.idDeepTau2017v2p1VSmu > 2,
-            "medium": events.Tau.idDeepTau2017v2p1VSmu > 4,
-            "tight": events.Tau.idDeepTau2017v2p1VSmu > 8,
-        }
-        if wp not in wps:
+        if wp not in self.deeptau_vs_mu:
             raise ValueError(
-                f"Invalid value {wp} for DeepTauvsMuon working point. Please specify {list(wps.keys())}"
+                f"Invalid value {wp} for DeepTauvsMuon working point. Please specify {list(self.deeptau_vs_mu.keys())}"
             )
-        return wps[wp]
+        return events.Tau.idDeepTau2017v2p1VSmu > self.deeptau_vs_mu[wp]
 
+    @memoize_mask("Tau")
     def taus_decaymode(self, events, wp):
-        # prong to mode map
-        wps = {
-            "1": [0, 1, 2],
-            "2": [5, 6, 7],
-            "3": [10, 11],
-            "13": [0, 1, 2, 10, 11],
-            "12": [0, 1, 2, 5, 6, 7],
-            "23": [5, 6, 7, 10, 11],
-        }
-        if wp not in wps:
+        if wp not in self.tau_decay_modes:
             raise ValueError(
-                f"Invalid value {wp} for tau prong working point. Please specify {list(wps.keys())}"
+                f"Invalid value {wp} for tau prong working point. Please specify {list(self.tau_decay_modes.keys())}"
             )
+        # single membership test on the flat decay modes
         tau_dm = events.Tau.decayMode
-        decay_mode_mask = ak.zeros_like(tau_dm)
-        for mode in wps[wp]:
-            decay_mode_mask = np.logical_or(decay_mode_mask, tau_dm == mode)
-        return decay_mode_mask
+        decay_mode_mask = np.isin(
+            ak.to_numpy(ak.flatten(tau_dm)), self.tau_decay_modes[wp]
+        )
+        return ak.unflatten(decay_mode_mask, ak.num(tau_dm))
 
     # -------------------------------------------
     # Jets
     # -------------------------------------------
+    @memoize_mask("Jet")
     def jets_id(self, events, year, wp):
+        if wp not in ["tight", "tightlepveto"]:
+            raise ValueError(
+                f"Invalid value {wp} for jet ID working point. Please specify {['tight', 'tightlepveto']}"
+            )
         # Run 3 NanoAODs have a bug in jetId
         # Implement fix from:
         # https://twiki.cern.ch/twiki/bin/viewauth/CMS/JetID13p6TeV#nanoAOD_Flags
@@ -208,11 +280,6 @@ class WorkingPoints:
                     ),
                 ),
             )
-            jetid_tightlepveto = ak.where(
-                np.abs(events.Jet.eta) <= 2.7,
-                jetid_tight & (events.Jet.muEF < 0.8) & (events.Jet.chEmEF < 0.8),
-                jetid_tight,
-            )
         elif year.startswith("202"):
             # NanoV12
             jetid_tight = ak.where(
@@ -230,65 +297,49 @@ class WorkingPoints:
                     ),
                 ),
             )
-            jetid_tightlepveto = ak.where(
-                np.abs(events.Jet.eta) <= 2.7,
-                jetid_tight & (events.Jet.muEF < 0.8) & (events.Jet.chEmEF < 0.8),
-                jetid_tight,
-            )
         else:
             # NanoV9
-            jetid_tight = events.Jet.jetId == 2
-            jetid_tightlepveto = events.Jet.jetId == 6
+            if wp == "tight":
+                return ak.values_astype(events.Jet.jetId == 2, bool)
+            return ak.values_astype(events.Jet.jetId == 6, bool)
 
-        wps = {
-            "tight": ak.values_astype(jetid_tight, bool),
-            "tightlepveto": ak.values_astype(jetid_tightlepveto, bool),
-        }
-        if wp not in wps:
-            raise ValueError(
-                f"Invalid value {wp} for jet ID working point. Please specify {list(wps.keys())}"
+        if wp == "tightlepveto":
+            return ak.values_astype(
+                ak.where(
+                    np.abs(events.Jet.eta) <= 2.7,
+                    jetid_tight & (events.Jet.muEF < 0.8) & (events.Jet.chEmEF < 0.8),
+                    jetid_tight,
+                ),
+                bool,
             )
-        return wps[wp]
+        return ak.values_astype(jetid_tight, bool)
 
+    @memoize_mask("Jet")
     def jets_pileup_id(self, events, wp, year):
         if year.startswith("201"):
             # Run2
-            wps = {
-                "2016preVFP": {
-                    "loose": events.Jet.puId == 1,
-                    "medium": events.Jet.puId == 3,
-                    "tight": events.Jet.puId == 7,
-                },
-                "2016postVFP": {
-                    "loose": events.Jet.puId == 1,
-                    "medium": events.Jet.puId == 3,
-                    "tight": events.Jet.puId == 7,
-                },
-                "2017": {
-                    "loose": events.Jet.puId == 4,
-                    "medium": events.Jet.puId == 6,
-                    "tight": events.Jet.puId == 7,
-                },
-                "2018": {
-                    "loose": events.Jet.puId == 4,
-                    "medium": events.Jet.puId == 6,
-                    "tight": events.Jet.puId == 7,
-                },
-            }
-            if wp not in wps[year]:
+            if wp not in self.jet_puid[year]:
                 raise ValueError(
-                    f"Invalid value {wp} for jet pileup ID working point. Please specify {list(wps[year].keys())}"
+                    f"Invalid value {wp} for jet pileup ID working point. Please specify {list(self.jet_puid[year].keys())}"
                 )
             # break up selection for low and high pT jets
             # to apply jets_pileup only to jets with pT < 50 GeV
             return ak.where(
                 events.Jet.pt < 50,
-                wps[year][wp],
+                events.Jet.puId == self.jet_puid[year][wp],
                 events.Jet.pt >= 50,
             )
         else:
             # Run3
             return np.ones_like(events.Jet.pt, dtype=bool)
 
+    @memoize_mask("Jet")
     def jets_btagging(self, events, wp, year):
         return get_btag_mask(events.Jet, year, wp)
+
+    @memoize_mask("Jet")
+    def jets_vetomap(self, events, year):
+        # jets outside the jet veto maps regions
+        if "passJetVetoMap" in events.Jet.fields:
+            return events.Jet.passJetVetoMap
+        return get_jetvetomap_mask(events.Jet, year)
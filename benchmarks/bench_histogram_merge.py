@@ -0,0 +1,121 @@
+"""
+Benchmark of the merge of processor outputs: coffea's processor.accumulate vs accumulate_outputs
+
+Usage:
+    # real campaign outputs
+    python3 benchmarks/bench_histogram_merge.py --input_files "outputs/<workflow>/<year>/<sample>/*.coffea"
+    # synthetic outputs built from a workflow's histograms
+    python3 benchmarks/bench_histogram_merge.py --workflow ztomumu --n_outputs 20
+"""
+
+import sys
+import glob
+import time
+import copy
+import argparse
+import numpy as np
+from pathlib import Path
+from coffea.util import load
+from coffea.processor import accumulate
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from analysis.histograms import HistBuilder, accumulate_outputs
+from analysis.workflows.config import WorkflowConfigBuilder
+
+
+def make_synthetic_outputs(workflow: str, n_outputs: int, n_variations: int, seed: int = 0):
+    """build processor-like outputs with random bin contents and shuffled variation order"""
+    rng = np.random.default_rng(seed)
+    workflow_config = WorkflowConfigBuilder(workflow=workflow).build_workflow_config()
+    templates = HistBuilder(workflow_config).build_histogram()
+    variations = ["nominal"] + [
+        f"syst{i}{direction}" for i in range(n_variations) for direction in ["Up", "Down"]
+    ]
+    outputs = []
+    for _ in range(n_outputs):
+        histograms = copy.deepcopy(templates)
+        # chunks fill variations in different orders (and may miss some)
+        output_variations = list(rng.permutation(variations))[
+            : len(variations) - rng.integers(0, 2)
+        ]
+        for histogram in histograms.values():
+            if "variation" in histogram.axes.name:
+                for variation in output_variations:
+                    histogram.fill(
+                        **{
+                            axis.name: (
+                                variation
+                                if axis.name == "variation"
+                                else axis.value(0)
+                            )
+                            for axis in histogram.axes
+                        }
+                    )
+            view = np.asarray(histogram.view(flow=True))
+            if view.dtype.names:
+                view["value"] = rng.random(view.shape)
+                view["variance"] = rng.random(view.shape)
+            else:
+                view[...] = rng.random(view.shape)
+        outputs.append(
+            {"histograms": histograms, "metadata": {"sumw": float(rng.random())}}
+        )
+    return outputs
+
+
+def check_outputs(reference, output) -> None:
+    """check that both merges give the same bin contents for every variation"""
+    for name, histogram in reference["histograms"].items():
+        other = output["histograms"][name]
+        variations = (
+            list(histogram.axes["variation"])
+            if "variation" in histogram.axes.name
+            else [None]
+        )
+        for variation in variations:
+            selector = {} if variation is None else {"variation": variation}
+            assert np.allclose(
+                histogram[selector].values(flow=True), other[selector].values(flow=True)
+            ), name
+    assert np.isclose(reference["metadata"]["sumw"], output["metadata"]["sumw"])
+
+
+def time_merge(function, outputs, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        to_merge = copy.deepcopy(outputs)
+        start = time.perf_counter()
+        function(to_merge)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--input_files", type=str, help="glob of processor outputs (.coffea)")
+    parser.add_argument("--workflow", type=str, default="ztomumu", help="workflow of the synthetic outputs")
+    parser.add_argument("--n_outputs", type=int, default=20, help="number of synthetic outputs")
+    parser.add_argument("--n_variations", type=int, default=5, help="number of synthetic systematics")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timing repetitions")
+    args = parser.parse_args()
+
+    if args.input_files:
+        outputs = [load(f) for f in sorted(glob.glob(args.input_files))]
+        outputs = [output for output in outputs if output]
+        source = args.input_files
+    else:
+        outputs = make_synthetic_outputs(args.workflow, args.n_outputs, args.n_variations)
+        source = f"synthetic ({args.workflow}, {args.n_variations} systematics)"
+
+    check_outputs(accumulate(copy.deepcopy(outputs)), accumulate_outputs(copy.deepcopy(outputs)))
+
+    print(f"outputs: {len(outputs)} from {source}")
+    results = {
+        "processor.accumulate": time_merge(accumulate, outputs, args.repeat),
+        "accumulate_outputs": time_merge(accumulate_outputs, outputs, args.repeat),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>22}: {seconds:8.3f} s  ({len(outputs) / seconds:8.1f} outputs/s)")
+    speedup = results["processor.accumulate"] / results["accumulate_outputs"]
+    print(f"{'speedup':>22}: {speedup:8.2f}x")
@@ -0,0 +1,119 @@
+"""
+Cold-start benchmark: import time of the analysis modules in fresh interpreters
+
+Each module is imported in a new python process (median wall time over some repetitions), and the
+heavy dependencies it pulls in are reported. With --ref, the same modules are also timed on a git
+revision of the repository (extracted with 'git archive') to report the cold-start change
+
+Usage:
+    python3 benchmarks/bench_import.py --ref HEAD~1 --repeat 5
+"""
+
+import sys
+import json
+import tarfile
+import argparse
+import tempfile
+import subprocess
+import statistics
+import pandas as pd
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# modules imported by the processor workers (and the condor entry point)
+MODULES = [
+    "analysis.corrections",
+    "analysis.corrections.utils",
+    "analysis.selections",
+    "analysis.selections.trigger",
+    "analysis.processors.base",
+]
+# dependencies whose import is expensive
+HEAVY_MODULES = [
+    "scipy",
+    "vector",
+    "cloudpickle",
+    "correctionlib",
+    "coffea.jetmet_tools",
+    "coffea.lookup_tools",
+    "coffea.nanoevents.methods.candidate",
+]
+MEASURE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"time": elapsed, "modules": len(sys.modules), "heavy": heavy}}))
+"""
+
+
+def measure_import(module: str, repo_dir: Path, repeat: int = 3) -> dict:
+    """
+    import a module in 'repeat' fresh interpreters
+
+    Returns:
+    --------
+        dictionary with the median import time [s], the number of loaded modules and
+        the loaded heavy dependencies
+    """
+    runs = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-c", MEASURE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=repo_dir,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            return {"time": None, "modules": None, "heavy": process.stderr.strip().split("\n")[-1]}
+        runs.append(json.loads(process.stdout.strip().split("\n")[-1]))
+    return {
+        "time": statistics.median(run["time"] for run in runs),
+        "modules": runs[-1]["modules"],
+        "heavy": ", ".join(runs[-1]["heavy"]),
+    }
+
+
+def extract_revision(ref: str, output_dir: Path) -> Path:
+    """extract the tree of a git revision of the repository to 'output_dir'"""
+    archive = output_dir / "tree.tar"
+    with open(archive, "wb") as f:
+        subprocess.run(["git", "archive", ref], cwd=REPO_DIR, stdout=f, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(output_dir / "tree")
+    return output_dir / "tree"
+
+
+def get_report(modules: list, repeat: int, ref: str = None) -> pd.DataFrame:
+    """import time report of the working tree (and of a git revision, if given)"""
+    report = pd.DataFrame(
+        {module: measure_import(module, REPO_DIR, repeat) for module in modules}
+    ).T
+    if ref is None:
+        return report
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ref_dir = extract_revision(ref, Path(tmpdir))
+        ref_report = pd.DataFrame(
+            {module: measure_import(module, ref_dir, repeat) for module in modules}
+        ).T
+    report[f"time ({ref})"] = ref_report["time"]
+    report["speedup"] = ref_report["time"].astype(float) / report["time"].astype(float)
+    report[f"heavy ({ref})"] = ref_report["heavy"]
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--modules", nargs="+", default=MODULES, help="modules to import")
+    parser.add_argument("--repeat", type=int, default=3, help="number of fresh interpreters per module")
+    parser.add_argument("--ref", type=str, help="git revision to compare with")
+    parser.add_argument("--output", type=str, help="save the report to this .csv file")
+    args = parser.parse_args()
+
+    report = get_report(args.modules, args.repeat, args.ref)
+    with pd.option_context("display.max_colwidth", 80, "display.width", 200):
+        print(report.to_string(float_format="{:.3f}".format))
+    if args.output:
+        report.to_csv(args.output)
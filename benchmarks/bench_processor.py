@@ -0,0 +1,166 @@
+"""
+Offline benchmark of the processor throughput: events/s and peak RSS per workflow and year
+
+Synthetic NanoAOD-like files (benchmarks/synthetic_nanoaod.py) are processed with BaseProcessor
+using stand-in POG correction payloads (benchmarks/standin_corrections.py), so no /cvmfs, grid
+proxy or xrootd access is needed. Each (workflow, year) runs in a fresh process, hence its peak
+RSS is not polluted by the previous runs
+
+Usage:
+    python3 benchmarks/bench_processor.py --workflows ztomumu 2b1mu --years 2017 2022postEE --n_events 50000
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+import resource
+import tempfile
+import contextlib
+import pandas as pd
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(REPO_DIR))
+
+from benchmarks.synthetic_nanoaod import write_nanoaod, get_run
+from benchmarks.standin_corrections import write_standin_corrections
+
+# MC dataset of the synthetic files (top quark pair samples: every MC weight applies)
+DATASETS = {"2": "TTTo2L2Nu", "3": "TTto2L2Nu"}
+
+
+def get_workflows() -> list:
+    return sorted(f.stem for f in (REPO_DIR / "analysis" / "workflows").glob("*.yaml"))
+
+
+def prepare_inputs(workdir: Path, years: list, n_events: int, n_files: int, reuse: bool) -> dict:
+    """
+    write the stand-in POG payloads and the synthetic files of each year
+
+    Returns:
+    --------
+        dictionary {year: list of synthetic files}
+    """
+    write_standin_corrections(str(workdir / "pog"), years)
+    files = {}
+    for year in years:
+        files[year] = []
+        for i in range(n_files):
+            path = workdir / "nanoaod" / f"nano_{year}_{n_events}_{i}.root"
+            if not (reuse and path.exists()):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                write_nanoaod(str(path), year, n_events, seed=i)
+            files[year].append(str(path))
+    return files
+
+
+def run_workflow(workflow: str, year: str, files: list, chunksize: int, profile: bool = False) -> dict:
+    """
+    process the synthetic files of a year with the workflow (meant to run in a fresh process)
+
+    if 'profile' is True, the wall time of each processor stage (summed over shifts) is added
+    to the result under 'stages' (without tracing allocations, so the throughput is not biased)
+    """
+    warnings.filterwarnings("ignore")
+    from coffea import processor
+    from coffea.nanoevents import NanoAODSchema
+    from analysis.processors.base import BaseProcessor
+
+    result = {
+        "workflow": workflow,
+        "year": year,
+        "import_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    try:
+        # corrections report (a lot) to stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            out, metrics = processor.run_uproot_job(
+                {DATASETS[get_run(year)]: files},
+                treename="Events",
+                processor_instance=BaseProcessor(
+                    workflow=workflow, year=year, profile=profile, profile_memory=False
+                ),
+                executor=processor.iterative_executor,
+                executor_args={"schema": NanoAODSchema, "savemetrics": True},
+                chunksize=chunksize,
+            )
+            elapsed = time.perf_counter() - start_time
+        result.update(
+            {
+                "status": "ok",
+                "events": int(metrics["entries"]),
+                "time": elapsed,
+                "events_per_s": metrics["entries"] / elapsed,
+            }
+        )
+        if profile:
+            perf = out["metadata"]["perf"]
+            result["stages"] = {
+                stage: sum(record["time"] for record in shifts.values())
+                for stage, shifts in perf["stages"].items()
+            }
+    except Exception as e:
+        # report the innermost error (coffea wraps it in a 'Failed processing file' one)
+        while e.__cause__ is not None:
+            e = e.__cause__
+        result.update({"status": f"{type(e).__name__}: {e}"[:120]})
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run_isolated(workflow: str, year: str, files: list, chunksize: int, profile: bool = False) -> dict:
+    """run a workflow benchmark in a new (spawned) process"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(
+            run_workflow, workflow, year, files, chunksize, profile
+        ).result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workflows", nargs="+", default=get_workflows(), help="workflows to benchmark (default: all)")
+    parser.add_argument("--years", nargs="+", default=["2017", "2022postEE"], help="dataset years")
+    parser.add_argument("--n_events", type=int, default=50_000, help="number of events per synthetic file")
+    parser.add_argument("--n_files", type=int, default=1, help="number of synthetic files per year")
+    parser.add_argument("--chunksize", type=int, default=50_000, help="processor chunk size")
+    parser.add_argument("--workdir", type=str, default=f"{tempfile.gettempdir()}/bsm3g_benchmark", help="directory of the synthetic files and stand-in payloads")
+    parser.add_argument("--reuse", action="store_true", help="reuse the synthetic files of a previous run")
+    parser.add_argument("--output", type=str, help="save the results to this .json file")
+    args = parser.parse_args()
+
+    # the corrections read their payloads relative to the repository
+    os.chdir(REPO_DIR)
+    workdir = Path(args.workdir).resolve()
+    files = prepare_inputs(workdir, args.years, args.n_events, args.n_files, args.reuse)
+    # redirect the POG jsons to the stand-in payloads (inherited by the benchmark processes)
+    os.environ["POG_CORRECTION_PATH"] = str(workdir / "pog")
+
+    results = []
+    for year in args.years:
+        for workflow in args.workflows:
+            result = run_isolated(workflow, year, files[year], args.chunksize)
+            results.append(result)
+            print(
+                f"{workflow:>20} {year:>12}: "
+                + (
+                    f"{result['events_per_s']:10.1f} events/s, {result['peak_rss_mb']:8.1f} MB peak RSS"
+                    if result["status"] == "ok"
+                    else result["status"]
+                ),
+                flush=True,
+            )
+
+    report = pd.DataFrame(results).set_index(["workflow", "year"])
+    columns = ["events", "time", "events_per_s", "import_rss_mb", "peak_rss_mb", "status"]
+    print(report.reindex(columns=columns).to_string(float_format="{:.1f}".format))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
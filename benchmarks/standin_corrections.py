@@ -0,0 +1,276 @@
+"""
+Stand-in correctionlib payloads for the POG jsons read by the processor
+
+The payloads have the POG layout ('<root>/POG/<POG>/<pog year>/<json>'), the correction names and
+the input signatures the corrections modules evaluate, so the processor runs end to end without
+/cvmfs when the POG_CORRECTION_PATH environment variable points to their root. Values are not
+physical: scale factors are small (eta, pt, ...) grids around 1 (so they cost about as much to
+evaluate as the real binned payloads), the jet veto maps veto nothing and the MET phi corrections
+return the uncorrected MET.
+
+Usage:
+    python3 benchmarks/standin_corrections.py --output_dir /tmp/standin_pog --years 2017 2022postEE
+"""
+
+import sys
+import gzip
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from analysis.corrections.utils import POG_JSONS, pog_years
+
+# binning of the real inputs of the stand-in scale factors
+INPUT_EDGES = {
+    "pt": np.geomspace(10.0, 1000.0, 11),
+    "eta": np.linspace(-2.5, 2.5, 11),
+    "abseta": np.linspace(0.0, 2.5, 6),
+    "phi": np.linspace(-np.pi, np.pi, 9),
+    "nTrueInt": np.linspace(0.0, 100.0, 101),
+}
+# published b-tagging working points (https://btv-wiki.docs.cern.ch/ScaleFactors/)
+BTAG_WP_VALUES = {
+    "deepJet": {"L": 0.0532, "M": 0.3040, "T": 0.7476},
+    "particleNet": {"L": 0.047, "M": 0.245, "T": 0.6734},
+}
+PILEUP_CORRECTIONS = {
+    "2016preVFP": "Collisions16_UltraLegacy_goldenJSON",
+    "2016postVFP": "Collisions16_UltraLegacy_goldenJSON",
+    "2017": "Collisions17_UltraLegacy_goldenJSON",
+    "2018": "Collisions18_UltraLegacy_goldenJSON",
+    "2022preEE": "Collisions2022_355100_357900_eraBCD_GoldenJson",
+    "2022postEE": "Collisions2022_359022_362760_eraEFG_GoldenJson",
+    "2023preBPix": "Collisions2023_366403_369802_eraBC_GoldenJson",
+    "2023postBPix": "Collisions2023_369803_370790_eraD_GoldenJson",
+}
+JETVETOMAPS_CORRECTIONS = {
+    "2016preVFP": "Summer19UL16_V1",
+    "2016postVFP": "Summer19UL16_V1",
+    "2017": "Summer19UL17_V1",
+    "2018": "Summer19UL18_V1",
+    "2022preEE": "Summer22_23Sep2023_RunCD_V1",
+    "2022postEE": "Summer22EE_23Sep2023_RunEFG_V1",
+    "2023preBPix": "Summer23Prompt23_RunC_V1",
+    "2023postBPix": "Summer23BPixPrompt23_RunD_V1",
+}
+MUON_CORRECTIONS = [
+    "NUM_TrackerMuons_DEN_genTracks",
+    "NUM_LooseID_DEN_TrackerMuons",
+    "NUM_MediumID_DEN_TrackerMuons",
+    "NUM_TightID_DEN_TrackerMuons",
+    "NUM_LooseRelIso_DEN_LooseID",
+    "NUM_LooseRelIso_DEN_MediumID",
+    "NUM_TightRelIso_DEN_MediumID",
+    "NUM_LooseRelIso_DEN_TightIDandIPCut",
+    "NUM_TightRelIso_DEN_TightIDandIPCut",
+    "NUM_LoosePFIso_DEN_LooseID",
+    "NUM_LoosePFIso_DEN_MediumID",
+    "NUM_LoosePFIso_DEN_TightID",
+    "NUM_TightPFIso_DEN_MediumID",
+    "NUM_TightPFIso_DEN_TightID",
+    "NUM_IsoMu24_or_IsoTkMu24_DEN_CutBasedIdTight_and_PFIsoTight",
+    "NUM_IsoMu27_DEN_CutBasedIdTight_and_PFIsoTight",
+    "NUM_IsoMu24_DEN_CutBasedIdTight_and_PFIsoTight",
+]
+MUON_HIGHPT_CORRECTIONS = [
+    "NUM_GlobalMuons_DEN_TrackerMuonProbes",
+    "NUM_HighPtID_DEN_GlobalMuonProbes",
+    "NUM_probe_LooseRelTkIso_DEN_HighPtProbes",
+    "NUM_probe_TightRelTkIso_DEN_HighPtProbes",
+    "NUM_HLT_DEN_HighPtTightRelIsoProbes",
+]
+
+
+def get_input(name: str) -> dict:
+    """return a correction input from its 'name:type' description"""
+    name, kind = name.split(":")
+    return {"name": name, "type": kind}
+
+
+def correction(name: str, inputs: list, data) -> dict:
+    """
+    build a correction
+
+    Parameters:
+    -----------
+        name:
+            correction name
+        inputs:
+            inputs descriptions ('name:type', type in {real, int, string})
+        data:
+            correction content (node or number)
+    """
+    return {
+        "name": name,
+        "description": "benchmark stand-in",
+        "version": 1,
+        "inputs": [get_input(x) for x in inputs],
+        "output": {"name": "weight", "type": "real"},
+        "data": data,
+    }
+
+
+def scale_factor(name: str, inputs: list, rng: np.random.Generator) -> dict:
+    """
+    build a stand-in scale factor: a grid around 1 over the real inputs with a binning
+    (INPUT_EDGES) and clamped flow. Other inputs (systematics, working points, ...) take any value
+    """
+    binned = [x.split(":")[0] for x in inputs if x.split(":")[0] in INPUT_EDGES]
+    edges = [[float(e) for e in INPUT_EDGES[x]] for x in binned]
+    n_bins = int(np.prod([len(e) - 1 for e in edges]))
+    data = {
+        "nodetype": "multibinning",
+        "inputs": binned,
+        "edges": edges,
+        "content": list(np.round(rng.uniform(0.95, 1.05, n_bins), 4)),
+        "flow": "clamp",
+    }
+    return correction(name, inputs, data)
+
+
+def get_standin_corrections(year: str, seed: int = 0) -> dict:
+    """
+    return the stand-in corrections of each POG json of a year
+
+    Parameters:
+    -----------
+        year:
+            dataset year {2016preVFP, 2016postVFP, 2017, 2018, 2022preEE, 2022postEE, 2023preBPix, 2023postBPix}
+        seed:
+            seed of the scale factors values
+
+    Returns:
+    --------
+        dictionary {json_name: list of corrections}
+    """
+    rng = np.random.default_rng(seed)
+    lepton_inputs = ["abseta:real", "pt:real", "scale_factors:string"]
+    electron_inputs = ["year:string", "ValType:string", "WorkingPoint:string", "eta:real", "pt:real"]
+    if year.startswith("2023"):
+        electron_inputs += ["phi:real"]
+    electron_hlt_inputs = ["year:string", "ValType:string", "Path:string", "eta:real", "pt:real"]
+    tagger = "deepJet" if year.startswith("201") else "particleNet"
+    btag_inputs = ["systematic:string", "working_point:string", "flavor:int", "abseta:real", "pt:real"]
+    met_inputs = ["met_pt:real", "met_phi:real", "npvs:real", "run:real"]
+    return {
+        "muon": [scale_factor(name, lepton_inputs, rng) for name in MUON_CORRECTIONS],
+        "muon_highpt": [
+            scale_factor(name, lepton_inputs, rng) for name in MUON_HIGHPT_CORRECTIONS
+        ],
+        "electron": [
+            scale_factor(name, electron_inputs, rng)
+            for name in ["UL-Electron-ID-SF", "Electron-ID-SF"]
+        ],
+        "electron_hlt": [
+            scale_factor(name, electron_hlt_inputs, rng)
+            for name in ["Electron-HLT-SF", "Electron-HLT-DataEff", "Electron-HLT-McEff"]
+        ],
+        "tau": [
+            scale_factor(name, ["abseta:real", "genmatch:int", "wp:string", "syst:string"], rng)
+            for name in ["DeepTau2017v2p1VSe", "DeepTau2017v2p1VSmu"]
+        ]
+        + [
+            scale_factor(
+                "DeepTau2017v2p1VSjet",
+                ["pt:real", "dm:int", "genmatch:int", "wp:string", "wp_VSe:string", "syst:string", "flag:string"],
+                rng,
+            ),
+            scale_factor(
+                "tau_trigger",
+                ["pt:real", "dm:int", "trigtype:string", "wp:string", "corrtype:string", "syst:string"],
+                rng,
+            ),
+            scale_factor(
+                "tau_energy_scale",
+                ["pt:real", "eta:real", "dm:int", "genmatch:int", "id:string", "syst:string"],
+                rng,
+            ),
+        ],
+        "pileup": [
+            scale_factor(PILEUP_CORRECTIONS[year], ["nTrueInt:real", "weights:string"], rng)
+        ],
+        "btag": [
+            scale_factor(f"{tagger}_{kind}", btag_inputs, rng)
+            for kind in ["comb", "incl", "light"]
+        ]
+        + [
+            correction(
+                f"{tagger}_wp_values",
+                ["working_point:string"],
+                {
+                    "nodetype": "category",
+                    "input": "working_point",
+                    "content": [
+                        {"key": wp, "value": value}
+                        for wp, value in BTAG_WP_VALUES[tagger].items()
+                    ],
+                },
+            )
+        ],
+        "met": [
+            correction(
+                f"{var}_metphicorr_pfmet_{kind}",
+                met_inputs,
+                {
+                    "nodetype": "formula",
+                    "expression": "x",
+                    "parser": "TFormula",
+                    "variables": [f"met_{var}"],
+                },
+            )
+            for var in ["pt", "phi"]
+            for kind in ["mc", "data"]
+        ],
+        "pujetid": [
+            scale_factor("PUJetID_eff", ["eta:real", "pt:real", "systematic:string", "workingpoint:string"], rng)
+        ],
+        "jetvetomaps": [
+            correction(
+                JETVETOMAPS_CORRECTIONS[year],
+                ["type:string", "eta:real", "phi:real"],
+                0.0,
+            )
+        ],
+    }
+
+
+def write_standin_corrections(output_dir: str, years: list, seed: int = 0) -> list:
+    """
+    write the stand-in POG jsons of some years with the POG layout
+
+    Parameters:
+    -----------
+        output_dir:
+            root of the stand-in payloads (to be used as POG_CORRECTION_PATH)
+        years:
+            dataset years
+        seed:
+            seed of the scale factors values
+
+    Returns:
+    --------
+        paths of the written jsons
+    """
+    paths = []
+    for year in years:
+        for json_name, corrections in get_standin_corrections(year, seed).items():
+            pog, fname = POG_JSONS[json_name]
+            path = Path(output_dir) / "POG" / pog / pog_years[year] / fname
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with gzip.open(path, "wt") as f:
+                json.dump({"schema_version": 2, "corrections": corrections}, f)
+            paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--output_dir", type=str, required=True, help="root of the stand-in payloads")
+    parser.add_argument("--years", nargs="+", default=list(pog_years), help="dataset years")
+    args = parser.parse_args()
+    for path in write_standin_corrections(args.output_dir, args.years):
+        print(path)
+    print(f"export POG_CORRECTION_PATH={Path(args.output_dir).resolve()}")
@@ -0,0 +1,386 @@
+"""
+Synthetic NanoAOD-like (MC) ROOT files for offline benchmarks of the processor
+
+Objects have NanoAOD-like multiplicities and kinematics, and the branches the workflows read
+(NanoAODv9 names for Run2 years, NanoAODv12 names for Run3 years): Muon, Electron, Tau, Jet, GenJet,
+GenPart (top quarks and the generated muons), TrigObj (trigger objects of the leptons), MET/PuppiMET,
+LHE/LHEPdfWeight/LHEScaleWeight, PSWeight, Pileup, PV, L1PreFiringWeight and the HLT/Flag bits of the
+year. Values are random: they exercise the processor code paths, not any physics
+
+Usage:
+    python3 benchmarks/synthetic_nanoaod.py --output_dir /tmp/synthetic --year 2017 --n_events 50000 --n_files 2
+"""
+
+import sys
+import json
+import yaml
+import argparse
+import numpy as np
+import awkward as ak
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+# mean number of objects per event
+MULTIPLICITIES = {
+    "Muon": 1.2,
+    "Electron": 1.0,
+    "Tau": 1.5,
+    "Jet": 6.0,
+    "GenJet": 6.0,
+}
+# number of weights per event
+N_WEIGHTS = {"LHEPdfWeight": 103, "LHEScaleWeight": 9, "PSWeight": 4}
+# trigger object bits of the lepton trigger legs (set to all the legs matched in analysis/selections/trigger.py)
+TRIGOBJ_FILTERBITS = {13: 1 | 8 | 1024 | 2048, 11: 2 | 8192}
+
+
+def get_run(year: str) -> str:
+    return "2" if year.startswith("201") else "3"
+
+
+def get_hlt_paths(year: str) -> list:
+    """return the HLT paths of the trigger flags of a year"""
+    with open(Path(__file__).resolve().parent.parent / "analysis" / "selections" / "trigger_flags.yaml") as f:
+        trigger_flags = yaml.safe_load(f)
+    year_key = int(year[:4])
+    return sorted({path for paths in trigger_flags[year_key].values() for path in paths})
+
+
+def get_met_filters(year: str) -> list:
+    with open(Path(__file__).resolve().parent.parent / "analysis" / "data" / "metfilters.json") as f:
+        metfilters = json.load(f)[year]
+    return sorted(set(metfilters["mc"]) | set(metfilters["data"]))
+
+
+class SyntheticNanoAOD:
+    """
+    Generator of synthetic NanoAOD-like MC events
+
+    Parameters:
+    -----------
+        year:
+            dataset year {2016preVFP, 2016postVFP, 2017, 2018, 2022preEE, 2022postEE, 2023preBPix, 2023postBPix}
+        seed:
+            random generator seed
+    """
+
+    def __init__(self, year: str, seed: int = 0):
+        self.year = year
+        self.run = get_run(year)
+        self.rng = np.random.default_rng(seed)
+
+    def counts(self, collection: str, n_events: int) -> np.ndarray:
+        return self.rng.poisson(MULTIPLICITIES[collection], n_events).astype(np.int32)
+
+    def kinematics(self, n: int, pt_min: float, pt_scale: float, eta_max: float) -> dict:
+        return {
+            "pt": (pt_min + self.rng.exponential(pt_scale, n)).astype(np.float32),
+            "eta": self.rng.uniform(-eta_max, eta_max, n).astype(np.float32),
+            "phi": self.rng.uniform(-np.pi, np.pi, n).astype(np.float32),
+        }
+
+    def flags(self, n: int, p: float) -> np.ndarray:
+        return self.rng.random(n) < p
+
+    def choice(self, values: list, n: int, p: list = None, dtype=np.int32) -> np.ndarray:
+        return self.rng.choice(values, n, p=p).astype(dtype)
+
+    def muons(self, counts: np.ndarray) -> dict:
+        n = counts.sum()
+        muons = self.kinematics(n, 10.0, 30.0, 2.4)
+        muons["mass"] = np.full(n, 0.10566, dtype=np.float32)
+        muons["charge"] = self.choice([-1, 1], n)
+        muons["looseId"] = self.flags(n, 0.98)
+        muons["mediumId"] = muons["looseId"] & self.flags(n, 0.95)
+        muons["tightId"] = muons["mediumId"] & self.flags(n, 0.95)
+        muons["highPtId"] = self.choice([0, 1, 2], n, p=[0.1, 0.1, 0.8], dtype=np.uint8)
+        muons["pfRelIso04_all"] = self.rng.exponential(0.08, n).astype(np.float32)
+        muons["pfRelIso03_all"] = (0.8 * muons["pfRelIso04_all"]).astype(np.float32)
+        muons["tunepRelPt"] = self.rng.normal(1.0, 0.02, n).astype(np.float32)
+        muons["nTrackerLayers"] = self.choice(np.arange(8, 18), n)
+        muons["dxy"] = self.rng.normal(0, 0.005, n).astype(np.float32)
+        muons["dz"] = self.rng.normal(0, 0.01, n).astype(np.float32)
+        muons["genPartFlav"] = self.choice([0, 1, 5, 15], n, p=[0.1, 0.8, 0.05, 0.05], dtype=np.uint8)
+        muons["jetIdx"] = np.full(n, -1, dtype=np.int32)
+        return muons
+
+    def electrons(self, counts: np.ndarray) -> dict:
+        n = counts.sum()
+        electrons = self.kinematics(n, 10.0, 30.0, 2.5)
+        electrons["mass"] = np.full(n, 0.000511, dtype=np.float32)
+        electrons["charge"] = self.choice([-1, 1], n)
+        electrons["deltaEtaSC"] = self.rng.normal(0, 0.01, n).astype(np.float32)
+        electrons["cutBased"] = self.choice([0, 1, 2, 3, 4], n, p=[0.1, 0.1, 0.1, 0.2, 0.5])
+        mva_prefix = "mvaFall17V2Iso" if self.run == "2" else "mvaIso"
+        electrons[f"{mva_prefix}_WP90"] = self.flags(n, 0.9)
+        electrons[f"{mva_prefix}_WP80"] = electrons[f"{mva_prefix}_WP90"] & self.flags(n, 0.9)
+        if self.run == "2":
+            electrons[f"{mva_prefix}_WPL"] = electrons[f"{mva_prefix}_WP90"] | self.flags(n, 0.5)
+        electrons["pfRelIso03_all"] = self.rng.exponential(0.08, n).astype(np.float32)
+        electrons["r9"] = self.rng.uniform(0.5, 1.0, n).astype(np.float32)
+        electrons["seedGain"] = self.choice([1, 6, 12], n, p=[0.05, 0.05, 0.9], dtype=np.uint8)
+        electrons["dxy"] = self.rng.normal(0, 0.005, n).astype(np.float32)
+        electrons["dz"] = self.rng.normal(0, 0.01, n).astype(np.float32)
+        electrons["genPartFlav"] = self.choice([0, 1, 15], n, p=[0.1, 0.85, 0.05], dtype=np.uint8)
+        electrons["jetIdx"] = np.full(n, -1, dtype=np.int32)
+        electrons["photonIdx"] = np.full(n, -1, dtype=np.int32)
+        return electrons
+
+    def taus(self, counts: np.ndarray) -> dict:
+        n = counts.sum()
+        taus = self.kinematics(n, 20.0, 25.0, 2.3)
+        taus["mass"] = self.rng.uniform(0.14, 1.7, n).astype(np.float32)
+        taus["charge"] = self.choice([-1, 1], n)
+        taus["dz"] = self.rng.normal(0, 0.05, n).astype(np.float32)
+        taus["decayMode"] = self.choice([0, 1, 2, 5, 6, 10, 11], n, p=[0.3, 0.3, 0.1, 0.05, 0.05, 0.15, 0.05])
+        # DeepTau bitmasks: all the working points looser than the passed one are set
+        for name, n_wps in [("VSjet", 8), ("VSe", 8), ("VSmu", 4)]:
+            passed = self.rng.integers(0, n_wps + 1, n)
+            taus[f"idDeepTau2017v2p1{name}"] = ((1 << passed) - 1).astype(np.uint8)
+        taus["genPartFlav"] = self.choice([0, 1, 2, 3, 4, 5], n, p=[0.5, 0.05, 0.05, 0.05, 0.05, 0.3], dtype=np.uint8)
+        taus["jetIdx"] = np.full(n, -1, dtype=np.int32)
+        return taus
+
+    def jets(self, counts: np.ndarray, genjet_counts: np.ndarray) -> dict:
+        n = counts.sum()
+        jets = self.kinematics(n, 15.0, 40.0, 4.7)
+        jets["mass"] = (jets["pt"] * self.rng.uniform(0.05, 0.2, n)).astype(np.float32)
+        jets["rawFactor"] = self.rng.uniform(0.0, 0.3, n).astype(np.float32)
+        jets["area"] = self.rng.normal(0.5, 0.03, n).astype(np.float32)
+        jets["jetId"] = self.choice([0, 2, 6], n, p=[0.05, 0.1, 0.85])
+        jets["puId"] = self.choice([0, 1, 3, 4, 6, 7], n, p=[0.1, 0.05, 0.05, 0.05, 0.05, 0.7])
+        jets["hadronFlavour"] = self.choice([0, 4, 5], n, p=[0.7, 0.1, 0.2])
+        jets["partonFlavour"] = jets["hadronFlavour"].copy()
+        btag = np.where(
+            jets["hadronFlavour"] == 5,
+            self.rng.beta(2.0, 0.5, n),
+            self.rng.beta(0.3, 3.0, n),
+        ).astype(np.float32)
+        jets["btagDeepFlavB"] = btag
+        if self.run == "3":
+            jets["btagPNetB"] = btag
+        for name, (low, high) in {
+            "neEmEF": (0.0, 0.5),
+            "chEmEF": (0.0, 0.5),
+            "neHEF": (0.0, 0.5),
+            "chHEF": (0.1, 0.9),
+            "muEF": (0.0, 0.1),
+        }.items():
+            jets[name] = self.rng.uniform(low, high, n).astype(np.float32)
+        jets["chMultiplicity"] = self.choice(np.arange(1, 30), n, dtype=np.uint8)
+        jets["neMultiplicity"] = self.choice(np.arange(0, 20), n, dtype=np.uint8)
+        # matched generated jet (if any) of each jet
+        local = np.arange(n) - np.repeat(np.cumsum(counts) - counts, counts)
+        matched = (local < np.repeat(genjet_counts, counts)) & self.flags(n, 0.9)
+        jets["genJetIdx"] = np.where(matched, local, -1).astype(np.int32)
+        for name in ["muonIdx1", "muonIdx2", "electronIdx1", "electronIdx2"]:
+            jets[name] = np.full(n, -1, dtype=np.int32)
+        return jets
+
+    def genjets(self, counts: np.ndarray) -> dict:
+        n = counts.sum()
+        genjets = self.kinematics(n, 15.0, 40.0, 4.7)
+        genjets["mass"] = (genjets["pt"] * self.rng.uniform(0.05, 0.2, n)).astype(np.float32)
+        genjets["hadronFlavour"] = self.choice([0, 4, 5], n, p=[0.7, 0.1, 0.2], dtype=np.uint8)
+        genjets["partonFlavour"] = genjets["hadronFlavour"].astype(np.int32)
+        return genjets
+
+    def genparticles(self, muons: dict, muon_counts: np.ndarray) -> tuple:
+        """
+        build the generated particles (a top quark pair and the generated muons) of each event
+
+        Returns:
+        --------
+            generated particles dictionary, their counts and the generated particle index of each muon
+        """
+        n_events = len(muon_counts)
+        muon_events = np.repeat(np.arange(n_events), muon_counts)
+        # 90% of the muons have a generated muon
+        matched = self.flags(len(muon_events), 0.9)
+        gen_muon_counts = np.bincount(muon_events[matched], minlength=n_events)
+        counts = (2 + gen_muon_counts).astype(np.int32)
+        starts = np.cumsum(counts) - counts
+        # index (within the event) of the generated muon of each matched muon
+        gen_muon_starts = np.cumsum(gen_muon_counts) - gen_muon_counts
+        local_idx = 2 + np.arange(matched.sum()) - gen_muon_starts[muon_events[matched]]
+        positions = starts[muon_events[matched]] + local_idx
+
+        n = counts.sum()
+        genparts = self.kinematics(n, 0.0, 100.0, 4.0)
+        genparts["mass"] = np.full(n, 172.5, dtype=np.float32)
+        genparts["pdgId"] = np.empty(n, dtype=np.int32)
+        genparts["pdgId"][starts] = 6
+        genparts["pdgId"][starts + 1] = -6
+        genparts["status"] = np.full(n, 62, dtype=np.int32)
+        # generated muons: reconstructed muons smeared back
+        genparts["pdgId"][positions] = -13 * muons["charge"][matched]
+        genparts["pt"][positions] = muons["pt"][matched] * self.rng.normal(1.0, 0.01, len(positions))
+        genparts["eta"][positions] = muons["eta"][matched]
+        genparts["phi"][positions] = muons["phi"][matched]
+        genparts["mass"][positions] = muons["mass"][matched]
+        genparts["status"][positions] = 1
+        # isPrompt (bit 0) and isLastCopy (bit 13)
+        genparts["statusFlags"] = np.full(n, (1 << 0) | (1 << 13), dtype=np.int32)
+        genparts["genPartIdxMother"] = np.full(n, -1, dtype=np.int32)
+
+        genpart_idx = np.full(len(muon_events), -1, dtype=np.int32)
+        genpart_idx[matched] = local_idx
+        return genparts, counts, genpart_idx
+
+    def trigger_objects(self, leptons: list) -> tuple:
+        """build the trigger objects of the leptons ([(pdgId, kinematics, counts)])"""
+        objects, counts = [], []
+        for pdg_id, kinematics, lepton_counts in leptons:
+            n = lepton_counts.sum()
+            objects.append(
+                {
+                    "pt": kinematics["pt"] * self.rng.normal(1.0, 0.02, n).astype(np.float32),
+                    "eta": kinematics["eta"],
+                    "phi": kinematics["phi"],
+                    "id": np.full(n, pdg_id, dtype=np.int32),
+                    "filterBits": np.where(self.flags(n, 0.9), TRIGOBJ_FILTERBITS[pdg_id], 0).astype(np.int32),
+                }
+            )
+            counts.append(lepton_counts)
+        # interleave the objects of each event
+        counts = np.stack(counts, axis=1)
+        event_counts = counts.sum(axis=1).astype(np.int32)
+        order = np.argsort(
+            np.concatenate(
+                [np.repeat(np.arange(len(c)), c) for c in counts.T]
+            ),
+            kind="stable",
+        )
+        trigobjs = {
+            name: np.concatenate([o[name] for o in objects])[order]
+            for name in objects[0]
+        }
+        return trigobjs, event_counts
+
+    def generate(self, n_events: int) -> dict:
+        """return the branches of 'n_events' events, ready to be written with uproot"""
+        rng = self.rng
+        counts = {name: self.counts(name, n_events) for name in MULTIPLICITIES}
+        muons = self.muons(counts["Muon"])
+        electrons = self.electrons(counts["Electron"])
+        taus = self.taus(counts["Tau"])
+        jets = self.jets(counts["Jet"], counts["GenJet"])
+        genjets = self.genjets(counts["GenJet"])
+        genparts, genpart_counts, muons["genPartIdx"] = self.genparticles(muons, counts["Muon"])
+        electrons["genPartIdx"] = np.full(counts["Electron"].sum(), -1, dtype=np.int32)
+        taus["genPartIdx"] = np.full(counts["Tau"].sum(), -1, dtype=np.int32)
+        trigobjs, trigobj_counts = self.trigger_objects(
+            [(13, muons, counts["Muon"]), (11, electrons, counts["Electron"])]
+        )
+
+        def jagged(fields: dict, counts: np.ndarray) -> ak.Array:
+            return ak.zip({name: ak.unflatten(values, counts) for name, values in fields.items()})
+
+        branches = {
+            "Muon": jagged(muons, counts["Muon"]),
+            "Electron": jagged(electrons, counts["Electron"]),
+            "Tau": jagged(taus, counts["Tau"]),
+            "Jet": jagged(jets, counts["Jet"]),
+            "GenJet": jagged(genjets, counts["GenJet"]),
+            "GenPart": jagged(genparts, genpart_counts),
+            "TrigObj": jagged(trigobjs, trigobj_counts),
+        }
+        for name, n_weights in N_WEIGHTS.items():
+            branches[name] = ak.unflatten(
+                rng.normal(1.0, 0.05, n_events * n_weights).astype(np.float32),
+                np.full(n_events, n_weights),
+            )
+        met = {
+            "pt": rng.exponential(40.0, n_events).astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, n_events).astype(np.float32),
+            "sumEt": rng.normal(1000.0, 200.0, n_events).astype(np.float32),
+            "MetUnclustEnUpDeltaX": rng.normal(0.0, 2.0, n_events).astype(np.float32),
+            "MetUnclustEnUpDeltaY": rng.normal(0.0, 2.0, n_events).astype(np.float32),
+        }
+        for collection in ["MET", "PuppiMET"]:
+            for name, values in met.items():
+                branches[f"{collection}_{name}"] = values
+        branches.update(
+            {
+                "run": np.ones(n_events, dtype=np.uint32),
+                "luminosityBlock": rng.integers(1, 1000, n_events).astype(np.uint32),
+                "event": np.arange(n_events, dtype=np.uint64),
+                "genWeight": rng.choice([-1.0, 1.0], n_events, p=[0.1, 0.9]).astype(np.float32),
+                "LHE_HT": rng.exponential(300.0, n_events).astype(np.float32),
+                "LHE_Njets": rng.integers(0, 5, n_events).astype(np.uint8),
+                "Pileup_nTrueInt": rng.gamma(8.0, 4.0, n_events).astype(np.float32),
+                "Pileup_nPU": rng.poisson(32, n_events).astype(np.int32),
+                "PV_npvs": rng.poisson(32, n_events).astype(np.int32),
+                "PV_npvsGood": np.maximum(rng.poisson(30, n_events), 1).astype(np.int32),
+                "L1PreFiringWeight_Nom": rng.uniform(0.97, 1.0, n_events).astype(np.float32),
+                "L1PreFiringWeight_Up": np.ones(n_events, dtype=np.float32),
+                "L1PreFiringWeight_Dn": rng.uniform(0.95, 0.97, n_events).astype(np.float32),
+            }
+        )
+        rho = rng.gamma(4.0, 5.0, n_events).astype(np.float32)
+        branches["fixedGridRhoFastjetAll" if self.run == "2" else "Rho_fixedGridRhoFastjetAll"] = rho
+        for path in get_hlt_paths(self.year):
+            branches[f"HLT_{path}"] = self.flags(n_events, 0.3)
+        for metfilter in get_met_filters(self.year):
+            branches[f"Flag_{metfilter}"] = self.flags(n_events, 0.99)
+        return branches
+
+
+def write_nanoaod(path: str, year: str, n_events: int, seed: int = 0, chunksize: int = 50_000) -> str:
+    """
+    write a synthetic NanoAOD-like file with an 'Events' tree and a 'Runs' tree with the
+    generator weight sums of the events
+
+    Parameters:
+    -----------
+        path:
+            output .root file
+        year:
+            dataset year
+        n_events:
+            number of events
+        seed:
+            random generator seed
+        chunksize:
+            number of events generated (and written as a TBasket) at once
+    """
+    import uproot
+
+    generator = SyntheticNanoAOD(year, seed)
+    sumw, sumw2 = 0.0, 0.0
+    with uproot.recreate(path) as f:
+        for start in range(0, n_events, chunksize):
+            branches = generator.generate(min(chunksize, n_events - start))
+            sumw += float(np.sum(branches["genWeight"], dtype=np.float64))
+            sumw2 += float(np.sum(branches["genWeight"].astype(np.float64) ** 2))
+            if start == 0:
+                f["Events"] = branches
+            else:
+                f["Events"].extend(branches)
+        f["Runs"] = {
+            "run": np.ones(1, dtype=np.uint32),
+            "genEventCount": np.array([n_events], dtype=np.int64),
+            "genEventSumw": np.array([sumw]),
+            "genEventSumw2": np.array([sumw2]),
+        }
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--output_dir", type=str, required=True, help="output directory")
+    parser.add_argument("--year", type=str, default="2017", help="dataset year")
+    parser.add_argument("--n_events", type=int, default=50_000, help="number of events per file")
+    parser.add_argument("--n_files", type=int, default=1, help="number of files")
+    parser.add_argument("--seed", type=int, default=0, help="random generator seed")
+    args = parser.parse_args()
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    for i in range(args.n_files):
+        path = write_nanoaod(
+            f"{args.output_dir}/nano_{args.year}_{i}.root",
+            args.year,
+            args.n_events,
+            seed=args.seed + i,
+        )
+        print(path)
@@ -0,0 +1,319 @@
+"""
+Track the processor throughput across commits and flag performance regressions
+
+A fixed set of workflows is benchmarked (benchmarks/bench_processor.py) on pinned synthetic
+inputs (fixed seeds and number of events). The events/s, peak RSS and per-stage wall times are
+stored in a JSON history keyed by git commit and compared with a baseline entry (by default, the
+latest clean commit benchmarked with the same inputs): metrics worse than the tolerance are reported
+as warnings, or make the script exit with status 1 if --fail is set. A text (or HTML) trend report
+of the history can be written with --report
+
+Usage:
+    python3 benchmarks/track_throughput.py --tolerance 0.1 --fail --report throughput_trend.html
+    python3 benchmarks/track_throughput.py --report_only --report throughput_trend.txt
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import pandas as pd
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.bench_processor import REPO_DIR, prepare_inputs, run_isolated
+
+# workflows and inputs benchmarked at every commit (changing them starts a new baseline)
+PINNED_WORKFLOWS = ["2b1mu", "ztomumu", "qcd_ele"]
+PINNED_INPUTS = {"years": ["2017", "2022postEE"], "n_events": 20_000, "n_files": 1, "chunksize": 20_000}
+# benchmark metrics and whether larger values are better
+METRICS = {"events_per_s": True, "peak_rss_mb": False}
+
+
+def get_git_state() -> dict:
+    """return the commit, date, subject and dirty state of the repository"""
+
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    commit, date, subject = git("log", "-1", "--format=%H%n%cI%n%s").split("\n", 2)
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    return {"commit": commit, "date": date, "subject": subject, "dirty": dirty}
+
+
+def get_inputs_digest(files: dict) -> str:
+    """sha256 of the synthetic files (entries are only compared if they ran on the same inputs)"""
+    digest = hashlib.sha256()
+    for year in sorted(files):
+        for fname in files[year]:
+            with open(fname, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def load_history(path: str) -> dict:
+    if not Path(path).exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_history(history: dict, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(history, f, indent=2)
+
+
+def get_history_key(git_state: dict) -> str:
+    """history key of a commit (runs on uncommitted changes do not overwrite the commit entry)"""
+    return git_state["commit"] + ("-dirty" if git_state["dirty"] else "")
+
+
+def benchmark(workflows: list, files: dict, chunksize: int, repeat: int = 1) -> dict:
+    """
+    benchmark each (workflow, year) in a fresh process
+
+    Parameters:
+    -----------
+        workflows:
+            workflows to benchmark
+        files:
+            dictionary {year: list of synthetic files}
+        chunksize:
+            processor chunk size
+        repeat:
+            number of runs per benchmark (the fastest one is kept to reduce the noise)
+
+    Returns:
+    --------
+        dictionary {'workflow/year': result}
+    """
+    results = {}
+    for year, year_files in files.items():
+        for workflow in workflows:
+            runs = [
+                run_isolated(workflow, year, year_files, chunksize, profile=True)
+                for _ in range(repeat)
+            ]
+            ok_runs = [r for r in runs if r["status"] == "ok"]
+            result = max(ok_runs, key=lambda r: r["events_per_s"]) if ok_runs else runs[0]
+            results[f"{workflow}/{year}"] = result
+            print(
+                f"{workflow:>20} {year:>12}: "
+                + (
+                    f"{result['events_per_s']:10.1f} events/s, {result['peak_rss_mb']:8.1f} MB peak RSS"
+                    if result["status"] == "ok"
+                    else result["status"]
+                ),
+                flush=True,
+            )
+    return results
+
+
+def get_baseline(history: dict, entry: dict, key: str, baseline: str = None) -> tuple:
+    """
+    return the (key, entry) of the history to compare an entry with: the given commit (prefix) or
+    the latest clean commit benchmarked on the same inputs. (None, None) if there is none
+    """
+    if baseline is not None:
+        matches = [k for k in history if k.startswith(baseline)]
+        if not matches:
+            raise ValueError(f"Please specify a benchmarked baseline commit (got {baseline})")
+        return matches[0], history[matches[0]]
+    candidates = [
+        (k, e)
+        for k, e in history.items()
+        if k != key and not e["dirty"] and e["inputs"] == entry["inputs"]
+    ]
+    if not candidates:
+        return None, None
+    return max(candidates, key=lambda item: item[1]["date"])
+
+
+def find_regressions(
+    results: dict, baseline_results: dict, tolerance: float, min_stage_time: float = 0.05
+) -> list:
+    """
+    compare benchmark results with those of a baseline
+
+    Parameters:
+    -----------
+        results:
+            dictionary {'workflow/year': result} of the current commit
+        baseline_results:
+            dictionary {'workflow/year': result} of the baseline commit
+        tolerance:
+            allowed relative change of each metric before it is considered a regression
+        min_stage_time:
+            stages faster than this (in the baseline, in seconds) are not compared (noise)
+
+    Returns:
+    --------
+        list of regression messages
+    """
+    regressions = []
+    for name, result in results.items():
+        ref = baseline_results.get(name)
+        if ref is None or ref["status"] != "ok":
+            continue
+        if result["status"] != "ok":
+            regressions.append(f"{name}: failed ({result['status']})")
+            continue
+        for metric, larger_is_better in METRICS.items():
+            change = result[metric] / ref[metric] - 1
+            if (-change if larger_is_better else change) > tolerance:
+                regressions.append(
+                    f"{name}: {metric} {ref[metric]:.1f} -> {result[metric]:.1f} ({100 * change:+.1f}%)"
+                )
+        for stage, time in result.get("stages", {}).items():
+            ref_time = ref.get("stages", {}).get(stage)
+            if ref_time is None or ref_time < min_stage_time:
+                continue
+            change = time / ref_time - 1
+            if change > tolerance:
+                regressions.append(
+                    f"{name}: stage '{stage}' {ref_time:.3f}s -> {time:.3f}s ({100 * change:+.1f}%)"
+                )
+    return regressions
+
+
+def get_trend(history: dict, metric: str) -> pd.DataFrame:
+    """
+    return the trend of a metric across the history
+
+    Parameters:
+    -----------
+        history:
+            benchmark history {key: entry}
+        metric:
+            a benchmark metric (events_per_s, peak_rss_mb) or 'stage:<name>' for a stage wall time
+
+    Returns:
+    --------
+        DataFrame with one row per history entry (sorted by commit date) and one column per benchmark
+    """
+    rows = {}
+    for key, entry in sorted(history.items(), key=lambda item: item[1]["date"]):
+        label = f"{entry['date'][:10]} {key[:10]}{'*' if entry['dirty'] else ''}"
+        row = {}
+        for name, result in entry["results"].items():
+            if result["status"] != "ok":
+                continue
+            if metric.startswith("stage:"):
+                row[name] = result.get("stages", {}).get(metric[len("stage:"):])
+            else:
+                row[name] = result[metric]
+        rows[label] = row
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def get_stages(history: dict, n: int = 5) -> list:
+    """return the 'n' slowest stages (summed over the benchmarks) of the latest history entry"""
+    latest = max(history.values(), key=lambda entry: entry["date"])
+    times = {}
+    for result in latest["results"].values():
+        for stage, time in result.get("stages", {}).items():
+            times[stage] = times.get(stage, 0) + time
+    return sorted(times, key=times.get, reverse=True)[:n]
+
+
+def write_report(history: dict, path: str) -> None:
+    """write the trend of the metrics (and of the slowest stages) as a text or .html report"""
+    tables = {
+        "events/s": get_trend(history, "events_per_s"),
+        "peak RSS [MB]": get_trend(history, "peak_rss_mb"),
+    }
+    for stage in get_stages(history):
+        tables[f"stage '{stage}' wall time [s]"] = get_trend(history, f"stage:{stage}")
+    if path.endswith(".html"):
+        body = "\n".join(
+            f"<h2>{title}</h2>\n{table.to_html(float_format='{:.3g}'.format, na_rep='-')}"
+            for title, table in tables.items()
+        )
+        content = (
+            "<html><head><title>Processor throughput trend</title></head><body>\n"
+            f"<h1>Processor throughput trend</h1>\n{body}\n</body></html>\n"
+        )
+    else:
+        content = "\n\n".join(
+            f"{title}\n{table.to_string(float_format='{:.3g}'.format, na_rep='-')}"
+            for title, table in tables.items()
+        )
+    with open(path, "w") as f:
+        f.write(content)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workflows", nargs="+", default=PINNED_WORKFLOWS, help="workflows to benchmark")
+    parser.add_argument("--years", nargs="+", default=PINNED_INPUTS["years"], help="dataset years")
+    parser.add_argument("--n_events", type=int, default=PINNED_INPUTS["n_events"], help="number of events per synthetic file")
+    parser.add_argument("--n_files", type=int, default=PINNED_INPUTS["n_files"], help="number of synthetic files per year")
+    parser.add_argument("--chunksize", type=int, default=PINNED_INPUTS["chunksize"], help="processor chunk size")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs per benchmark (the fastest one is kept)")
+    parser.add_argument("--workdir", type=str, default=f"{tempfile.gettempdir()}/bsm3g_benchmark", help="directory of the synthetic files and stand-in payloads")
+    parser.add_argument("--history", type=str, default=str(REPO_DIR / "benchmarks" / "throughput_history.json"), help="JSON history of the benchmarks")
+    parser.add_argument("--baseline", type=str, help="commit (prefix) to compare with (default: latest clean commit with the same inputs)")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative change of a metric")
+    parser.add_argument("--min_stage_time", type=float, default=0.05, help="stages faster than this (in seconds) are not compared")
+    parser.add_argument("--fail", action="store_true", help="exit with status 1 if a regression is found")
+    parser.add_argument("--report", type=str, help="write the trend report to this .txt or .html file")
+    parser.add_argument("--report_only", action="store_true", help="only write the trend report of the history")
+    args = parser.parse_args()
+
+    history_path = Path(args.history).resolve()
+    history = load_history(history_path)
+    regressions = []
+    if not args.report_only:
+        # the corrections read their payloads relative to the repository
+        os.chdir(REPO_DIR)
+        workdir = Path(args.workdir).resolve()
+        # synthetic files are deterministic (fixed seeds): reuse them between commits
+        files = prepare_inputs(workdir, args.years, args.n_events, args.n_files, reuse=True)
+        os.environ["POG_CORRECTION_PATH"] = str(workdir / "pog")
+
+        git_state = get_git_state()
+        key = get_history_key(git_state)
+        entry = {
+            **git_state,
+            "inputs": {
+                "workflows": args.workflows,
+                "years": args.years,
+                "n_events": args.n_events,
+                "n_files": args.n_files,
+                "chunksize": args.chunksize,
+                "digest": get_inputs_digest(files),
+            },
+            "results": benchmark(args.workflows, files, args.chunksize, args.repeat),
+        }
+        history[key] = entry
+        save_history(history, history_path)
+        print(f"benchmark of {key[:12]} saved to {history_path}")
+
+        baseline_key, baseline = get_baseline(history, entry, key, args.baseline)
+        if baseline is None:
+            print("no baseline to compare with")
+        else:
+            regressions = find_regressions(
+                entry["results"], baseline["results"], args.tolerance, args.min_stage_time
+            )
+            print(
+                f"{len(regressions)} regression(s) with respect to {baseline_key[:12]} "
+                f"({baseline['subject']}) with a {100 * args.tolerance:.0f}% tolerance"
+            )
+            for regression in regressions:
+                print(f"  WARNING: {regression}")
+
+    if args.report:
+        if not history:
+            raise ValueError(f"Please specify a non-empty benchmark history (got {history_path})")
+        write_report(history, args.report)
+        print(f"trend report saved to {args.report}")
+    if args.fail and regressions:
+        sys.exit(1)
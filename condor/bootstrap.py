@@ -0,0 +1,85 @@
+"""
+Entry point of a condor job
+
+Reads the job arguments (arguments.json) and the job partition (partitions.json) from the job
+working directory, writes the partition fileset of the job and runs submit.py in this same
+interpreter (instead of one python3 call per parameter in the shell script)
+
+Usage:
+    python3 condor/bootstrap.py <jobid> <basedir>
+"""
+
+import os
+import sys
+import json
+import runpy
+import argparse
+from pathlib import Path
+
+# job arguments passed to submit.py as '--<key> <value>'
+ARGUMENTS = ["workflow", "year", "output_path", "output_format"]
+
+
+def get_submit_args(workdir: Path, jobid: str) -> list:
+    """
+    build the submit.py command-line arguments of a job
+
+    Parameters:
+    -----------
+        workdir:
+            job working directory with the arguments.json and partitions.json files
+        jobid:
+            job number (key of the job partition in partitions.json)
+
+    Returns:
+    --------
+        list of submit.py arguments
+    """
+    with open(workdir / "arguments.json") as f:
+        arguments = json.load(f)
+    # keep only the subset of the dataset assigned to this job
+    with open(workdir / "partitions.json") as f:
+        partition = json.load(f)[jobid]
+    partition_json = workdir / "partition_fileset.json"
+    with open(partition_json, "w") as f:
+        json.dump(partition, f, indent=4)
+
+    submit_args = []
+    for key in ARGUMENTS:
+        submit_args += [f"--{key}", str(arguments[key])]
+    # add the JOBID suffix to the dataset name to uniquely identify the output
+    submit_args += ["--dataset", f"{arguments['dataset']}_{jobid}"]
+    if arguments.get("profile", False):
+        submit_args += ["--profile"]
+    # stage the inputs and upload the outputs through the job scratch (the working directory)
+    if arguments.get("prefetch", 0) > 0:
+        submit_args += ["--prefetch", str(arguments["prefetch"])]
+    if arguments.get("staged_upload", False):
+        submit_args += ["--staged_upload"]
+    # executor settings tuned per dataset (see analysis/utils/resource_tuner.py)
+    for key in ["workers", "chunksize"]:
+        if key in arguments:
+            submit_args += [f"--{key}", str(arguments[key])]
+    if arguments.get("sample_fraction", 1.0) < 1:
+        submit_args += ["--sample_fraction", str(arguments["sample_fraction"])]
+    if arguments.get("merge", 0) > 0:
+        submit_args += ["--merge", str(arguments["merge"])]
+    submit_args += ["--scratch_dir", str(workdir)]
+    submit_args += ["--partition_json", str(partition_json)]
+    return submit_args
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("jobid", type=str, help="job number")
+    parser.add_argument("basedir", type=str, help="repository directory")
+    args = parser.parse_args()
+
+    submit_args = get_submit_args(Path.cwd(), args.jobid)
+    print(" ".join(submit_args), flush=True)
+    # run submit.py from the repository directory, as 'python3 submit.py <args>' would
+    basedir = Path(args.basedir).resolve()
+    sys.path.insert(0, str(basedir))
+    sys.argv = [str(basedir / "submit.py"), *submit_args]
+    os.chdir(basedir)
+    runpy.run_path(str(basedir / "submit.py"), run_name="__main__")
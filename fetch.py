@@ -49,25 +49,85 @@ if __name__ == "__main__":
         action="store_true",
         help="Skip white/black sites initialization",
     )
+    parser.add_argument(
+        "--replicas_strategy",
+        type=str,
+        default="score",
+        choices=["score", "round-robin"],
+        help="pick each file replica by site health score (from the job ledgers telemetry) or round-robin over the sites",
+    )
+    parser.add_argument(
+        "--catalogue",
+        type=str,
+        help="(Optional) local json catalogue of the datasets files, used instead of rucio and DAS (e.g. for offline tests)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="number of concurrent dataset queries per backend",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        default=24,
+        help="lifetime (in hours) of the cached dataset files",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="ignore the cached dataset files",
+    )
+    parser.add_argument(
+        "--index_runs",
+        action="store_true",
+        help="read the generator weight sums of the new files into the fileset metadata index",
+    )
     args = parser.parse_args()
 
-    try:
-        subprocess.run("voms-proxy-info -exists", shell=True, check=True)
-    except subprocess.CalledProcessError:
-        raise Exception(
-            "VOMS proxy expired or non-existing: please run 'voms-proxy-init --voms cms'"
-        )
+    if args.catalogue is None:
+        try:
+            subprocess.run("voms-proxy-info -exists", shell=True, check=True)
+        except subprocess.CalledProcessError:
+            raise Exception(
+                "VOMS proxy expired or non-existing: please run 'voms-proxy-init --voms cms'"
+            )
 
     if not args.skip_site:
         # initialize white/black sites
         cmd = f"python3 analysis/filesets/build_sites.py --year {args.year}"
         subprocess.run(cmd, shell=True)
 
-    # generate input filesets
-    samples_str = " ".join(args.samples) if args.samples else ""
-    cmd = f"singularity exec -B /afs -B /cvmfs {args.image} python3 analysis/filesets/build_filesets.py --year {args.year} --samples {samples_str}"
-    subprocess.run(cmd, shell=True)
+    if args.replicas_strategy == "score":
+        # update the site health stats with the telemetry of the jobs finished since the last update
+        cmd = f"python3 analysis/filesets/site_health.py --year {args.year}"
+        subprocess.run(cmd, shell=True)
+
+    # discover the datasets files (each dataset is merged into the fileset as soon as it is found)
+    discovery_cmd = (
+        f"python3 analysis/filesets/discovery.py --year {args.year} --workers {args.workers} "
+        f"--ttl {args.ttl} --replicas_strategy {args.replicas_strategy}"
+    )
+    if args.samples:
+        discovery_cmd += f" --samples {' '.join(args.samples)}"
+    if args.refresh:
+        discovery_cmd += " --refresh"
+    if args.catalogue:
+        cmds = [f"{discovery_cmd} --backend local --catalogue {args.catalogue}"]
+    else:
+        cmds = [
+            # data and MC samples from rucio (within the coffea image)
+            f"singularity exec -B /afs -B /cvmfs {args.image} {discovery_cmd} --backend rucio",
+            # signal samples from DAS, concurrently
+            f"{discovery_cmd} --backend das --site {args.site}",
+        ]
+    processes = [subprocess.Popen(cmd, shell=True) for cmd in cmds]
+    for process in processes:
+        process.wait()
 
-    # add signal samples
-    signal_cmd = f"python3 analysis/filesets/build_signal_filesets.py --year {args.year} --site {args.site}"
-    subprocess.run(signal_cmd, shell=True)
+    if args.index_runs:
+        # genEventSumw/genEventCount of each file (read once, see analysis/filesets/normalisation.py)
+        index_cmd = f"python3 analysis/filesets/normalisation.py --year {args.year} --workers {args.workers}"
+        if args.samples:
+            index_cmd += f" --samples {' '.join(args.samples)}"
+        subprocess.run(index_cmd, shell=True)
@@ -7,10 +7,22 @@ import logging
 import subprocess
 from pathlib import Path
 from analysis.filesets.xrootd_sites import xroot_to_site
-from datetime import datetime, timedelta
 from analysis.utils import make_output_directory
 from analysis.filesets.xrootd_sites import xroot_to_site
-from analysis.filesets.utils import divide_list, modify_site_list, extract_xrootd_errors
+from analysis.filesets.utils import divide_list, modify_site_list
+from analysis.filesets.site_health import update_site_stats
+from analysis.utils.job_ledger import (
+    JobLedger,
+    LEDGER_NAME,
+    FAILURE_CLASSES,
+    RESUBMIT_STATUSES,
+)
+from submit_condor import (
+    move_proxy,
+    get_jobname,
+    condor_submit,
+    write_campaign_submit_file,
+)
 
 
 def parse_args():
@@ -53,10 +65,11 @@ def parse_args():
         help="Format of output histograms",
     )
     parser.add_argument(
-        "--hours_ago",
-        type=int,
-        default=3,
-        help="use .err files that have been modified less than 'hours_ago' hours ago",
+        "--failure-class",
+        dest="failure_class",
+        nargs="+",
+        choices=FAILURE_CLASSES,
+        help="resubmit only the jobs failed with these failure classes (default: all failed, held and unknown jobs)",
     )
     parser.add_argument(
         "-l",
@@ -76,106 +89,105 @@ def parse_args():
     return parser.parse_args()
 
 
-def get_jobs_info(job_dir, output_dir, log_dir, output_format, hours_ago=3):
+def register_unknown_datasets(ledger, job_dir, log_dir, args):
     """
-    Collect expected and completed job numbers per dataset, and gather error logs.
+    Register in the ledger the datasets prepared without it. Their jobs state is unknown until their outputs are found.
 
     Parameters:
     -----------
+        ledger (JobLedger): Campaign job ledger.
         job_dir (Path): Directory containing dataset job folders.
-        output_dir (Path): Directory with output files.
         log_dir (Path): Directory containing log files.
-        output_format (str): File format of the output (e.g., 'coffea' or 'root').
-
-    Returns:
-    --------
-        tuple:
-            - jobnum (dict): Expected job numbers per dataset.
-            - jobnum_done (dict): Successfully completed job numbers per dataset.
-            - error_file (list): List of .err log files.
+        args: Submission arguments (workflow, label).
     """
-    jobnum, jobnum_done = {}, {}
-    error_file = []
-
-    for dataset_dir in job_dir.iterdir():
-        if not dataset_dir.is_dir():
+    for dataset_dir in sorted(job_dir.iterdir()):
+        if not dataset_dir.is_dir() or ledger.has_dataset(dataset_dir.name):
             continue
-
-        dataset = dataset_dir.name
-        jobnum_path = dataset_dir / "jobnum.txt"
-        if not jobnum_path.exists():
+        partitions_path = dataset_dir / "partitions.json"
+        if not partitions_path.exists():
             raise FileNotFoundError(
-                f"Missing jobnum.txt for dataset '{dataset}'. Expected at: {jobnum_path}"
+                f"Missing partitions.json for dataset '{dataset_dir.name}'. Expected at: {partitions_path}"
             )
-
-        jobnum[dataset] = jobnum_path.read_text().splitlines()
-        output_files = list((output_dir / dataset).glob(f"*.{output_format}"))
-        jobnum_done[dataset] = [f.stem.replace(f"{dataset}_", "") for f in output_files]
-
-        # look for error files created within the last 3 hours
-        x_hours_ago = datetime.now() - timedelta(hours=hours_ago)
-        for err_file in (log_dir / dataset).glob("*.err"):
-            if datetime.fromtimestamp(err_file.stat().st_mtime) > x_hours_ago:
-                error_file.append(err_file)
-
-    return jobnum, jobnum_done, error_file
+        ledger.register_jobs(
+            dataset_dir.name,
+            get_jobname(args, dataset_dir.name),
+            dataset_dir,
+            log_dir / dataset_dir.name,
+            json.loads(partitions_path.read_text()),
+        )
 
 
-def print_job_status(jobnum, jobnum_done):
+def print_job_status(ledger, failure_classes=None):
     """
-    Print a summary of expected, finished, and missing jobs. Show YAML list of datasets with missing jobs.
+    Print a summary of the jobs status, failure classes and input sites. Show YAML list of datasets with jobs to resubmit.
 
     Parameters:
     -----------
-        jobnum (dict): Expected job numbers per dataset.
-        jobnum_done (dict): Completed job numbers per dataset.
+        ledger (JobLedger): Campaign job ledger.
+        failure_classes (list): Failure classes of the jobs to resubmit. If None, all failed, held and unknown jobs are resubmitted.
 
     Returns:
     --------
-        tuple:
-            - jobnum_missing (dict): Missing job numbers per dataset.
-            - datasets_with_missing (list): Datasets that have missing jobs.
+        list: Jobs (ledger rows) to resubmit.
     """
-    jobnum_missing = {d: set(jobnum[d]) - set(jobnum_done.get(d, [])) for d in jobnum}
-    n_expected = sum(len(v) for v in jobnum.values())
-    n_done = sum(len(v) for v in jobnum_done.values())
-    n_missing = sum(len(v) for v in jobnum_missing.values())
-
+    status_counts = ledger.get_status_counts()
     logging.info("Jobs status:")
-    logging.info(f"Expected: {n_expected}")
-    logging.info(f"Finished: {n_done}")
-    logging.info(f"Missing: {n_missing}\n")
-
-    datasets_with_missing = [d for d in jobnum_missing if jobnum_missing[d]]
-    if n_missing:
-        print(
-            f"Datasets with missing jobs ({len(datasets_with_missing)}/{len(jobnum)}):"
-        )
-        print(
-            yaml.dump(
-                datasets_with_missing,
-                default_flow_style=False,
-                sort_keys=False,
-                indent=2,
+    logging.info(f"Expected: {sum(status_counts.values())}")
+    for status, n in sorted(status_counts.items()):
+        logging.info(f"{status.capitalize()}: {n}")
+
+    failure_counts = ledger.get_failure_counts()
+    if failure_counts:
+        logging.info("\nFailure classes:")
+        for failure_class, n in sorted(failure_counts.items()):
+            logging.info(f"{failure_class}: {n}")
+
+    # (column, header, width, format)
+    columns = [
+        ("input_site", "site", 25, ""),
+        ("jobs", "jobs", 6, ""),
+        ("done", "done", 6, ""),
+        ("failed", "failed", 8, ""),
+        ("wall_time", "wall time [s]", 15, ".0f"),
+        ("cpu_efficiency", "CPU eff.", 10, ".2f"),
+        ("peak_memory_mb", "peak mem. [MB]", 16, ".0f"),
+        ("events", "events", 12, ""),
+    ]
+    logging.info("\nInput sites:")
+    logging.info("".join(f"{header:>{width}}" for _, header, width, _ in columns))
+    for row in ledger.get_site_summary():
+        logging.info(
+            "".join(
+                f"{'-' if row[column] is None else format(row[column], spec):>{width}}"
+                for column, _, width, spec in columns
             )
         )
 
-    return jobnum_missing, datasets_with_missing
+    if failure_classes is None:
+        jobs_to_resubmit = ledger.get_jobs(statuses=RESUBMIT_STATUSES)
+    else:
+        jobs_to_resubmit = ledger.get_jobs(failure_classes=failure_classes)
+    datasets = list(dict.fromkeys(job["dataset"] for job in jobs_to_resubmit))
+    if jobs_to_resubmit:
+        print(f"\nJobs to resubmit: {len(jobs_to_resubmit)}")
+        print(f"Datasets with jobs to resubmit ({len(datasets)}):")
+        print(yaml.dump(datasets, default_flow_style=False, sort_keys=False, indent=2))
+    return jobs_to_resubmit
 
 
-def analyze_xrootd_errors(error_file):
+def analyze_xrootd_errors(ledger):
     """
-    Analyze error logs and extract problematic xrootd sites.
+    Find the problematic xrootd sites of the jobs failed with xrootd errors.
 
     Parameters:
     -----------
-        error_file (list): List of error log files.
+        ledger (JobLedger): Campaign job ledger.
 
     Returns:
     --------
         list: Sites with detected xrootd errors.
     """
-    xrootd_errs = extract_xrootd_errors(error_file)
+    xrootd_errs = ledger.get_xrootd_errors()
     if not xrootd_errs:
         return []
 
@@ -242,35 +254,54 @@ def update_input_filesets(
             json.dump(partition_dataset, json_file, indent=4)
 
 
-def resubmit_jobs(job_dir, jobnum_missing, datasets_with_missing_jobs, workflow, year):
+def resubmit_jobs(args, ledger, jobs_to_resubmit):
     """
-    Prepare and resubmit jobs for datasets with missing jobs.
+    Resubmit jobs with a single condor submit file queueing only those jobs.
 
     Parameters:
     -----------
-        job_dir (Path): Directory with Condor job files.
-        jobnum_missing (dict): Missing job numbers per dataset.
-        datasets_with_missing_jobs (list): List of affected datasets.
-        workflow (str): Workflow name.
-        year (str): Dataset year.
+        args: Submission arguments (workflow, label, year, memory).
+        ledger (JobLedger): Campaign job ledger.
+        jobs_to_resubmit (list): Jobs (ledger rows) to resubmit.
     """
-    to_resubmit = []
-    for dataset in datasets_with_missing_jobs:
-        missing_file = job_dir / dataset / "missing.txt"
-        with open(missing_file, "w") as f:
-            print(*sorted(jobnum_missing[dataset]), sep="\n", file=f)
-
-        condor_file = job_dir / dataset / f"{workflow}_{dataset}.sub"
-        condor_backup = condor_file.with_name(condor_file.stem + "_all.sub")
-        subprocess.run(["cp", str(condor_file), str(condor_backup)])
-
-        submit_text = condor_file.read_text().replace("jobnum.txt", "missing.txt")
-        condor_file.write_text(submit_text)
-        logging.info(f"Condor file updated: {workflow}/{year}/{dataset}")
-        to_resubmit.append(str(condor_file))
-
-    for submit_file in to_resubmit:
-        subprocess.run(["condor_submit", submit_file])
+    # held jobs are still in the queue
+    held = [
+        f"{job['cluster_id']}.{job['proc_id']}"
+        for job in jobs_to_resubmit
+        if job["status"] == "held"
+    ]
+    if held:
+        subprocess.run(["condor_rm", *held])
+
+    jobs = {}
+    for job in jobs_to_resubmit:
+        jobs.setdefault(
+            job["dataset"],
+            {
+                "dataset": job["dataset"],
+                "jobname": job["jobname"],
+                "job_dir": job["job_dir"],
+                "log_dir": job["log_dir"],
+                "jobnums": [],
+            },
+        )["jobnums"].append(job["jobnum"])
+    jobs = list(jobs.values())
+    for job in jobs:
+        # datasets submitted with --tune keep their tuned memory request (others use --memory)
+        arguments_path = Path(job["job_dir"]) / "arguments.json"
+        if arguments_path.exists():
+            arguments = json.loads(arguments_path.read_text())
+            if arguments.get("tune", False):
+                job["memory"] = arguments["memory"]
+
+    with open(Path.cwd() / "condor" / "submit.sub") as f:
+        template = f.readlines()
+    submit_file = write_campaign_submit_file(
+        args, jobs, template, move_proxy(), name="resubmit"
+    )
+    logging.info(f"Condor file written: {submit_file}")
+    queued = [(job["dataset"], n) for job in jobs for n in job["jobnums"]]
+    ledger.mark_submitted(queued, condor_submit(submit_file))
 
 
 if __name__ == "__main__":
@@ -305,14 +336,20 @@ if __name__ == "__main__":
     log_dir = condor_dir / "logs" / workflow_dir / args.year
     fileset_dir = base_dir / "analysis" / "filesets"
 
-    jobnum, jobnum_done, error_file = get_jobs_info(
-        job_dir, output_dir, log_dir, args.output_format, args.hours_ago
-    )
+    ledger = JobLedger(job_dir / LEDGER_NAME)
+    register_unknown_datasets(ledger, job_dir, log_dir, args)
+    ledger.update_from_logs(log_dir)
+    ledger.update_from_outputs(output_dir, args.output_format)
+    # feed the site health stats before resubmissions reset the failed jobs
+    update_site_stats(args.year, [job_dir / LEDGER_NAME])
 
-    jobnum_missing, datasets_with_missing_jobs = print_job_status(jobnum, jobnum_done)
+    jobs_to_resubmit = print_job_status(ledger, args.failure_class)
 
-    if jobnum_missing and datasets_with_missing_jobs:
-        site_errs = analyze_xrootd_errors(error_file)
+    if jobs_to_resubmit:
+        datasets_with_missing_jobs = list(
+            dict.fromkeys(job["dataset"] for job in jobs_to_resubmit)
+        )
+        site_errs = analyze_xrootd_errors(ledger)
 
         if site_errs and input("Update input filesets? (y/n): ").lower() in [
             "y",
@@ -323,10 +360,5 @@ if __name__ == "__main__":
             )
 
         if input("Update and resubmit jobs? (y/n): ").lower() in ["y", "yes"]:
-            resubmit_jobs(
-                job_dir,
-                jobnum_missing,
-                datasets_with_missing_jobs,
-                args.workflow,
-                args.year,
-            )
+            resubmit_jobs(args, ledger, jobs_to_resubmit)
+    ledger.close()
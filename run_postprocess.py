@@ -1,4 +1,3 @@
-import gc
 import sys
 import yaml
 import glob
@@ -10,17 +9,24 @@ import pandas as pd
 from pathlib import Path
 from collections import defaultdict
 from coffea.util import save, load
-from coffea.processor import accumulate
 from analysis.utils import make_output_directory
+from analysis.histograms import accumulate_outputs
+from analysis.utils.output_merger import drop_merged_inputs, get_output_dataset
 from analysis.filesets.utils import get_dataset_config, get_process_maps
 from analysis.workflows.config import WorkflowConfigBuilder
-from analysis.postprocess.coffea_plotter import CoffeaPlotter
+from analysis.postprocess.coffea_plotter import plot_all_histograms
 from analysis.postprocess.coffea_postprocessor import (
-    save_process_histograms_by_process,
-    save_process_histograms_by_sample,
+    postprocess_outputs,
     load_processed_histograms,
     get_results_report,
 )
+from analysis.postprocess.systematics import VariationProjector
+from analysis.postprocess.perf_report import (
+    load_perf,
+    get_stage_report,
+    get_chunk_report,
+)
+from analysis.postprocess.histogram_store import HistogramStore, save_histogram_store
 from analysis.postprocess.utils import (
     print_header,
     setup_logger,
@@ -106,6 +112,12 @@ def parse_arguments():
     parser.add_argument(
         "--eos", action="store_true", help="Enable reading outputs from /eos"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes used to merge samples and processes, and to plot",
+    )
     return parser.parse_args()
 
 
@@ -122,7 +134,7 @@ def load_year_histograms(workflow: str, year: str, output_dir: Path):
     post_file = (
         output_dir.parent / post_year / f"{post_year}_processed_histograms.coffea"
     )
-    return accumulate([load(pre_file), load(post_file)])
+    return accumulate_outputs([load(pre_file), load(post_file)])
 
 
 def load_histogram_file(path: Path):
@@ -146,6 +158,8 @@ if __name__ == "__main__":
     event_selection = workflow_config.event_selection
     categories = workflow_config.event_selection["categories"]
     processed_histograms = None
+    # (variation, bin) projections shared by the results, uncertainty tables and plots
+    projector = None
 
     if "data" not in workflow_config.datasets:
         args.blind = True
@@ -156,11 +170,13 @@ if __name__ == "__main__":
         # logging.info(workflow_config.to_yaml())
         print_header(f"Reading outputs from: {output_dir}")
 
-        output_files = [
-            i
-            for i in glob.glob(f"{output_dir}/*/*.coffea", recursive=True)
-            if not i.split("/")[-1].startswith("cutflow")
-        ]
+        output_files = drop_merged_inputs(
+            [
+                i
+                for i in glob.glob(f"{output_dir}/*/*.coffea", recursive=True)
+                if not i.split("/")[-1].startswith("cutflow")
+            ]
+        )
         process_samples_map = defaultdict(list)
 
         samples_in_out = [
@@ -181,40 +197,49 @@ if __name__ == "__main__":
         # group output file paths by sample name
         grouped_outputs = {}
         for output_file in output_files:
-            sample_name = output_file.split("/")[-1].split(".coffea")[0]
-            if sample_name.rsplit("_")[-1].isdigit():
-                sample_name = "_".join(sample_name.rsplit("_")[:-1])
+            # job ('{sample}_{jobnum}') or merged ('{sample}_merged{level}-{jobnum}') outputs
+            sample_name = get_output_dataset(output_file.split("/")[-1].split(".coffea")[0])
             sample_name = sample_name.replace(f"{args.year}_", "")
             if sample_name in grouped_outputs:
                 grouped_outputs[sample_name].append(output_file)
             else:
                 grouped_outputs[sample_name] = [output_file]
 
-        for sample in grouped_outputs:
-            save_process_histograms_by_sample(
-                year=args.year,
-                output_dir=output_dir,
-                sample=sample,
-                grouped_outputs=grouped_outputs,
-                categories=categories,
-            )
-            gc.collect()
-
-        for process in process_samples_map:
-            save_process_histograms_by_process(
-                year=args.year,
-                output_dir=output_dir,
-                process_samples_map=process_samples_map,
-                process=process,
-                categories=categories,
-            )
-            gc.collect()
+        # merge and save changed samples, then processes (as soon as their samples are ready)
+        merged_histograms = postprocess_outputs(
+            grouped_outputs=grouped_outputs,
+            year=args.year,
+            output_dir=output_dir,
+            process_samples_map=process_samples_map,
+            categories=categories,
+            workers=args.workers,
+        )
 
         processed_histograms = load_processed_histograms(
             year=args.year,
             output_dir=output_dir,
             process_samples_map=process_samples_map,
+            histograms=merged_histograms,
+        )
+        save_histogram_store(
+            processed_histograms, output_dir / f"{args.year}_processed_histograms.h5"
         )
+        projector = VariationProjector(processed_histograms)
+
+        perf = load_perf(output_dir)
+        if perf is not None:
+            print_header("Processor stages performance")
+            stage_report = get_stage_report(perf)
+            logging.info(
+                stage_report.applymap(lambda x: f"{x:.3f}" if pd.notnull(x) else "")
+            )
+            stage_report.to_csv(output_dir / "perf_stages.csv")
+            get_stage_report(perf, by_shift=True).to_csv(
+                output_dir / "perf_stages_by_shift.csv"
+            )
+            logging.info("\nSlowest chunks:")
+            logging.info(get_chunk_report(perf).to_string(index=False))
+            logging.info("\n")
 
         for category in categories:
             logging.info(f"category: {category}")
@@ -268,6 +293,7 @@ if __name__ == "__main__":
                     category,
                     columns_to_drop,
                     args.blind,
+                    projector=projector,
                 )
                 logging.info(
                     results_df.applymap(lambda x: f"{x:.5f}" if pd.notnull(x) else "")
@@ -297,6 +323,11 @@ if __name__ == "__main__":
                 processed_histograms,
                 f"{output_dir}/{args.year}_processed_histograms.coffea",
             )
+            save_histogram_store(
+                processed_histograms,
+                output_dir / f"{args.year}_processed_histograms.h5",
+            )
+            projector = VariationProjector(processed_histograms)
             identifier_map = {"2016": "VFP", "2022": "EE", "2023": "BPix"}
             identifier = identifier_map[args.year]
 
@@ -309,7 +340,9 @@ if __name__ == "__main__":
                 "1b1mu",
             ]:
                 print_header(f"Systematic uncertainty impact")
-                syst_df = uncertainty_table(processed_histograms, args.workflow)
+                syst_df = uncertainty_table(
+                    processed_histograms, args.workflow, projector=projector
+                )
                 syst_df.to_csv(
                     f"{OUTPUT_DIR / args.workflow / args.year}/uncertainty_table.csv"
                 )
@@ -391,14 +424,16 @@ if __name__ == "__main__":
     if args.postprocess:
         if args.workflow in ["1b1mu", "1b1e", "2b1e", "2b1mu", "1b1mu1e", "1b1e1mu"]:
             print_header(f"Systematic uncertainty impact")
-            syst_df = uncertainty_table(processed_histograms, args.workflow)
+            syst_df = uncertainty_table(
+                processed_histograms, args.workflow, projector=projector
+            )
             syst_df.to_csv(f"{output_dir}/uncertainty_table.csv")
             logging.info(syst_df)
             logging.info("\n")
 
             print_header(f"Systematic uncertainty impact by process")
             summary_table = build_systematic_summary(
-                processed_histograms, args.workflow
+                processed_histograms, args.workflow, projector=projector
             )
             summary_table.to_csv(f"{output_dir}/uncertainty_table_by_process.csv")
             logging.info(summary_table)
@@ -408,36 +443,42 @@ if __name__ == "__main__":
         subprocess.run("python3 analysis/postprocess/color_map.py", shell=True)
 
         if not args.postprocess and args.year not in ["2016", "2022", "2023"]:
+            store_file = output_dir / f"{args.year}_processed_histograms.h5"
             postprocess_file = output_dir / f"{args.year}_processed_histograms.coffea"
-            processed_histograms = load_histogram_file(postprocess_file)
+            if store_file.exists():
+                # read histograms lazily, only the plotted slices are loaded
+                processed_histograms = HistogramStore(store_file)
+            else:
+                processed_histograms = load_histogram_file(postprocess_file)
             if processed_histograms is None:
                 cmd = f"python3 run_postprocess.py -w {args.workflow} -y {args.year} --postprocess"
                 raise ValueError(
                     f"Postprocess file not found. Please run:\n  '{cmd}' first"
                 )
+            projector = VariationProjector(processed_histograms)
 
         print_header("Plots")
-        plotter = CoffeaPlotter(
-            workflow=args.workflow,
-            processed_histograms=processed_histograms,
-            year=args.year,
-            output_dir=output_dir,
+        timing_df = plot_all_histograms(
+            plotter_kwargs=dict(
+                workflow=args.workflow,
+                processed_histograms=processed_histograms,
+                year=args.year,
+                output_dir=output_dir,
+                projector=projector,
+            ),
+            categories=list(workflow_config.event_selection["categories"]),
+            variables=workflow_config.histogram_config.variables,
+            plot_kwargs=dict(
+                yratio_limits=args.yratio_limits,
+                log=args.log,
+                extension=args.extension,
+                add_ratio=not args.no_ratio,
+                blind=args.blind,
+            ),
+            tarball_name=f"{args.workflow}_{args.year}_plots.tar.gz",
+            workers=args.workers,
         )
-
-        for category in workflow_config.event_selection["categories"]:
-            logging.info(f"Plotting histograms for category: {category}")
-            for variable in workflow_config.histogram_config.variables:
-                logging.info(variable)
-                plotter.plot_histograms(
-                    variable=variable,
-                    category=category,
-                    yratio_limits=args.yratio_limits,
-                    log=args.log,
-                    extension=args.extension,
-                    add_ratio=not args.no_ratio,
-                    blind=args.blind,
-                )
-            subprocess.run(
-                f"tar -zcvf {output_dir}/{category}/{args.workflow}_{args.year}_plots.tar.gz {output_dir}/{category}/*.{args.extension}",
-                shell=True,
-            )
+        print_header("Plotting time")
+        logging.info(timing_df.to_string(float_format=lambda x: f"{x:.2f}"))
+        logging.info(f"total: {timing_df['seconds'].sum():.2f} s")
+        timing_df.to_csv(output_dir / "plot_timing.csv", index=False)
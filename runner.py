@@ -1,8 +1,7 @@
-import json
 import argparse
-import subprocess
 from pathlib import Path
-from analysis.filesets.utils import get_datasets_to_run_over, fileset_checker
+from submit_condor import submit_campaign
+from analysis.filesets.utils import get_datasets_to_run_over
 
 
 if __name__ == "__main__":
@@ -72,29 +71,41 @@ if __name__ == "__main__":
         default="2000",
         help="Requested memory (in MB) for the condor job",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Enable recording the processor stages performance (wall time, events and allocated memory)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="Number of input files staged to the job scratch ahead of the file being processed (0 reads the inputs remotely)",
+    )
+    parser.add_argument(
+        "--staged_upload",
+        action="store_true",
+        help="Write the job outputs to the job scratch and then upload them to the output path (with checksum verification)",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        default=0,
+        help="Merge the finished outputs of each dataset as jobs finish, with this fan-in (0 disables merging)",
+    )
+    parser.add_argument(
+        "--sample_fraction",
+        type=float,
+        default=1.0,
+        help="Process only this fraction of the chunks of each dataset, evenly spread (quick studies). Outputs are normalised to the full datasets",
+    )
+    parser.add_argument(
+        "--tune",
+        action="store_true",
+        help="Use the per-dataset memory, workers and chunk size of the campaign resources.json (see analysis/utils/resource_tuner.py)",
+    )
     args = parser.parse_args()
 
-    # submit (or prepare) a job for each dataset using the given arguments
+    # prepare the jobs of all datasets in a single pass and (optionally) submit them at once
     datasets_to_run = get_datasets_to_run_over(args.workflow, args.year)
-    fileset_checker(datasets_to_run, args.year)
-    cmd = ["python3", "submit_condor.py"]
-    for dataset in datasets_to_run:
-        cmd_args = [
-            "--workflow",
-            args.workflow,
-            "--year",
-            args.year,
-            "--dataset",
-            dataset,
-            "--nfiles",
-            str(args.nfiles),
-            "--output_format",
-            args.output_format,
-            "--memory",
-            args.memory
-        ]
-        if args.submit:
-            cmd_args.append("--submit")
-        if args.eos:
-            cmd_args.append("--eos")
-        subprocess.run(cmd + cmd_args)
+    submit_campaign(args, datasets_to_run)
@@ -1,28 +1,130 @@
+import os
 import json
+import dataclasses
+import time
 import argparse
 from pathlib import Path
 from coffea import processor
 from coffea.util import save
 from coffea.nanoevents import NanoAODSchema
 from analysis.utils import write_root
+from analysis.histograms import accumulate_outputs
+from analysis.utils.sampling import sample_fileset
+from analysis.filesets.normalisation import FilesetMetadataIndex, get_files_norm
+from analysis.utils.job_ledger import write_job_summary
+from analysis.utils.output_merger import merge_job_outputs, get_output_dataset
 from analysis.processors.base import BaseProcessor
+from analysis.utils.staging import (
+    InputPrefetcher,
+    OutputUploader,
+    copy_file,
+    get_open_latency,
+)
 
 
-def main(args):
-    with open(args.partition_json) as f:
-        partition_fileset = json.load(f)
-    out = processor.run_uproot_job(
-        partition_fileset,
+def run_processor(fileset: dict, args, chunks: list = None):
+    """process a fileset or, if given, only some of its chunks (sampling mode)"""
+    processor_instance = BaseProcessor(
+        workflow=args.workflow, year=args.year, profile=args.profile
+    )
+    if chunks is not None:
+        runner = processor.Runner(
+            executor=processor.FuturesExecutor(workers=args.workers),
+            schema=NanoAODSchema,
+            savemetrics=True,
+        )
+        output = runner.run(chunks, processor_instance)
+        return output["out"], output["metrics"]
+    return processor.run_uproot_job(
+        fileset,
         treename="Events",
-        processor_instance=BaseProcessor(workflow=args.workflow, year=args.year),
+        processor_instance=processor_instance,
         executor=processor.futures_executor,
-        executor_args={"schema": NanoAODSchema, "workers": 4},
+        executor_args={"schema": NanoAODSchema, "workers": args.workers, "savemetrics": True},
+        chunksize=args.chunksize,
     )
-    savepath = f"{args.output_path}/{args.dataset}"
+
+
+def run_staged_processor(fileset: dict, args, chunks: list = None):
+    """process the files one at a time from local scratch, while the next ones are being staged"""
+    datasets = [dataset for dataset, files in fileset.items() for _ in files]
+    root_files = [f for files in fileset.values() for f in files]
+    if chunks is not None:
+        # only the files with sampled chunks are staged
+        sampled_files = {chunk.filename for chunk in chunks}
+        datasets, root_files = zip(
+            *[(d, f) for d, f in zip(datasets, root_files) if f in sampled_files]
+        )
+    outputs, metrics = [], []
+    with InputPrefetcher(root_files, args.scratch_dir, args.prefetch) as prefetcher:
+        for dataset, (url, path) in zip(datasets, prefetcher):
+            if chunks is None:
+                file_out, file_metrics = run_processor({dataset: [path]}, args)
+            else:
+                file_chunks = [
+                    dataclasses.replace(chunk, filename=path)
+                    for chunk in chunks
+                    if chunk.filename == url
+                ]
+                file_out, file_metrics = run_processor({}, args, file_chunks)
+            outputs.append(file_out)
+            metrics.append(file_metrics)
+    return accumulate_outputs(outputs), accumulate_outputs(metrics)
+
+
+def main(args):
+    with open(args.partition_json) as f:
+        partition_fileset = json.load(f)
+    start_time = time.time()
+    root_files = [f for files in partition_fileset.values() for f in files]
+    # input site telemetry (see analysis/filesets/site_health.py)
+    open_latency = get_open_latency(root_files[0])
+    chunks = None
+    if args.sample_fraction < 1:
+        # evenly spread subset of the chunks (see analysis/utils/sampling.py)
+        chunks, sampling = sample_fileset(partition_fileset, args.sample_fraction, args.chunksize)
+    if args.prefetch > 0:
+        out, metrics = run_staged_processor(partition_fileset, args, chunks)
+    else:
+        out, metrics = run_processor(partition_fileset, args, chunks)
+    # generator weight sums of the input files, from their 'Runs' trees (see analysis/filesets/normalisation.py)
+    out["metadata"]["norm"] = get_files_norm(root_files, FilesetMetadataIndex(args.year))
+    if chunks is not None:
+        # read by save_process_histograms_by_sample to normalise the sampled outputs
+        out["metadata"]["sampling"] = sampling
+    # outputs are written to local scratch and then uploaded, or written in place
+    output_dir = args.scratch_dir if args.staged_upload else args.output_path
+    savepath = f"{output_dir}/{args.dataset}"
     if args.output_format == "coffea":
         save(out, f"{savepath}.coffea")
+        outputs = [f"{savepath}.coffea"]
     elif args.output_format == "root":
+        outputs = [f"{savepath}.pkl", f"{savepath}.root"]
         write_root(out, savepath, args)
+    checksums = None
+    if args.staged_upload:
+        uploader = OutputUploader()
+        for output in outputs:
+            uploader.upload(output, f"{args.output_path}/{Path(output).name}")
+        checksums = uploader.wait()
+    # job summary read by the job ledger (see jobs_status.py), written once the outputs are in place
+    summary = f"{output_dir}/{args.dataset}.summary.json"
+    write_job_summary(
+        summary,
+        metrics,
+        time.time() - start_time,
+        root_files,
+        checksums,
+        open_latency,
+    )
+    if args.staged_upload:
+        copy_file(summary, f"{args.output_path}/{Path(summary).name}")
+        # condor would otherwise transfer the local copies back to the submit directory
+        for path in outputs + [summary]:
+            os.remove(path)
+    if args.merge > 0 and args.output_format == "coffea":
+        # merge the finished outputs of the dataset (skipped if another job is merging them)
+        merge_job_outputs(args.output_path, get_output_dataset(args.dataset), args.merge)
 
 
 if __name__ == "__main__":
@@ -80,5 +182,51 @@ if __name__ == "__main__":
         choices=["coffea", "root"],
         help="format of output histogram",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Enable recording the processor stages performance (wall time, events and allocated memory)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="Number of input files staged to local scratch ahead of the file being processed (0 reads the inputs remotely)",
+    )
+    parser.add_argument(
+        "--staged_upload",
+        action="store_true",
+        help="Write the outputs to local scratch and then upload them to the output path (with checksum verification)",
+    )
+    parser.add_argument(
+        "--scratch_dir",
+        type=str,
+        default=".",
+        help="local scratch directory of the staged inputs and outputs",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="number of executor workers",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="number of events per processor chunk",
+    )
+    parser.add_argument(
+        "--sample_fraction",
+        type=float,
+        default=1.0,
+        help="Fraction of the chunks of each dataset to process (sampling mode). Chunks are evenly spread over the files",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        default=0,
+        help="Fan-in of the hierarchical merge of the finished dataset outputs run at the end of the job (0 disables merging)",
+    )
     args = parser.parse_args()
     main(args)
@@ -1,9 +1,12 @@
 import os
+import re
 import json
 import argparse
 import subprocess
 from pathlib import Path
 from analysis.utils import make_output_directory
+from analysis.utils.job_ledger import JobLedger, LEDGER_NAME
+from analysis.utils.resource_tuner import load_resources
 from analysis.filesets.utils import divide_list, fileset_checker
 
 
@@ -26,47 +29,98 @@ def move_proxy() -> str:
     return x509_path
 
 
-def submit_condor(args):
-    """Build condor files. Optionally submit condor job"""
-    print(f"Creating {args.workflow}-{args.year}-{args.dataset} condor file")
-    
-
-    if args.label:
-        jobname = f"{args.workflow}_{args.label}_{args.dataset}"
-    else:
-        jobname = f"{args.workflow}_{args.dataset}"
-
-    # make condor and log directories
+def get_job_dirs(args, dataset: str):
+    """return the condor directory and the job and log directories of a dataset (created if missing)"""
     condor_dir = Path.cwd() / "condor"
     job_dir = condor_dir / args.workflow
+    log_dir = condor_dir / "logs" / args.workflow
     if args.label:
         job_dir = job_dir / args.label
-    job_dir = job_dir / args.year / args.dataset
-    
-    if not job_dir.exists():
-        job_dir.mkdir(parents=True, exist_ok=True)
+        log_dir = log_dir / args.label
+    job_dir = job_dir / args.year / dataset
+    log_dir = log_dir / args.year / dataset
+    job_dir.mkdir(parents=True, exist_ok=True)
+    log_dir.mkdir(parents=True, exist_ok=True)
+    return condor_dir, job_dir, log_dir
 
-    log_dir = condor_dir / "logs" / args.workflow
+
+def get_campaign_dir(args) -> Path:
+    """return the condor directory of a workflow (and label) year"""
+    campaign_dir = Path.cwd() / "condor" / args.workflow
     if args.label:
-        log_dir = log_dir / args.label
-    log_dir = log_dir / args.year / args.dataset
-    
-    if not log_dir.exists():
-        log_dir.mkdir(parents=True, exist_ok=True)
+        campaign_dir = campaign_dir / args.label
+    campaign_dir = campaign_dir / args.year
+    campaign_dir.mkdir(parents=True, exist_ok=True)
+    return campaign_dir
+
+
+def get_jobname(args, dataset: str) -> str:
+    if args.label:
+        return f"{args.workflow}_{args.label}_{dataset}"
+    return f"{args.workflow}_{dataset}"
+
+
+def fill_template(template: list, replacements: dict) -> str:
+    """replace the placeholders of the condor submit template lines"""
+    lines = []
+    for line in template:
+        for placeholder, value in replacements.items():
+            line = line.replace(placeholder, value)
+        lines.append(line)
+    return "".join(lines)
+
+
+def condor_submit(submit_file: Path) -> int:
+    """submit a condor submit file. Returns the cluster id (None if unknown)"""
+    result = subprocess.run(
+        ["condor_submit", str(submit_file)], capture_output=True, text=True
+    )
+    print(result.stdout, end="")
+    print(result.stderr, end="")
+    cluster = re.search(r"submitted to cluster (\d+)", result.stdout)
+    return int(cluster[1]) if cluster else None
+
+
+def prepare_dataset(
+    args,
+    dataset: str,
+    root_files: list,
+    template: list,
+    x509_path: str,
+    ledger: JobLedger,
+) -> dict:
+    """
+    write the partitions, job numbers, arguments and condor submit file of a dataset
+
+    Parameters:
+    -----------
+        args:
+            submission arguments (workflow, year, label, nfiles, memory, ...)
+        dataset:
+            dataset name
+        root_files:
+            dataset root files
+        template:
+            lines of the condor submit template
+        x509_path:
+            path of the copied x509 proxy
+        ledger:
+            job ledger where the dataset jobs are registered
+
+    Returns:
+    --------
+        dictionary with the dataset job name, directories, job numbers and submit file
+    """
+    print(f"Creating {args.workflow}-{args.year}-{dataset} condor file")
+    condor_dir, job_dir, log_dir = get_job_dirs(args, dataset)
+    jobname = get_jobname(args, dataset)
 
-    # check if the fileset for the given year exists, generate it otherwise
-    fileset_checker(year=args.year, samples=[args.dataset])
     # save partitions json and jobnums to job directory
     jobnum_list = []
     partition_dataset = {}
-    fileset_path = Path.cwd() / "analysis" / "filesets"
-    with open(f"{fileset_path}/fileset_{args.year}_NANO_lxplus.json", "r") as f:
-        root_files = json.load(f)[args.dataset]
     root_files_list = divide_list(root_files, args.nfiles)
     for i in range(len(root_files_list)):
-        dataset_key = (
-            f"{args.dataset}_{i+1}" if len(root_files_list) > 1 else args.dataset
-        )
+        dataset_key = f"{dataset}_{i+1}" if len(root_files_list) > 1 else dataset
         partition_dataset[i + 1] = {dataset_key: root_files_list[i]}
         jobnum_list.append(i + 1)
 
@@ -79,31 +133,161 @@ def submit_condor(args):
         print(*jobnum_list, sep="\n", file=f)
 
     # build and save arguments json
-    args.output_path = str(make_output_directory(args))
+    dataset_args = argparse.Namespace(**{**vars(args), "dataset": dataset})
+    if args.tune:
+        # per-dataset memory request, executor workers and chunk size (see analysis/utils/resource_tuner.py)
+        resources = load_resources(get_campaign_dir(args)).get(dataset)
+        if resources is None:
+            print(f"No tuned resources for {dataset}: using --memory {args.memory}")
+        else:
+            for key in ["memory", "workers", "chunksize"]:
+                setattr(dataset_args, key, resources[key])
+    dataset_args.output_path = str(make_output_directory(dataset_args))
     args_file = job_dir / "arguments.json"
     with open(args_file, "w") as json_file:
-        json.dump(vars(args), json_file, indent=4)
+        json.dump(vars(dataset_args), json_file, indent=4)
 
     # make condor file
-    local_condor = f"{job_dir}/{jobname}.sub"
-    with open(f"{condor_dir}/submit.sub") as condor_template_file, open(
-        local_condor, "w"
-    ) as condor_file:
-        for line in condor_template_file:
-            line = line.replace("CONDORDIR", str(condor_dir))
-            line = line.replace("BASEDIR", str(Path.cwd()))
-            line = line.replace("X509PATH", move_proxy())
-            line = line.replace("LOGDIR", str(log_dir))
-            line = line.replace("JOBNAME", jobname)
-            line = line.replace(
-                "INPUTFILES", f"{partition_file},{jobnum_file},{args_file}"
-            )
-            line = line.replace("JOBNUM_FILE", str(jobnum_file))
-            line = line.replace("MEMORY", args.memory)
-            condor_file.write(line)
+    local_condor = job_dir / f"{jobname}.sub"
+    local_condor.write_text(
+        fill_template(
+            template,
+            {
+                "CONDORDIR": str(condor_dir),
+                "BASEDIR": str(Path.cwd()),
+                "X509PATH": x509_path,
+                "LOGDIR": str(log_dir),
+                "JOBNAME": jobname,
+                "INPUTFILES": f"{partition_file},{jobnum_file},{args_file}",
+                "JOBNUM_FILE": str(jobnum_file),
+                "MEMORY": dataset_args.memory,
+            },
+        )
+    )
+    ledger.register_jobs(dataset, jobname, job_dir, log_dir, partition_dataset)
+    return {
+        "dataset": dataset,
+        "jobname": jobname,
+        "job_dir": job_dir,
+        "log_dir": log_dir,
+        "jobnums": jobnum_list,
+        "submit_file": local_condor,
+        "memory": dataset_args.memory,
+    }
+
+
+def write_campaign_submit_file(
+    args, jobs: list, template: list, x509_path: str, name: str = "campaign"
+) -> Path:
+    """
+    write a single condor submit file queueing the jobs of several datasets.
+    Each queue row holds the job number, job directory, job name, log directory and memory request of a job
+
+    Parameters:
+    -----------
+        args:
+            submission arguments
+        jobs:
+            prepared datasets (see prepare_dataset). Datasets without 'memory' request args.memory
+        template:
+            lines of the condor submit template
+        x509_path:
+            path of the copied x509 proxy
+        name:
+            name of the submit file, e.g. 'campaign' or 'resubmit'
+    """
+    condor_dir = Path.cwd() / "condor"
+    campaign_dir = get_campaign_dir(args)
+    queue_file = campaign_dir / f"{name}_queue.txt"
+    with open(queue_file, "w") as f:
+        for job in jobs:
+            for jobnum in job["jobnums"]:
+                memory = job.get("memory") or args.memory
+                print(jobnum, job["job_dir"], job["jobname"], job["log_dir"], memory, file=f)
+
+    # the template's queue statement is replaced by a queue over the rows of 'queue_file'
+    campaign_template = [
+        line for line in template if not line.strip().lower().startswith("queue")
+    ]
+    submit_file = campaign_dir / f"{get_jobname(args, args.year)}_{name}.sub"
+    submit_text = fill_template(
+        campaign_template,
+        {
+            "CONDORDIR": str(condor_dir),
+            "BASEDIR": str(Path.cwd()),
+            "X509PATH": x509_path,
+            "LOGDIR": "$(LOGDIR)",
+            "JOBNAME": "$(JOBNAME)",
+            "INPUTFILES": "$(JOBDIR)/partitions.json,$(JOBDIR)/jobnum.txt,$(JOBDIR)/arguments.json",
+            "MEMORY": "$(JOBMEMORY)",
+        },
+    )
+    submit_text += f"Queue JOBNUM, JOBDIR, JOBNAME, LOGDIR, JOBMEMORY from {queue_file}\n"
+    submit_file.write_text(submit_text)
+    return submit_file
 
+
+def submit_campaign(args, datasets: list) -> Path:
+    """
+    Build the condor files of several datasets in a single pass and, optionally,
+    submit all their jobs with a single condor_submit
+
+    The fileset and submit template are read once and the x509 proxy is copied once.
+    Each dataset keeps its own job directory, and its jobs are registered in the campaign job ledger
+
+    Parameters:
+    -----------
+        args:
+            submission arguments (workflow, year, label, nfiles, memory, eos, submit, output_format)
+        datasets:
+            datasets to submit
+
+    Returns:
+    --------
+        path of the campaign submit file
+    """
+    fileset_checker(samples=datasets, year=args.year)
+    fileset_path = Path.cwd() / "analysis" / "filesets"
+    with open(f"{fileset_path}/fileset_{args.year}_NANO_lxplus.json", "r") as f:
+        root_files = json.load(f)
+    with open(Path.cwd() / "condor" / "submit.sub") as f:
+        template = f.readlines()
+    x509_path = move_proxy()
+
+    ledger = JobLedger(get_campaign_dir(args) / LEDGER_NAME)
+    jobs = [
+        prepare_dataset(args, dataset, root_files[dataset], template, x509_path, ledger)
+        for dataset in datasets
+    ]
+    submit_file = write_campaign_submit_file(args, jobs, template, x509_path)
+    n_jobs = sum(len(job["jobnums"]) for job in jobs)
+    print(f"{n_jobs} jobs from {len(jobs)} datasets queued in {submit_file}")
+    if args.submit:
+        # ProcIds follow the order of the queue rows
+        queued = [(job["dataset"], n) for job in jobs for n in job["jobnums"]]
+        ledger.mark_submitted(queued, condor_submit(submit_file))
+    ledger.close()
+    return submit_file
+
+
+def submit_condor(args):
+    """Build condor files. Optionally submit condor job"""
+    # check if the fileset for the given year exists, generate it otherwise
+    fileset_checker(year=args.year, samples=[args.dataset])
+    fileset_path = Path.cwd() / "analysis" / "filesets"
+    with open(f"{fileset_path}/fileset_{args.year}_NANO_lxplus.json", "r") as f:
+        root_files = json.load(f)[args.dataset]
+    with open(Path.cwd() / "condor" / "submit.sub") as f:
+        template = f.readlines()
+
+    ledger = JobLedger(get_campaign_dir(args) / LEDGER_NAME)
+    job = prepare_dataset(
+        args, args.dataset, root_files, template, move_proxy(), ledger
+    )
     if args.submit:
-        subprocess.run(["condor_submit", local_condor])
+        queued = [(args.dataset, n) for n in job["jobnums"]]
+        ledger.mark_submitted(queued, condor_submit(job["submit_file"]))
+    ledger.close()
 
 
 if __name__ == "__main__":
@@ -180,5 +364,38 @@ if __name__ == "__main__":
         default="2000",
         help="Requested memory (in MB) for the condor job",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Enable recording the processor stages performance (wall time, events and allocated memory)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="Number of input files staged to the job scratch ahead of the file being processed (0 reads the inputs remotely)",
+    )
+    parser.add_argument(
+        "--staged_upload",
+        action="store_true",
+        help="Write the job outputs to the job scratch and then upload them to the output path (with checksum verification)",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        default=0,
+        help="Merge the finished outputs of each dataset as jobs finish, with this fan-in (0 disables merging)",
+    )
+    parser.add_argument(
+        "--sample_fraction",
+        type=float,
+        default=1.0,
+        help="Process only this fraction of the chunks of each dataset, evenly spread (quick studies). Outputs are normalised to the full datasets",
+    )
+    parser.add_argument(
+        "--tune",
+        action="store_true",
+        help="Use the per-dataset memory, workers and chunk size of the campaign resources.json (see analysis/utils/resource_tuner.py)",
+    )
     args = parser.parse_args()
     submit_condor(args)